@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+import random
+from bisect import bisect
+from datetime import datetime, timedelta
+
+
+# fix path nonsense: https://stackoverflow.com/a/6466139
+if __name__ == '__main__' and __package__ is None:
+  from sys import path
+  from os.path import dirname as dir
+  path.append(dir(path[0]))
+  __package__ = 'benchmarks'
+
+
+from tensor_parser.csv_parser import open_file
+
+
+# dates are drawn relative to this day
+BASE_DATE = datetime(2000, 1, 1)
+
+
+class zipf_sampler:
+  """ Draw integers in [0, n) with probability proportional to 1/(i+1)^skew.
+
+  A skew of 0 is uniform.
+  """
+
+  def __init__(self, n, skew, rng):
+    self._rng = rng
+    self._n = n
+    self._cdf = None
+    if skew > 0:
+      total = 0.
+      self._cdf = []
+      for i in range(n):
+        total += 1. / (i + 1) ** skew
+        self._cdf.append(total)
+
+  def __call__(self):
+    if self._cdf is None:
+      return self._rng.randrange(self._n)
+    return min(bisect(self._cdf, self._rng.random() * self._cdf[-1]),
+        self._n - 1)
+
+
+def make_columns(num_columns, cardinality=1000, skew=0., date_format=None):
+  """ Return a list of column specifications for `generate_csv()`.
+
+  Args:
+    num_columns (int): The number of (key) columns.
+    cardinality (int or list): The number of distinct keys in each column.
+    skew (float or list): The Zipf exponent of each column (0 is uniform).
+    date_format (str or list): A `strftime()` format for date columns, or None
+                               for integer-like string keys.
+  """
+  def per_column(x):
+    if isinstance(x, (list, tuple)):
+      if len(x) != num_columns:
+        raise ValueError('ERROR: expected {} values, got {}.'.format(
+            num_columns, len(x)))
+      return list(x)
+    return [x] * num_columns
+
+  cards = per_column(cardinality)
+  skews = per_column(skew)
+  fmts = per_column(date_format)
+  return [{'name' : 'c{}'.format(c+1), 'cardinality' : cards[c],
+      'skew' : skews[c], 'date_format' : fmts[c]} for c in range(num_columns)]
+
+
+def _format_key(column, key):
+  if column['date_format']:
+    return (BASE_DATE + timedelta(hours=key)).strftime(column['date_format'])
+  return 'k{}'.format(key)
+
+
+def generate_rows(num_rows, columns, dup_rate=0., seed=0):
+  """ Yield deterministic synthetic rows.
+
+  Each row holds one key per column followed by a value. With probability
+  `dup_rate`, a row repeats the keys of a recent row.
+
+  Args:
+    num_rows (int): The number of rows to generate.
+    columns (list): Column specifications from `make_columns()`.
+    dup_rate (float): The fraction of rows that duplicate an earlier row.
+    seed (int): The random seed.
+  """
+  rng = random.Random(seed)
+  samplers = [zipf_sampler(c['cardinality'], c['skew'], rng) for c in columns]
+  recent = []
+  for r in range(num_rows):
+    if recent and rng.random() < dup_rate:
+      keys = recent[rng.randrange(len(recent))]
+    else:
+      keys = [_format_key(c, s()) for c, s in zip(columns, samplers)]
+      if len(recent) < 1024:
+        recent.append(keys)
+      else:
+        recent[rng.randrange(1024)] = keys
+    yield keys + ['{:0.2f}'.format(rng.random() * 100)]
+
+
+def generate_csv(fname, num_rows, columns, dup_rate=0., seed=0, delimiter=','):
+  """ Write a synthetic CSV file with a header row.
+
+  The file is compressed if `fname` ends in `.gz` or `.bz2`.
+
+  Args:
+    fname (str): The output file.
+    num_rows (int): The number of rows to generate.
+    columns (list): Column specifications from `make_columns()`.
+    dup_rate (float): The fraction of rows that duplicate an earlier row.
+    seed (int): The random seed.
+    delimiter (str): The field separator.
+  """
+  with open_file(fname, 'w') as fout:
+    header = [c['name'] for c in columns] + ['val']
+    print(delimiter.join(header), file=fout)
+    for row in generate_rows(num_rows, columns, dup_rate, seed):
+      print(delimiter.join(row), file=fout)
+
+
+def list_arg(text, conv):
+  """ Parse a comma-separated per-column argument, as a single value if it
+  has one and as a list otherwise (see `make_columns()`).
+  """
+  vals = [conv(x) for x in text.split(',')]
+  return vals[0] if len(vals) == 1 else vals
+
+
+def date_formats(fmts):
+  """ Return the `date_format` of `make_columns()` from the values of
+  repeated `--date-format` arguments, where 'none' is a non-date column.
+  """
+  if not fmts:
+    return None
+  if len(fmts) == 1:
+    return fmts[0]
+  return [None if f == 'none' else f for f in fmts]
+
+
+def parse_args(cmd_args=None):
+  parser = argparse.ArgumentParser(
+      description='Generate a deterministic synthetic CSV file.')
+  parser.add_argument('csv', type=str,
+      help='output CSV file (.gz and .bz2 are compressed)')
+  parser.add_argument('-n', '--rows', type=int, default=100000,
+      help='number of rows (default: 100000)')
+  parser.add_argument('-c', '--columns', type=int, default=3,
+      help='number of key columns (default: 3)')
+  parser.add_argument('--cardinality', type=str, default='1000',
+      metavar='N[,N,...]', help='distinct keys per column (default: 1000)')
+  parser.add_argument('--skew', type=str, default='0',
+      metavar='S[,S,...]', help='Zipf exponent per column (default: 0)')
+  parser.add_argument('--date-format', type=str, action='append',
+      metavar='FMT', help='strftime format for date columns, one per column')
+  parser.add_argument('--dup-rate', type=float, default=0.,
+      help='fraction of duplicate rows (default: 0)')
+  parser.add_argument('-F', '--field-sep', type=str, default=',',
+      help='field separator (default: ",")')
+  parser.add_argument('--seed', type=int, default=0,
+      help='random seed (default: 0)')
+  return parser.parse_args(cmd_args)
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  columns = make_columns(args.columns,
+      cardinality=list_arg(args.cardinality, int),
+      skew=list_arg(args.skew, float),
+      date_format=date_formats(args.date_format))
+  generate_csv(args.csv, args.rows, columns, dup_rate=args.dup_rate,
+      seed=args.seed, delimiter=args.field_sep)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+import os, sys
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import redirect_stderr
+
+
+# fix path nonsense: https://stackoverflow.com/a/6466139
+if __name__ == '__main__' and __package__ is None:
+  from sys import path
+  from os.path import dirname as dir
+  path.append(dir(path[0]))
+  __package__ = 'benchmarks'
+
+
+from benchmarks.gen_csv import make_columns, generate_csv, list_arg, \
+    date_formats
+from tensor_parser.csv_parser import csv_parser
+from tensor_parser.index_map import index_map
+from tensor_parser.tensor_config import tensor_config
+from tensor_parser import builder
+
+
+# the command-line entry point, for startup benchmarks
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'scripts', 'build_tensor.py')
+
+
+#
+# Timing harness
+#
+def measure(name, items, func, setup=None, memory=True, repeat=1):
+  """ Time `func()` and optionally record its peak traced memory.
+
+  The timed runs are never traced, so tracing does not affect throughput. The
+  fastest of `repeat` runs is reported. Peak memory comes from an additional,
+  traced run.
+
+  Args:
+    name (str): The name of the benchmark.
+    items (int): The number of items (rows, keys, ...) processed by `func`.
+    func (func): The work to benchmark.
+    setup (func): Called before each run of `func`.
+    memory (bool): Whether to measure peak memory.
+    repeat (int): The number of timed runs.
+  """
+  seconds = None
+  for _ in range(repeat):
+    if setup:
+      setup()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    if seconds is None or elapsed < seconds:
+      seconds = elapsed
+
+  peak = None
+  if memory:
+    if setup:
+      setup()
+    tracemalloc.start()
+    try:
+      func()
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+
+  return OrderedDict([
+    ('name', name),
+    ('items', items),
+    ('seconds', seconds),
+    ('items_per_sec', items / seconds if seconds > 0 else 0.),
+    ('peak_memory', peak),
+  ])
+
+
+#
+# Benchmarks. Each takes the benchmark directory and the parsed arguments and
+# returns a list of results from `measure()`.
+#
+def bench_csv_rows(workdir, args):
+  results = []
+  for ext in args.compression:
+    fname = os.path.join(workdir, 'input.csv' + ext)
+    parser = csv_parser(fname)
+    def run():
+      for row in parser.rows():
+        pass
+    results.append(measure('csv_parser.rows' + ext, args.rows, run,
+        memory=args.memory, repeat=args.repeat))
+  return results
+
+
+def bench_index_map(workdir, args):
+  parser = csv_parser(os.path.join(workdir, 'input.csv'))
+  keys = [row[0] for row in parser.rows()]
+  imap = [None]
+
+  def fresh():
+    imap[0] = index_map()
+  def add():
+    for key in keys:
+      imap[0].add(key)
+  def filled():
+    fresh()
+    add()
+  def lookup():
+    for key in keys:
+      imap[0][key]
+
+  results = [measure('index_map.add', len(keys), add, setup=fresh,
+      memory=args.memory, repeat=args.repeat)]
+  results.append(measure('index_map.build_map', len(keys),
+      lambda : imap[0].build_map(), setup=filled, memory=args.memory,
+      repeat=args.repeat))
+  results.append(measure('index_map.__getitem__', len(keys), lookup,
+      setup=lambda : (filled(), imap[0].build_map()), memory=args.memory,
+      repeat=args.repeat))
+  return results
+
+
+def bench_merge_dups(workdir, args):
+  tns = os.path.join(workdir, 'merge.tns')
+  parser = csv_parser(os.path.join(workdir, 'input.csv'))
+  maps = [dict() for _ in range(args.columns)]
+  lines = []
+  for row in parser.rows():
+    inds = [str(maps[m].setdefault(row[m], len(maps[m]) + 1))
+        for m in range(args.columns)]
+    lines.append('{} {}'.format(' '.join(inds), row[-1]))
+
+  def write():
+    with open(tns, 'w') as fout:
+      for line in lines:
+        print(line, file=fout)
+  return [measure('merge_dups', len(lines),
+      lambda : builder.merge_dups(tns, args.columns), setup=write,
+      memory=args.memory, repeat=args.repeat)]
+
+
+def bench_build_tensor(workdir, args):
+  results = []
+  for ext in args.compression:
+    fname = os.path.abspath(os.path.join(workdir, 'input.csv' + ext))
+    config = tensor_config(csv_names=[fname], tensor_name='bench.tns')
+    for c in range(args.columns):
+      config.add_mode('c{}'.format(c+1))
+    config.set_vals('val')
+
+    def run():
+      cwd = os.getcwd()
+      os.chdir(workdir)
+      try:
+        builder.build_tensor(config)
+      finally:
+        os.chdir(cwd)
+    results.append(measure('build_tensor' + ext, args.rows, run,
+        memory=args.memory, repeat=args.repeat))
+
+    # the same build with a pipelined emit pass
+    config.set_pipeline(4)
+    results.append(measure('build_tensor_pipeline' + ext, args.rows, run,
+        memory=args.memory, repeat=args.repeat))
+    config.set_pipeline(None)
+  return results
+
+
+def import_times(report):
+  """ Parse the report of `python -X importtime`.
+
+  Returns:
+    A dictionary of the cumulative microseconds of each top-level import, in
+    order of import.
+  """
+  times = OrderedDict()
+  for line in report.splitlines():
+    if not line.startswith('import time:'):
+      continue
+    fields = line[len('import time:'):].split('|')
+    if len(fields) != 3 or not fields[1].strip().isdigit():
+      continue # the header
+    name = fields[2][1:].rstrip()
+    if not name.startswith(' '):
+      times[name] = int(fields[1])
+  return times
+
+
+def bench_startup(workdir, args):
+  """ Time launches of the command line which exit early (`--help` and
+  `--query`), whose cost is mostly imports. Items are launches, and the
+  seconds spent importing and the slowest top-level imports are reported.
+  """
+  fname = os.path.join(workdir, 'input.csv')
+  commands = OrderedDict([
+    ('help', ['--help']),
+    ('query', [fname, os.path.join(workdir, 'query.tns'), '--query']),
+  ])
+
+  results = []
+  for name, cmd_args in commands.items():
+    cmd = [sys.executable, '-X', 'importtime', SCRIPT] + cmd_args
+    report = [None]
+    def run():
+      report[0] = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+          stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    result = measure('startup.' + name, 1, run, memory=False,
+        repeat=args.repeat)
+    times = import_times(report[0])
+    result['import_seconds'] = sum(times.values()) / 1e6
+    result['slowest_imports'] = sorted(times.items(),
+        key=lambda x : -x[1])[:5]
+    results.append(result)
+  return results
+
+
+BENCHMARKS = OrderedDict([
+  ('csv_rows', bench_csv_rows),
+  ('index_map', bench_index_map),
+  ('merge_dups', bench_merge_dups),
+  ('build_tensor', bench_build_tensor),
+  ('startup', bench_startup),
+])
+
+
+#
+# Baselines
+#
+def compare(results, baseline, tolerance):
+  """ Compare throughput against a baseline.
+
+  Returns:
+    A list of (name, ratio) for the benchmarks whose throughput dropped by
+    more than `tolerance` (e.g., 0.1 for 10%). `ratio` is current/baseline.
+  """
+  base = {r['name'] : r for r in baseline['results']}
+  regressions = []
+  for r in results['results']:
+    if r['name'] not in base or base[r['name']]['items_per_sec'] <= 0:
+      continue
+    ratio = r['items_per_sec'] / base[r['name']]['items_per_sec']
+    print('{:<28} {:>14.0f} items/s  ({:0.2f}x baseline)'.format(r['name'],
+        r['items_per_sec'], ratio))
+    if ratio < 1. - tolerance:
+      regressions.append((r['name'], ratio))
+  return regressions
+
+
+def parse_args(cmd_args=None):
+  parser = argparse.ArgumentParser(
+      description='Benchmark tensor_parser on synthetic CSV data.')
+  parser.add_argument('-n', '--rows', type=int, default=100000,
+      help='number of rows (default: 100000)')
+  parser.add_argument('-c', '--columns', type=int, default=3,
+      help='number of key columns (default: 3)')
+  parser.add_argument('--cardinality', type=str, default='1000',
+      metavar='N[,N,...]', help='distinct keys per column (default: 1000)')
+  parser.add_argument('--skew', type=str, default='1',
+      metavar='S[,S,...]', help='Zipf exponent per column (default: 1)')
+  parser.add_argument('--date-format', type=str, action='append',
+      metavar='FMT', help='strftime format for date columns, one per column '
+      '("none" for a non-date column)')
+  parser.add_argument('--dup-rate', type=float, default=0.1,
+      help='fraction of duplicate rows (default: 0.1)')
+  parser.add_argument('--seed', type=int, default=0,
+      help='random seed (default: 0)')
+  parser.add_argument('--compression', type=str, action='append',
+      choices=['none', 'gz', 'bz2'],
+      help='input compression to benchmark (default: none)')
+  parser.add_argument('-b', '--bench', type=str, action='append',
+      choices=list(BENCHMARKS.keys()),
+      help='benchmarks to run (default: all)')
+  parser.add_argument('-r', '--repeat', type=int, default=3,
+      help='timed runs per benchmark, the fastest is kept (default: 3)')
+  parser.add_argument('--no-memory', dest='memory', action='store_false',
+      help='skip peak memory measurements')
+  parser.add_argument('-o', '--output', type=str,
+      help='write results to OUTPUT as JSON')
+  parser.add_argument('--baseline', type=str,
+      help='compare throughput against a saved results file')
+  parser.add_argument('--tolerance', type=float, default=0.1,
+      help='allowed throughput drop vs. baseline (default: 0.1)')
+  args = parser.parse_args(cmd_args)
+
+  args.cardinality = list_arg(args.cardinality, int)
+  args.skew = list_arg(args.skew, float)
+  args.date_format = date_formats(args.date_format)
+  try:
+    make_columns(args.columns, cardinality=args.cardinality, skew=args.skew,
+        date_format=args.date_format)
+  except ValueError as err:
+    print(err, file=sys.stderr)
+    sys.exit(1)
+  if not args.compression:
+    args.compression = ['none']
+  args.compression = ['' if c == 'none' else '.' + c for c in args.compression]
+  if not args.bench:
+    args.bench = list(BENCHMARKS.keys())
+  return args
+
+
+def run(args):
+  """ Generate inputs and run the selected benchmarks.
+
+  Returns:
+    A JSON-serializable dictionary of the configuration and results.
+  """
+  columns = make_columns(args.columns, cardinality=args.cardinality,
+      skew=args.skew, date_format=args.date_format)
+  results = OrderedDict([('config', OrderedDict([
+    ('rows', args.rows),
+    ('columns', args.columns),
+    ('cardinality', args.cardinality),
+    ('skew', args.skew),
+    ('date_format', args.date_format),
+    ('dup_rate', args.dup_rate),
+    ('seed', args.seed),
+  ])), ('results', [])])
+
+  with tempfile.TemporaryDirectory() as workdir:
+    for ext in set(args.compression + ['']):
+      generate_csv(os.path.join(workdir, 'input.csv' + ext), args.rows,
+          columns, dup_rate=args.dup_rate, seed=args.seed)
+
+    with open(os.devnull, 'w') as redirect:
+      for name in args.bench:
+        with redirect_stderr(redirect):
+          bench_results = BENCHMARKS[name](workdir, args)
+        for r in bench_results:
+          print('{:<28} {:>10.3f}s {:>14.0f} items/s'.format(r['name'],
+              r['seconds'], r['items_per_sec']))
+        results['results'] += bench_results
+  return results
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  results = run(args)
+
+  if args.output:
+    with open(args.output, 'w') as fout:
+      json.dump(results, fout, indent=2)
+      print('', file=fout)
+
+  if args.baseline:
+    with open(args.baseline, 'r') as fin:
+      baseline = json.load(fin)
+    print('\nComparison against {}:'.format(args.baseline))
+    regressions = compare(results, baseline, args.tolerance)
+    for name, ratio in regressions:
+      print('REGRESSION: {} is at {:0.2f}x of baseline'.format(name, ratio),
+          file=sys.stderr)
+    if regressions:
+      sys.exit(1)
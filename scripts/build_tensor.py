@@ -2,15 +2,8 @@
 
 import os, sys
 import argparse
-import pprint
 import re
 
-from functools import partial
-
-# Make these available to eval() for user-defined types.
-import datetime
-from dateutil import parser as date_parser
-
 
 # fix path nonsense: https://stackoverflow.com/a/6466139
 if __name__ == '__main__' and __package__ is None:
@@ -20,24 +13,52 @@ if __name__ == '__main__' and __package__ is None:
   __package__ = 'scripts'
 
 
-from tensor_parser.index_map import index_map
+# batch_type is also available to eval() for user-defined types
+from tensor_parser.index_map import index_map, batch_type, round_float, \
+    epoch_bucket
 from tensor_parser.tensor_config import tensor_config
-from tensor_parser.csv_parser import csv_parser
-from tensor_parser.builder import build_tensor
+from tensor_parser.csv_parser import csv_parser, BAD_ROW_POLICIES, \
+    BAD_ROWS_ABORT, BAD_ROWS_QUARANTINE
+from tensor_parser.memory import parse_size
+
+# The builder, daemon, queries, and the modules available to custom types are
+# imported where they are first needed, to keep `--help` and `--query` fast.
 
 
 #
 # Helper functions
 #
-def roundf(ndigits):
-  """ Returns a function that rounds floats with `ndigits` of precision. """
-  def _roundf(ndigits, flt):
-    return round(float(flt), ndigits)
-  return partial(_roundf, ndigits)
+def _type_globals():
+  """ Return the globals of custom types: those of this module, plus the
+  `datetime` and `date_parser` modules.
+  """
+  import datetime
+  from dateutil import parser as date_parser
+  namespace = dict(globals())
+  namespace['datetime'] = datetime
+  namespace['date_parser'] = date_parser
+  return namespace
+
+
+def compile_type(text_func):
+  """ Compile and evaluate the source of a custom type.
+
+  Exits with an error if `text_func` is not a valid expression.
+  """
+  try:
+    code = compile(text_func, '<type>', 'eval')
+  except SyntaxError as e:
+    print('ERROR: invalid type "{}": {}'.format(text_func, e.msg),
+        file=sys.stderr)
+    sys.exit(1)
+  return eval(code, _type_globals())
 
 
 def parse_types(cmd_args, config):
   """ Set mode types. Each --type flag gives us a string of field,field,..,func
+
+  Each distinct custom type is compiled once, so that fields given the same
+  type share one type function.
   """
   builtin_funcs = {
     # index_map builtins
@@ -51,7 +72,16 @@ def parse_types(cmd_args, config):
     'hour'  : index_map.TYPE_DATE_HOUR,
     'min'   : index_map.TYPE_DATE_MIN,
     'sec'   : index_map.TYPE_DATE_SEC,
+    'epoch'    : index_map.TYPE_EPOCH,
+    'epoch_ms' : index_map.TYPE_EPOCH_MS,
+    'dow'      : index_map.TYPE_DOW,
+  }
+  # parametrized builtins, e.g., "bucket-3600"
+  builtin_factories = {
+    'roundf' : round_float,
+    'bucket' : epoch_bucket,
   }
+  compiled = dict()
   for f in cmd_args:
     f = f.split(',')
     text_func = f[-1]
@@ -68,7 +98,18 @@ def parse_types(cmd_args, config):
         func_name = match.group('func_name')
         func_args = match.group('func_args')
         text_func = '{}({})'.format(func_name, func_args)
-      func = eval(text_func)
+      if text_func not in compiled:
+        if match and func_name in builtin_factories:
+          try:
+            args = [int(a) for a in func_args.split(',')]
+            compiled[text_func] = builtin_factories[func_name](*args)
+          except (TypeError, ValueError) as e:
+            print('ERROR: invalid type "{}": {}'.format(f[-1], e),
+                file=sys.stderr)
+            sys.exit(1)
+        else:
+          compiled[text_func] = compile_type(text_func)
+      func = compiled[text_func]
 
     for field in f[:-1]:
       print('field "{}" -> type "{}"'.format(field, text_func))
@@ -76,6 +117,29 @@ def parse_types(cmd_args, config):
 
 
 
+def parse_filters(where, where_range, config):
+  """ Add row filters. Each --where flag gives us field=val,val,.. and each
+  --where-range flag gives us field=low,high.
+  """
+  for f in (where or []):
+    field, vals = f.split('=', 1)
+    vals = vals.split(',')
+    if len(vals) == 1:
+      config.add_filter(field, tensor_config.FILTER_EQ, vals[0])
+    else:
+      config.add_filter(field, tensor_config.FILTER_IN, vals)
+
+  for f in (where_range or []):
+    field, bounds = f.split('=', 1)
+    bounds = bounds.split(',')
+    if len(bounds) != 2:
+      print('ERROR: --where-range expects FIELD=LOW,HIGH', file=sys.stderr)
+      sys.exit(1)
+    low, high = [b if b != '' else None for b in bounds]
+    config.add_filter(field, tensor_config.FILTER_RANGE, (low, high))
+
+
+
 def parse_args(cmd_args=None):
   my_description = '''
     Construct a tensor from CSV-like files. The files can either be in plain
@@ -111,6 +175,10 @@ def parse_args(cmd_args=None):
         hour     => extract hour from date
         min      => extract minute from date
         sec      => extract second from date
+        epoch    => Unix timestamp in seconds
+        epoch_ms => Unix timestamp in milliseconds
+        bucket-N => truncate a Unix timestamp (seconds) to N-second intervals
+        dow      => day of the week of a Unix timestamp (seconds)
 
     ADVANCED: if the provided field is not in the above list, it is interpreted
     as a custom type and converted to source code. See README.md for details.
@@ -122,9 +190,9 @@ def parse_args(cmd_args=None):
   # Required positional arguments
   #
   parser.add_argument('csv', type=str, nargs='+',
-      help='CSV files to parse')
+      help='CSV files to parse ("-" reads from stdin)')
   parser.add_argument('tensor', type=str,
-      help='output tensor file (.tns)')
+      help='output tensor file (.tns), or directory of deltas with --serve-*')
 
   #
   # Adding and modifying tensor modes
@@ -136,6 +204,9 @@ def parse_args(cmd_args=None):
 
   parser.add_argument('--no-sort', type=str, metavar='FIELD', action='append',
       help="do not sort FIELD")
+  parser.add_argument('--sort-count', type=str, metavar='FIELD',
+      action='append',
+      help="order FIELD by decreasing count (densest slices first)")
   parser.add_argument('-t', '--type', type=str, metavar='FIELDS,TYPE',
       action='append', help="treat FIELDs as type TYPE. See --help for details")
 
@@ -149,6 +220,104 @@ def parse_args(cmd_args=None):
 
   parser.add_argument('-q', '--query', action='store_true',
       help='query metadata of the CSV file and exit')
+  parser.add_argument('--query-stats', action='store_true',
+      help='also scan the CSV file for per-column statistics and estimate\n'
+           'the size of a tensor built from the given --field set')
+  parser.add_argument('--query-sample', type=float, default=1.0,
+      metavar='FRACTION',
+      help='fraction of rows to scan with --query-stats (default: 1.0)')
+  parser.add_argument('--top-k', type=int, default=10,
+      help='frequent values to report with --query-stats (default: 10)')
+
+  parser.add_argument('--mode-order', type=str, metavar='FIELD,FIELD,...',
+      help='sort non-zeros lexicographically by this permutation of fields')
+  parser.add_argument('--csf', type=str, metavar='FILE',
+      help='also write the tensor as binary CSF to FILE')
+  parser.add_argument('--slices', type=str, metavar='FILE',
+      help='also write the non-zeros of each slice of each mode and a\n'
+           'balanced partition of each mode to FILE (binary)')
+  parser.add_argument('--slice-parts', type=int, default=1, metavar='P',
+      help='the number of parts of each mode for --slices (default: 1)')
+  parser.add_argument('--output-dir', type=str, metavar='DIR',
+      help='write the maps into DIR and take relative tensor, --csf,\n'
+           '--slices, and --stats names relative to DIR')
+  parser.add_argument('--temp-dir', type=str, metavar='DIR',
+      help='create temporary files (sorted splits, spools) in DIR')
+  parser.add_argument('--memory-limit', type=str, metavar='SIZE',
+      help='keep the memory accounted by the build within SIZE (e.g.,\n'
+           '512M or 4G) by spilling pruned rows and shrinking sort\n'
+           'splits and buffers; decisions are reported')
+
+  parser.add_argument('--dry-run', type=float, metavar='FRACTION', nargs='?',
+      const=0.01,
+      help='estimate the tensor size and build cost from a sample of\n'
+           'FRACTION of the rows and exit (default: 0.01)')
+  parser.add_argument('--stats', type=str, metavar='FILE',
+      help='write per-phase timings and tensor statistics to FILE as JSON')
+
+  parser.add_argument('--progress', type=float, metavar='SECONDS', nargs='?',
+      const=5.0,
+      help='report progress to stderr every SECONDS (default: 5)')
+
+  parser.add_argument('--pipeline', type=int, metavar='DEPTH', nargs='?',
+      const=4,
+      help='emit with threads for reading, parsing, mapping, and writing,\n'
+           'connected by queues of DEPTH batches (default: 4)')
+
+  parser.add_argument('--profile', type=str, metavar='DIR',
+      help='profile each build phase with cProfile into DIR/<phase>.pstats')
+  parser.add_argument('--trace-memory', action='store_true',
+      help='report traced memory, peak RSS, and top allocations per phase')
+
+  parser.add_argument('-w', '--where', type=str, metavar='FIELD=VAL[,VAL...]',
+      action='append',
+      help='only use rows whose FIELD is one of the VALs')
+  parser.add_argument('--where-range', type=str, metavar='FIELD=LOW,HIGH',
+      action='append',
+      help='only use rows with LOW <= FIELD <= HIGH (either may be empty)')
+  parser.add_argument('--bad-rows', type=str, metavar='POLICY',
+      choices=BAD_ROW_POLICIES,
+      help='what to do with rows that cannot be parsed or have a different\n'
+           'number of fields than the header: abort (default), skip,\n'
+           'count (skip and report the first few), or quarantine')
+  parser.add_argument('--quarantine', type=str, metavar='FILE',
+      help='append bad rows to the CSV FILE (implies --bad-rows=quarantine)')
+
+  parser.add_argument('--min-count', type=int, default=1, metavar='K',
+      help='iteratively remove keys with fewer than K non-zeros (default: 1)')
+  parser.add_argument('--prune-spill', type=str, metavar='DIR',
+      help='keep pruning data for --min-count in memory-mapped files in DIR')
+
+  sample = parser.add_mutually_exclusive_group()
+  sample.add_argument('--sample-rate', type=float, metavar='P',
+      help='build from a random sample of rows, each kept with probability P')
+  sample.add_argument('--sample-rows', type=int, metavar='N',
+      help='build from a uniform random sample of N rows')
+  parser.add_argument('--sample-seed', type=int, default=0, metavar='SEED',
+      help='random seed for --sample-rate/--sample-rows (default: 0)')
+  parser.add_argument('--sample-by', type=str, metavar='FIELD',
+      help='keep at least one sampled row for each key of FIELD')
+
+  parser.add_argument('--cache', type=str, metavar='DIR',
+      help='restore unchanged builds from (and store builds in) DIR')
+  parser.add_argument('--cache-hash', action='store_true',
+      help='identify cached inputs by content hash instead of size/mtime')
+
+  parser.add_argument('--checkpoint', type=str, metavar='DIR',
+      help='record progress in DIR after each input and phase')
+  parser.add_argument('--resume', action='store_true',
+      help='continue a failed build from its --checkpoint')
+
+  serve_group = parser.add_mutually_exclusive_group()
+  serve_group.add_argument('--serve-socket', type=str, metavar='PATH',
+      help='run as a daemon building a delta tensor in the output\n'
+           'directory for each batch of inputs sent to the UNIX socket PATH')
+  serve_group.add_argument('--serve-spool', type=str, metavar='DIR',
+      help='run as a daemon building a delta tensor in the output\n'
+           'directory for each batch of files moved into DIR')
+  parser.add_argument('--serve-poll', type=float, default=1.0,
+      metavar='SECONDS',
+      help='seconds between scans of --serve-spool (default: 1)')
 
   parser.add_argument('--merge', type=str, default='sum',
       choices=['none', 'sum', 'min', 'max', 'avg', 'count'],
@@ -172,11 +341,18 @@ def parse_args(cmd_args=None):
       args.has_header = False
 
   # Check for file query
-  if args.query:
-    parser = csv_parser(args.csv[0])
+  if args.query or args.query_stats:
+    parser = csv_parser(args.csv[0], args.field_sep, args.has_header)
     print('Found delimiter: "{}"'.format(parser.get_delimiter()))
     print('Found fields:')
+    import pprint
     pprint.pprint(parser.get_header())
+    if args.query_stats:
+      from tensor_parser.query import scan_columns, print_scan
+      print('')
+      # reuse the parser: a stream cannot be opened twice
+      print_scan(scan_columns(parser, fields=args.field,
+          sample=args.query_sample, top_k=args.top_k))
     sys.exit(0)
 
 
@@ -186,6 +362,8 @@ def parse_args(cmd_args=None):
     args.field = []
   if not args.no_sort:
     args.no_sort = []
+  if not args.sort_count:
+    args.sort_count = []
   if not args.type:
     args.type = []
 
@@ -199,6 +377,8 @@ def parse_args(cmd_args=None):
 
   for f in cmd_args.no_sort:
     config.set_mode_sort(f, False)
+  for f in cmd_args.sort_count:
+    config.set_mode_sort(f, index_map.SORT_COUNT)
 
   merge_funcs = {
     'none' : tensor_config.MERGE_NONE,
@@ -213,13 +393,83 @@ def parse_args(cmd_args=None):
 
   parse_types(cmd_args.type, config)
 
+  if args.mode_order:
+    config.set_mode_order(args.mode_order.split(','))
+  config.set_csf(args.csf)
+  if args.slice_parts < 1:
+    print('ERROR: --slice-parts must be positive', file=sys.stderr)
+    sys.exit(1)
+  config.set_slices(args.slices, args.slice_parts)
+  config.set_stats_file(args.stats)
+  config.set_output_dir(args.output_dir)
+  config.set_temp_dir(args.temp_dir)
+  if args.memory_limit:
+    try:
+      config.set_memory_limit(parse_size(args.memory_limit))
+    except ValueError as e:
+      print(e, file=sys.stderr)
+      sys.exit(1)
+  config.set_dry_run(args.dry_run)
+  config.set_profile_dir(args.profile)
+  config.set_pipeline(args.pipeline)
+  config.set_trace_memory(args.trace_memory)
+  if args.progress is not None:
+    from tensor_parser.progress import progress_reporter
+    config.set_progress(progress_reporter(interval=args.progress))
+
   config.set_vals(cmd_args.vals)
 
+  parse_filters(args.where, args.where_range, config)
+  config.set_min_count(args.min_count, args.prune_spill)
+  if args.quarantine and args.bad_rows is None:
+    args.bad_rows = BAD_ROWS_QUARANTINE
+  try:
+    config.set_bad_rows(args.bad_rows or BAD_ROWS_ABORT, args.quarantine)
+  except ValueError as e:
+    print(e, file=sys.stderr)
+    sys.exit(1)
+  config.set_cache(args.cache, args.cache_hash)
+
+  if args.sample_by and args.sample_rate is None and args.sample_rows is None:
+    print('ERROR: --sample-by requires --sample-rate or --sample-rows',
+        file=sys.stderr)
+    sys.exit(1)
+  if args.sample_by and \
+      args.sample_by.lower() not in [f.lower() for f in args.field]:
+    print('ERROR: --sample-by FIELD must be a --field', file=sys.stderr)
+    sys.exit(1)
+  try:
+    config.set_sample(args.sample_rate, args.sample_rows, args.sample_seed,
+        args.sample_by)
+  except ValueError as e:
+    print(e, file=sys.stderr)
+    sys.exit(1)
+
+  config.set_serve(args.serve_socket, args.serve_spool, args.serve_poll)
+
+  if args.resume and not args.checkpoint:
+    print('ERROR: --resume requires --checkpoint', file=sys.stderr)
+    sys.exit(1)
+  config.set_checkpoint(args.checkpoint, args.resume)
+
   return config
 
 
 if __name__ == '__main__':
   config = parse_args()
-  build_tensor(config)
+  if config.get_serve():
+    from tensor_parser.daemon import serve
+    serve(config)
+    sys.exit(0)
+  from tensor_parser.builder import build_tensor
+  try:
+    stats = build_tensor(config)
+  except ValueError as e:
+    # e.g., a bad row with --bad-rows=abort
+    print(e, file=sys.stderr)
+    sys.exit(1)
+  if config.get_dry_run():
+    from tensor_parser.estimate import print_estimate
+    print_estimate(stats)
 
 
@@ -0,0 +1,255 @@
+
+
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+from functools import partial
+
+from .csv_parser import is_stream
+
+
+# bump when the cached formats change
+CACHE_VERSION = 1
+
+# bytes read at a time when hashing contents
+HASH_BLOCK = 1 << 20
+
+
+def _func_id(func, _seen=()):
+  """ Return a string identifying a type or merge function across runs.
+
+  Named functions are identified by their module and name. Lambdas (and other
+  functions) are identified by a digest of their bytecode, constants, and
+  captured values, and partials and callable objects by their function and
+  arguments or attributes, so that e.g. two `roundf-X` types with different X
+  differ.
+  """
+  if func is None:
+    return None
+  if id(func) in _seen:
+    # e.g., a recursive function
+    return 'cycle'
+  _seen += (id(func),)
+  if isinstance(func, partial):
+    return 'partial({}, {}, {})'.format(_func_id(func.func, _seen),
+        [_cell_id(a, _seen) for a in func.args],
+        sorted((k, _cell_id(v, _seen)) for k, v in func.keywords.items()))
+  if not hasattr(func, '__qualname__') and hasattr(func, '__dict__'):
+    # a callable object, e.g., a parametrized builtin type
+    cls = type(func)
+    return '{}.{}({})'.format(cls.__module__, cls.__qualname__,
+        sorted((k, _cell_id(v, _seen)) for k, v in vars(func).items()))
+  name = '{}.{}'.format(getattr(func, '__module__', ''),
+      getattr(func, '__qualname__', repr(func)))
+  code = getattr(func, '__code__', None)
+  if code is None:
+    return name
+  h = hashlib.blake2b(digest_size=16)
+  h.update(code.co_code)
+  h.update(repr(code.co_consts).encode())
+  h.update(repr(code.co_names).encode())
+  h.update(repr(func.__defaults__).encode())
+  for cell in func.__closure__ or ():
+    h.update(_cell_id(cell.cell_contents, _seen).encode())
+  return '{}:{}'.format(name, h.hexdigest())
+
+
+def _cell_id(value, _seen=()):
+  """ Identify a value captured by a function, recursing into functions
+  (whose `repr()` includes their address).
+  """
+  if callable(value) and not isinstance(value, type):
+    return _func_id(value, _seen)
+  return repr(value)
+
+
+def _modes(config):
+  return [config.get_mode_by_idx(m) for m in range(config.num_modes())]
+
+
+def _digest(obj):
+  """ Return the hex digest of a canonical JSON serialization of `obj`. """
+  text = json.dumps(obj, sort_keys=True, default=repr)
+  return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+
+def input_id(fname, hash_contents=False):
+  """ Return the identity of an input file: its path, size, and modification
+  time (or a hash of its contents).
+  """
+  st = os.stat(fname)
+  ident = [os.path.abspath(fname), st.st_size]
+  if hash_contents:
+    h = hashlib.blake2b(digest_size=20)
+    with open(fname, 'rb') as fin:
+      for block in iter(lambda: fin.read(HASH_BLOCK), b''):
+        h.update(block)
+    ident.append(h.hexdigest())
+  else:
+    ident.append(st.st_mtime_ns)
+  return ident
+
+
+def _count_settings(config):
+  """ The settings which affect the key counts of a single input. """
+  return {
+    'version' : CACHE_VERSION,
+    'delimiter' : config.get_delimiter(),
+    'header' : config.has_header(),
+    'modes' : [[m['field'].lower(), _func_id(m['type'])]
+        for m in _modes(config)],
+    'filters' : [[f['field'].lower(), f['op'], f['value']]
+        for f in config.get_filters()],
+    'bad_rows' : config.get_bad_rows(),
+  }
+
+
+def config_digest(config, input_ids):
+  """ Return a digest of the identities of the inputs and a canonical
+  serialization of every setting of `config` which affects the outputs.
+  """
+  settings = _count_settings(config)
+  settings.update({
+    'inputs' : input_ids,
+    'sort' : [m['sort'] for m in _modes(config)],
+    'vals' : config.get_vals(),
+    'merge' : _func_id(config.get_merge_func()),
+    'mode_order' : config.get_mode_order(),
+    'csf' : config.get_csf() is not None,
+    'slices' : config.get_slice_parts() if config.get_slices() else None,
+    'min_count' : config.get_min_count(),
+    'sample' : config.get_sample(),
+  })
+  return _digest(settings)
+
+
+def map_names(config):
+  """ Return the name of the `.map` file written for each mode of `config`,
+  without its output directory.
+  """
+  return [os.path.basename(config.get_map_file(m))
+      for m in range(config.num_modes())]
+
+
+class build_cache:
+  """ A content-addressed cache of build outputs in a directory.
+
+  A build is identified by a fingerprint of its inputs (path, size, and
+  modification time, or a hash of their contents) and a canonical
+  serialization of every `tensor_config` setting which affects the outputs.
+  If a matching entry exists, the tensor, CSF, and map files are restored
+  from it instead of being rebuilt.
+
+  The key counts of each input are cached as well, keyed by the input and
+  the settings used while counting, so that when some inputs change only
+  those are rescanned in the counting pass.
+  """
+
+  def __init__(self, cache_dir, hash_contents=False):
+    """
+    Args:
+      cache_dir (str): The cache directory (created if needed).
+      hash_contents (bool): Identify inputs by a hash of their contents
+                            instead of their size and modification time.
+    """
+    self._dir = cache_dir
+    self._hash_contents = hash_contents
+    self._input_ids = dict()
+    os.makedirs(os.path.join(cache_dir, 'builds'), exist_ok=True)
+    os.makedirs(os.path.join(cache_dir, 'counts'), exist_ok=True)
+
+
+  def input_id(self, fname):
+    """ Return the identity of an input file. """
+    if fname not in self._input_ids:
+      self._input_ids[fname] = input_id(fname, self._hash_contents)
+    return self._input_ids[fname]
+
+
+  def fingerprint(self, config):
+    """ Return the fingerprint of a build, or None if it cannot be cached
+    (i.e., an input is a stream).
+    """
+    if any(is_stream(f) for f in config.get_inputs()):
+      return None
+    return config_digest(config,
+        [self.input_id(f) for f in config.get_inputs()])
+
+
+  def _outputs(self, config):
+    """ Return pairs of (name in the cache entry, output file). """
+    outputs = [('tensor.tns', config.get_output())]
+    if config.get_csf():
+      outputs.append(('tensor.csf', config.get_csf()))
+    if config.get_slices():
+      outputs.append(('tensor.slices', config.get_slices()))
+    if config.get_quarantine():
+      outputs.append(('quarantine.csv', config.get_quarantine()))
+    outputs += [(name, config.get_map_file(m))
+        for m, name in enumerate(map_names(config))]
+    return outputs
+
+
+  def restore(self, config, key):
+    """ Copy the outputs of a cached build to their destinations.
+
+    Returns:
+      The statistics dictionary of the cached build, or None if there is no
+      entry for `key`.
+    """
+    entry = os.path.join(self._dir, 'builds', key)
+    if not os.path.isdir(entry):
+      return None
+    for name, dest in self._outputs(config):
+      shutil.copyfile(os.path.join(entry, name), dest)
+    with open(os.path.join(entry, 'stats.json'), 'r') as fin:
+      return json.load(fin)
+
+
+  def store(self, config, key, stats):
+    """ Add the outputs of a finished build to the cache. """
+    entry = os.path.join(self._dir, 'builds', key)
+    if os.path.isdir(entry):
+      return
+    # populate a temporary entry first so readers never see a partial one
+    tmp = tempfile.mkdtemp(dir=os.path.join(self._dir, 'builds'))
+    try:
+      for name, src in self._outputs(config):
+        shutil.copyfile(src, os.path.join(tmp, name))
+      stats.write_json(os.path.join(tmp, 'stats.json'))
+      os.rename(tmp, entry)
+    finally:
+      if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+
+
+  def _counts_file(self, fname, config):
+    key = _digest([self.input_id(fname), _count_settings(config)])
+    return os.path.join(self._dir, 'counts', key + '.pickle')
+
+
+  def load_counts(self, fname, config):
+    """ Return the cached key counts of an input, or None.
+
+    The counts are a dictionary with the number of rows read ('rows'),
+    rejected ('rejected'), and bad ('bad_rows', see `csv_parser.bad_rows()`)
+    and, for each mode, the counts of converted keys in order of first
+    appearance ('counts') and the skipped keys ('skipped').
+    """
+    try:
+      with open(self._counts_file(fname, config), 'rb') as fin:
+        return pickle.load(fin)
+    except (OSError, EOFError, pickle.UnpicklingError):
+      return None
+
+
+  def store_counts(self, fname, config, record):
+    """ Cache the key counts of an input, as returned by `load_counts()`. """
+    dest = self._counts_file(fname, config)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest))
+    with os.fdopen(fd, 'wb') as fout:
+      pickle.dump(record, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, dest)
@@ -0,0 +1,187 @@
+
+
+import os
+import pickle
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, \
+    wait as wait_futures
+
+from .builder import build_tensor
+
+
+def _run_build(config):
+  return build_tensor(config)
+
+
+class build_manager:
+  """ Run many builds concurrently over a shared, size-limited pool of
+  workers.
+
+  Builds are queued per owner (e.g., per client of a service) and started in
+  round-robin order across owners, so that an owner submitting many builds
+  does not delay the builds of the others. At most `max_workers` builds are
+  handed to the pool at a time; the rest wait in their owner's queue.
+
+  Concurrent builds must not share files: give each config its own output
+  directory (`tensor_config.set_output_dir()`), or distinct output names in
+  different directories. With process workers, configs are pickled, so their
+  types, merge functions, and callbacks must be module-level functions or
+  picklable objects (see `index_map.round_float()`).
+
+  The manager is a context manager which waits for all builds on exit.
+  """
+
+  def __init__(self, max_workers=None, executor='process'):
+    """
+    Args:
+      max_workers (int): The number of builds run at a time (default: the
+                         number of CPUs).
+      executor (str): 'process' to run builds in worker processes, or
+                      'thread' to run them in threads of this process.
+    """
+    if max_workers is None:
+      max_workers = os.cpu_count() or 1
+    if max_workers < 1:
+      raise ValueError('ERROR: max_workers must be positive.')
+    if executor == 'process':
+      self._pool = ProcessPoolExecutor(max_workers=max_workers)
+    elif executor == 'thread':
+      self._pool = ThreadPoolExecutor(max_workers=max_workers)
+    else:
+      raise ValueError('ERROR: unknown executor "{}".'.format(executor))
+
+    self._executor = executor
+    self._max_workers = max_workers
+    self._lock = threading.Lock()
+    self._queues = OrderedDict() # owner -> deque of (config, future)
+    self._owners = deque()       # owners with queued builds, in turn order
+    self._running = 0
+    self._closed = False
+
+
+  def submit(self, config, owner=None):
+    """ Queue a build of `config`.
+
+    Args:
+      config (tensor_config): Configuration for the tensor to construct.
+      owner (hashable): The owner of the build, for fair scheduling.
+
+    Returns:
+      A `concurrent.futures.Future` of the `build_stats` of the build (see
+      `builder.build_tensor()`).
+
+    Raises:
+      ValueError: If the config cannot be sent to a worker process.
+      RuntimeError: If the manager was shut down.
+    """
+    if self._executor == 'process':
+      try:
+        pickle.dumps(config)
+      except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise ValueError('ERROR: config cannot be sent to a worker process '
+            '({}). Use module-level functions for types and callbacks, or '
+            'executor="thread".'.format(e))
+
+    future = Future()
+    with self._lock:
+      if self._closed:
+        raise RuntimeError('ERROR: build_manager was shut down.')
+      queue = self._queues.get(owner)
+      if queue is None:
+        queue = deque()
+        self._queues[owner] = queue
+        self._owners.append(owner)
+      queue.append((config, future))
+      started = self._dispatch()
+    self._watch(started)
+    return future
+
+
+  def _dispatch(self):
+    """ Start queued builds while workers are free. Call with the lock held.
+
+    Returns:
+      The list of `(work, future)` of the started builds, to pass to
+      `_watch()` once the lock is released.
+    """
+    started = []
+    while self._running < self._max_workers and self._owners:
+      owner = self._owners.popleft()
+      queue = self._queues[owner]
+      config, future = queue.popleft()
+      if queue:
+        self._owners.append(owner)
+      else:
+        del self._queues[owner]
+
+      if not future.set_running_or_notify_cancel():
+        continue
+      try:
+        work = self._pool.submit(_run_build, config)
+      except RuntimeError as e:
+        # the pool was shut down without waiting for queued builds
+        future.set_exception(e)
+        continue
+      self._running += 1
+      started.append((work, future))
+    return started
+
+
+  def _watch(self, started):
+    """ Report the results of started builds. Call without the lock: the
+    callback of a build which already finished runs immediately.
+    """
+    for work, future in started:
+      work.add_done_callback(
+          lambda work, future=future: self._finished(work, future))
+
+
+  def _finished(self, work, future):
+    with self._lock:
+      self._running -= 1
+      started = self._dispatch()
+    e = work.exception()
+    if e is not None:
+      future.set_exception(e)
+    else:
+      future.set_result(work.result())
+    self._watch(started)
+
+
+  def pending(self):
+    """ Return the number of queued builds which have not started. """
+    with self._lock:
+      return sum(len(q) for q in self._queues.values())
+
+
+  def shutdown(self, wait=True, cancel_pending=False):
+    """ Stop accepting builds.
+
+    Args:
+      wait (bool): Wait until all started and queued builds finish.
+      cancel_pending (bool): Cancel the builds which have not started.
+    """
+    with self._lock:
+      self._closed = True
+      if cancel_pending:
+        for queue in self._queues.values():
+          for _, future in queue:
+            future.cancel()
+        self._queues.clear()
+        self._owners.clear()
+      waiting = [f for q in self._queues.values() for _, f in q]
+
+    if wait:
+      # queued builds are dispatched as running ones finish
+      wait_futures(waiting)
+    self._pool.shutdown(wait=wait)
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.shutdown(wait=True)
+    return False
@@ -0,0 +1,230 @@
+
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+
+def peak_rss():
+  """ Return the peak resident set size of this process in bytes, or None if
+  it is not available on this platform.
+  """
+  if resource is None:
+    return None
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # macOS reports bytes, others report kilobytes
+  if sys.platform == 'darwin':
+    return rss
+  return rss * 1024
+
+
+class build_stats:
+  """ Timing and size information collected while building a tensor.
+
+  Each phase of the build (e.g., 'count', 'prune', 'build_map', 'emit',
+  'merge_dups', 'write_maps') records its wall-clock time, CPU time, and the
+  number of rows it processed. The builder additionally records the bytes
+  read from each input, per-mode cardinalities and skipped keys, the number
+  of pruned rows, of rows rejected by filters, of bad rows (see
+  `csv_parser.set_bad_rows()`), and of sampled rows (if rows are sampled),
+  and the final number of non-zeros.
+
+  Phases can optionally be profiled with cProfile (one `.pstats` file per
+  phase, accumulated over repeats of the phase) and with tracemalloc, which records the traced and peak memory, the
+  peak RSS, and the top allocation sites at the end of each phase.
+  """
+
+  # number of allocation sites to report per phase
+  TOP_ALLOCATIONS = 10
+
+  def __init__(self, profile_dir=None, trace_memory=False):
+    """
+    Args:
+      profile_dir (str): Directory in which to write `<phase>.pstats` files
+                         (None disables profiling).
+      trace_memory (bool): Whether to trace allocations with tracemalloc.
+    """
+    self._profile_dir = profile_dir
+    self._trace_memory = trace_memory
+    self._started_tracing = False
+    self._profiles = dict() # phase name -> pstats.Stats
+    if profile_dir:
+      os.makedirs(profile_dir, exist_ok=True)
+
+    self.phases = OrderedDict()
+    self.inputs = OrderedDict()
+    self.modes = []
+    self.pruned_rows = 0
+    self.rejected_rows = 0
+    self.sampled_rows = None
+    self.bad_rows = OrderedDict([('short', 0), ('long', 0),
+        ('unparseable', 0)])
+    self.nnz = 0
+    self.cached = False
+    self.memory = None # memory_budget.to_dict() of the build
+
+
+  @contextmanager
+  def phase(self, name):
+    """ Time a phase of the build.
+
+    Yields a dictionary whose 'rows' entry should be set to the number of rows
+    processed by the phase. Repeated phases accumulate.
+
+    Args:
+      name (str): The name of the phase.
+    """
+    record = self.phases.setdefault(name, OrderedDict([('wall', 0.),
+        ('cpu', 0.), ('rows', 0), ('rows_per_sec', 0.)]))
+    profiler = None
+    if self._profile_dir:
+      import cProfile
+      profiler = cProfile.Profile()
+    if self._trace_memory:
+      self._start_tracing()
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if profiler:
+      profiler.enable()
+    try:
+      yield record
+    finally:
+      if profiler:
+        profiler.disable()
+      record['wall'] += time.perf_counter() - wall
+      record['cpu'] += time.process_time() - cpu
+      if record['wall'] > 0:
+        record['rows_per_sec'] = record['rows'] / record['wall']
+
+      if self._trace_memory:
+        record['memory'] = self._memory_report()
+        self._print_memory(name, record['memory'])
+      if profiler:
+        self._dump_profile(name, profiler)
+
+
+  def _dump_profile(self, name, profiler):
+    """ Add a profile of a phase to those of its earlier runs, and rewrite
+    `<phase>.pstats` with the total.
+    """
+    import pstats
+    if name in self._profiles:
+      self._profiles[name].add(profiler)
+    else:
+      self._profiles[name] = pstats.Stats(profiler)
+    self._profiles[name].dump_stats(os.path.join(self._profile_dir,
+        '{}.pstats'.format(name)))
+
+
+  def finish(self):
+    """ Stop any memory tracing started by this object. """
+    if self._started_tracing:
+      tracemalloc.stop()
+      self._started_tracing = False
+
+
+  def _start_tracing(self):
+    if not tracemalloc.is_tracing():
+      tracemalloc.start()
+      self._started_tracing = True
+    # reset_peak() is only available in Python >= 3.9
+    if hasattr(tracemalloc, 'reset_peak'):
+      tracemalloc.reset_peak()
+
+
+  def _memory_report(self):
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+      tracemalloc.Filter(False, tracemalloc.__file__),
+      tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    top = snapshot.statistics('lineno')[:build_stats.TOP_ALLOCATIONS]
+    return OrderedDict([
+      ('traced', current),
+      ('traced_peak', peak),
+      ('rss_peak', peak_rss()),
+      ('top', [str(stat) for stat in top]),
+    ])
+
+
+  def _print_memory(self, name, memory):
+    rss = memory['rss_peak']
+    print('[{}] traced {:0.1f} MB (peak {:0.1f} MB), RSS peak {}'.format(name,
+        memory['traced'] / 1e6, memory['traced_peak'] / 1e6,
+        '{:0.1f} MB'.format(rss / 1e6) if rss is not None else 'unknown'),
+        file=sys.stderr)
+    for stat in memory['top']:
+      print('  {}'.format(stat), file=sys.stderr)
+
+
+  def add_bad_rows(self, counts):
+    """ Add the counts of `csv_parser.bad_rows()` of an input. """
+    for kind, n in counts.items():
+      self.bad_rows[kind] += n
+
+
+  def add_input_read(self, fname, rows=0):
+    """ Record one full pass over an input file.
+
+    Args:
+      fname (str): The input file that was read.
+      rows (int): The number of rows read from the file.
+    """
+    record = self.inputs.setdefault(fname, OrderedDict([('size', 0),
+        ('bytes_read', 0), ('passes', 0), ('rows', 0)]))
+    if os.path.isfile(fname):
+      record['size'] = os.path.getsize(fname)
+      record['bytes_read'] += record['size']
+    record['passes'] += 1
+    if rows:
+      record['rows'] = rows
+
+
+  def add_mode(self, field, imap):
+    """ Record the final state of a mode's `index_map`.
+
+    Args:
+      field (str): The field of the CSV used as the mode.
+      imap (index_map): The mode's index map after `build_map()`.
+    """
+    self.modes.append(OrderedDict([('field', field),
+        ('cardinality', len(imap)), ('skipped_keys', len(imap.skipped))]))
+
+
+  def total_time(self):
+    """ Return the total wall-clock time spent in all phases. """
+    return sum(p['wall'] for p in self.phases.values())
+
+
+  def to_dict(self):
+    """ Return the statistics as a JSON-serializable dictionary. """
+    return OrderedDict([
+      ('phases', self.phases),
+      ('inputs', self.inputs),
+      ('modes', self.modes),
+      ('pruned_rows', self.pruned_rows),
+      ('rejected_rows', self.rejected_rows),
+      ('sampled_rows', self.sampled_rows),
+      ('bad_rows', self.bad_rows),
+      ('nnz', self.nnz),
+      ('cached', self.cached),
+      ('memory', self.memory),
+      ('total_time', self.total_time()),
+    ])
+
+
+  def write_json(self, filename):
+    """ Write the statistics to `filename` as JSON. """
+    with open(filename, 'w') as fout:
+      json.dump(self.to_dict(), fout, indent=2)
+      print('', file=fout)
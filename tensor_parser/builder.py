@@ -1,14 +1,55 @@
 
+import io
 import os
 import sys
-import uuid # for filenames
+import csv
+import shutil
+import tempfile
+import heapq
+from array import array
 from ast import literal_eval # safely eval literals during merge
-from contextlib import redirect_stdout
-from csvsorter import csvsort
+from collections import OrderedDict
+from itertools import chain, islice
 
 from .index_map import index_map
 from .tensor_config import tensor_config
-from .csv_parser import csv_parser
+from .csv_parser import csv_parser, is_stream, source_name, BAD_ROWS_SKIP
+from .csf import write_csf
+from .build_stats import build_stats
+from .estimate import estimate_tensor
+from .row_filter import compile_filters
+from .prune import kcore_pruner
+from .sparse_tensor import sparse_tensor
+from .spool import row_spool, INVALID
+from .build_cache import build_cache
+from .checkpoint import checkpoint
+from .pipeline import pipeline
+from .sample import row_sampler
+from .slices import slice_counts
+from .memory import memory_budget, format_size
+
+
+# rows converted together by the batch type functions of `index_map`
+BATCH_ROWS = 1 << 12
+
+# megabytes of a tensor sorted in memory at a time by `sort_tensor()`
+SORT_SPLIT_MB = 800
+
+# sorted splits merged at a time, which bounds the files open while sorting
+SORT_FAN_IN = 64
+
+# csvsorter measures splits by the size of their row lists only; the rows
+# with their strings take about this many times more memory
+SORT_OVERHEAD = 4
+
+# buffer of the output tensor file, when the memory limit allows
+WRITE_BUFFER = 1 << 20
+
+# estimated bytes of a batch of rows queued between pipeline stages
+PIPELINE_BATCH_BYTES = BATCH_ROWS * 256
+
+# batches of the count pass between updates of the memory accounting
+ACCOUNT_BATCHES = 16
 
 
 def grab_cols(parser, config):
@@ -24,61 +65,422 @@ def grab_cols(parser, config):
   for m in range(num_modes):
     field = config.get_mode_by_idx(m)['field']
     if field.lower() not in header:
-      print('ERROR: field "{}" not found in {}'.format(field, fin),
-          file=sys.stderr)
+      print('ERROR: field "{}" not found in {}'.format(field,
+          parser.get_name()), file=sys.stderr)
       sys.exit(1)
     cols.append(header.index(field.lower()))
   return cols
 
 
-def merge_dups(tensor_name, num_modes, merge_func=sum):
-  """ Remove duplicate non-zeros from a tensor file. """
+def _val_col(parser, config):
+  """ Return the column index of the values, or -1 if there are none. """
+  val_field = config.get_vals()
+  if val_field:
+    return parser.get_header().index(val_field)
+  return -1
+
+
+class _index_key:
+  """ A sort key of tensor lines, comparing the indices of `columns` as
+  integers. Passed to the sorts rather than patched into csvsorter, whose
+  module-level key type is shared by concurrent builds.
+  """
+  def __init__(self, columns):
+    self.columns = columns
+
+  def __call__(self, row):
+    return [int(row[c]) for c in self.columns]
+
+
+def _sort_split(split, key):
+  """ Sort a split of csvsorter in memory, as `csvsorter.memorysort()`. """
+  with open(split, 'r', newline='') as fin:
+    rows = list(csv.reader(fin))
+  rows.sort(key=key)
+  with open(split, 'w', newline='\n') as fout:
+    csv.writer(fout).writerows(rows)
+
+
+def _merge_splits(splits, key, writer, split_dir):
+  """ Merge sorted splits into `writer`, first merging groups of
+  `SORT_FAN_IN` splits into `split_dir` while there are more than that.
+  """
+  splits = list(splits)
+  while len(splits) > SORT_FAN_IN:
+    merged = os.path.join(split_dir, 'merge{}.csv'.format(len(splits)))
+    with open(merged, 'w', newline='\n') as fout:
+      _merge_splits(splits[:SORT_FAN_IN], key, csv.writer(fout), split_dir)
+    for split in splits[:SORT_FAN_IN]:
+      os.remove(split)
+    splits = [merged] + splits[SORT_FAN_IN:]
+
+  files = [open(split, 'r', newline='') for split in splits]
+  try:
+    writer.writerows(heapq.merge(*[csv.reader(f) for f in files], key=key))
+  finally:
+    for f in files:
+      f.close()
+
+
+def _sort_tensor(tensor_name, sorted_f, mode_order, tmp_dir=None,
+    split_mb=None):
+  """ Sort the lines of a tensor file lexicographically by their indices.
+
+  Args:
+    tensor_name (str): The tensor file to sort.
+    sorted_f (str): Where to write the sorted tensor.
+    mode_order (list): The mode indices (zero-indexed) to sort by, with the
+                       most significant mode first.
+    tmp_dir (str): The directory of the sorted splits (None for the system
+                   default).
+    split_mb (float): The size of the splits sorted in memory, as measured by
+                      csvsorter (default: `SORT_SPLIT_MB`).
+  """
+  # csvsort() keeps its splits in '.csvsorter.<pid>' under the current
+  # directory, which concurrent builds in one process would share, so only
+  # its splitting is used, in a directory of our own
+  import csvsorter # only needed by builds which sort
+
+  if split_mb is None:
+    split_mb = SORT_SPLIT_MB
+  key = _index_key(list(mode_order))
+  split_dir = tempfile.mkdtemp(prefix='sort-', dir=tmp_dir)
+  try:
+    with open(tensor_name, 'r') as fin:
+      splits = csvsorter.csvsplit(csv.reader(fin, delimiter=' '),
+          split_mb, 'utf-8', split_dir)
+    for split in splits:
+      _sort_split(split, key)
+
+    with open(sorted_f, 'w', newline='\n') as fout:
+      _merge_splits(splits, key, csv.writer(fout, delimiter=' '), split_dir)
+  finally:
+    shutil.rmtree(split_dir, ignore_errors=True)
+
+
+def sort_tensor(tensor_name, mode_order, tmp_dir=None, split_mb=None):
+  """ Sort the non-zeros of a tensor file by a permutation of its modes.
+
+  Duplicate non-zeros are left in place. See `merge_dups()` to also remove
+  them.
+
+  Args:
+    tensor_name (str): The tensor file to sort in place.
+    mode_order (list): The mode indices (zero-indexed) to sort by, with the
+                       most significant mode first.
+    tmp_dir (str): The directory of temporary files (None for the system
+                   default).
+    split_mb (float): The size of the splits sorted in memory (see
+                      `_sort_tensor()`).
+  """
   sorted_f = tensor_name + '.sorted'
-  tmp_name = str(uuid.uuid4().hex) + '.tns'
   try:
-    # Sort the "CSV" tensor -- this library prints to stdout in old versions,
-    # so suppress that
-    with open(os.devnull, 'w') as redirect:
-      with redirect_stdout(redirect):
-        csvsort(tensor_name, range(num_modes), column_types=int,
-            output_filename=sorted_f, max_size=800, delimiter=' ',
-            has_header=False)
+    _sort_tensor(tensor_name, sorted_f, mode_order, tmp_dir, split_mb)
+    os.replace(sorted_f, tensor_name)
+  finally:
+    if os.path.exists(sorted_f):
+      os.remove(sorted_f)
 
-    # Merge duplicate non-zeros
-    with open(tmp_name, 'w') as fout:
+
+def _merge_lines(lines, fout, merge_func, slices=None):
+  """ Write sorted non-zeros to `fout`, combining the values of consecutive
+  duplicates with `merge_func`.
+
+  Args:
+    lines (iterable): The non-zeros, each as a list of fields.
+    fout (file): Where to write the merged non-zeros.
+    merge_func (func): Combines a list of values.
+    slices (slice_counts): Counts the merged non-zeros (optional).
+
+  Returns:
+    The number of non-zeros written.
+  """
+  def flush(dup_lines):
+    vals = [literal_eval(x[-1]) for x in dup_lines]
+    inds = [str(x) for x in dup_lines[0][:-1]]
+    print('{} {}'.format(' '.join(inds), merge_func(vals)), file=fout)
+    if slices is not None:
+      slices.add(inds)
+
+  nnz = 0
+  dup_lines = []
+  for line in lines:
+    # indices do not match -- merge previous duplicates
+    if len(dup_lines) > 0 and line[:-1] != dup_lines[0][:-1]:
+      flush(dup_lines)
+      nnz += 1
       dup_lines = []
-      with open(sorted_f, 'r') as fin:
-        for line in fin:
-          line = line.split()
 
-          # indices do not match -- merge previous duplicates
-          if len(dup_lines) > 0 and line[:-1] != dup_lines[0][:-1]:
-            vals = [literal_eval(x[-1]) for x in dup_lines]
-            inds = [str(x) for x in dup_lines[0][:-1]]
-            print('{} {}'.format(' '.join(inds), merge_func(vals)), file=fout)
-            dup_lines = []
+    dup_lines.append(line)
+
+  # final flush
+  if len(dup_lines) > 0:
+    flush(dup_lines)
+    nnz += 1
+  return nnz
+
+
+def merge_dups(tensor_name, num_modes, merge_func=sum, mode_order=None,
+    tmp_dir=None, slices=None, split_mb=None):
+  """ Remove duplicate non-zeros from a tensor file.
 
-          dup_lines.append(line)
+  The resulting tensor is sorted lexicographically by `mode_order`, which
+  defaults to the natural order of the modes. If merging fails, the original
+  file is left untouched and the exception is raised.
 
-      # final flush
-      vals = [eval(x[-1]) for x in dup_lines]
-      inds = [str(x) for x in dup_lines[0][:-1]]
-      print('{} {}'.format(' '.join(inds), merge_func(vals)), file=fout)
+  Args:
+    tmp_dir (str): The directory of the sorted splits (None for the system
+                   default). The merged tensor is written next to
+                   `tensor_name` and then renamed.
+    slices (slice_counts): Counts the merged non-zeros (optional).
+    split_mb (float): The size of the splits sorted in memory (see
+                      `_sort_tensor()`).
+
+  Returns:
+    The number of non-zeros remaining after merging.
+  """
+  if mode_order is None:
+    mode_order = range(num_modes)
+  sorted_f = tensor_name + '.sorted'
+  fd, tmp_name = tempfile.mkstemp(suffix='.tns',
+      dir=os.path.dirname(os.path.abspath(tensor_name)))
+  os.close(fd)
+  try:
+    _sort_tensor(tensor_name, sorted_f, mode_order, tmp_dir, split_mb)
 
-      # overwrite original data
-      os.rename(tmp_name, tensor_name)
+    # Merge duplicate non-zeros
+    with open(sorted_f, 'r') as fin, open(tmp_name, 'w') as fout:
+      nnz = _merge_lines((line.split() for line in fin), fout, merge_func,
+          slices)
 
-  except:
-    # if there was an exception, we don't want to overwrite the original data
-    os.remove(tmp_name)
+    # overwrite original data
+    os.replace(tmp_name, tensor_name)
 
   finally:
-    os.remove(sorted_f)
+    for f in [tmp_name, sorted_f]:
+      if os.path.exists(f):
+        os.remove(f)
+
+  return nnz
+
+
+def _progress_hook(progress, phase, inputs, idx, rows):
+  """ Adapt a `build_tensor()` progress callback to the per-file callback of
+  `csv_parser.rows()`.
+
+  Args:
+    progress (func): The callback given to `build_tensor()` (may be None).
+    phase (str): The name of the current phase.
+    inputs (list): All input files of the phase.
+    idx (int): The index of the input about to be read.
+    rows (int): Rows read during the phase before this input.
+  """
+  if progress is None:
+    return None
+  sizes = [0 if is_stream(f) else os.path.getsize(f) for f in inputs]
+  offset = sum(sizes[:idx])
+  total = sum(sizes)
+  def hook(nrows, nbytes):
+    progress(phase, idx + 1, len(inputs), offset + nbytes, total, rows + nrows)
+  return hook
+
+
+def _batched(rows, size=BATCH_ROWS):
+  """ Yield lists of up to `size` consecutive rows. """
+  rows = iter(rows)
+  while True:
+    batch = list(islice(rows, size))
+    if not batch:
+      return
+    yield batch
+
 
+def _account(budget, config, indmaps, pruner=None, spool=None):
+  """ Update the memory used by the count pass. Over the limit, the rows
+  kept by the pruner are spilled to disk; the index maps cannot spill.
+  """
+  for imap in indmaps:
+    imap.account(budget)
+  if pruner is not None:
+    budget.update('pruner', pruner.memory_usage())
+  if spool is not None:
+    budget.update('spool', spool.memory_usage())
+  if not budget.over():
+    return
+
+  if pruner is not None and not pruner.is_spilled():
+    pruner.spill(config.get_prune_spill() or config.get_temp_dir())
+    budget.update('pruner', pruner.memory_usage())
+    budget.decide('pruner', 'spilled rows to disk',
+        '{} rows'.format(pruner.num_rows))
+  elif not any(d['action'] == 'over limit' for d in budget.decisions):
+    budget.decide('index_map', 'over limit', '{} used of {}; keys cannot be '
+        'spilled'.format(format_size(budget.used()),
+            format_size(budget.limit)))
+
+
+def _accounted(batches, budget, config, indmaps, pruner=None, spool=None):
+  """ Yield `batches`, accounting the memory of the count pass regularly. """
+  for i, batch in enumerate(batches):
+    yield batch
+    if i % ACCOUNT_BATCHES == ACCOUNT_BATCHES - 1:
+      _account(budget, config, indmaps, pruner, spool)
+  _account(budget, config, indmaps, pruner, spool)
+
+
+def _sort_split_mb(budget):
+  """ Return the split size of the external sort, within the memory left by
+  the other components.
+  """
+  want = SORT_SPLIT_MB * SORT_OVERHEAD * (1 << 20)
+  nbytes = budget.grant('sort', want, minimum=SORT_OVERHEAD * (1 << 20))
+  if nbytes < want:
+    budget.decide('sort', 'smaller sort splits', '{} instead of {}'.format(
+        format_size(nbytes), format_size(want)))
+  return nbytes / SORT_OVERHEAD / (1 << 20)
+
+
+def _write_buffer(budget):
+  """ Return the buffer size of the output tensor file. """
+  nbytes = budget.grant('writer', WRITE_BUFFER,
+      minimum=io.DEFAULT_BUFFER_SIZE)
+  if nbytes < WRITE_BUFFER:
+    budget.decide('writer', 'smaller output buffer', format_size(nbytes))
+  return nbytes
+
+
+def _pipeline_depth(budget, depth):
+  """ Return the queue depth of a pipelined emit pass, within the memory left
+  by the other components.
+  """
+  # batches wait in the queues between the four stages
+  want = 3 * depth * PIPELINE_BATCH_BYTES
+  nbytes = budget.grant('pipeline', want, minimum=3 * PIPELINE_BATCH_BYTES)
+  granted = max(int(nbytes // (3 * PIPELINE_BATCH_BYTES)), 1)
+  if granted < depth:
+    budget.decide('pipeline', 'shorter queues', 'depth {} instead of {}'.format(
+        granted, depth))
+  return granted
+
+
+def _add_rows(indmaps, rows, cols, val_col, pruner, spool):
+  """ Count the keys of a batch of rows, recording their converted keys in
+  `pruner` and their keys and values in `spool` (either may be None).
+  """
+  cols_keys = [indmaps[m].add_batch([row[cols[m]] for row in rows])
+      for m in range(len(indmaps))]
+  for r, row in enumerate(rows):
+    keys = [col[r] for col in cols_keys]
+    if pruner is not None:
+      pruner.add_row(keys)
+    if spool is not None:
+      spool.add_row(keys, row[val_col] if val_col != -1 else 1)
+
+
+def _make_sampler(config):
+  """ Return the `row_sampler` of `config`, or None. The sampled rows are
+  the keys of each mode followed by the value.
+  """
+  sample = config.get_sample()
+  if sample is None:
+    return None
+  stratify = None
+  if sample['stratify'] is not None:
+    fields = [config.get_mode_by_idx(m)['field'].lower()
+        for m in range(config.num_modes())]
+    if sample['stratify'].lower() not in fields:
+      raise ValueError('ERROR: cannot stratify by "{}", which is not a '
+          'mode.'.format(sample['stratify']))
+    mode = fields.index(sample['stratify'].lower())
+    stratify = lambda row: row[mode]
+  return row_sampler(rate=sample['rate'], size=sample['rows'],
+      seed=sample['seed'], stratify=stratify)
+
+
+def _make_dirs(config):
+  """ Create the output and temporary directories of a build, if set. """
+  for dirname in [config.get_output_dir(), config.get_temp_dir()]:
+    if dirname:
+      os.makedirs(dirname, exist_ok=True)
+
+
+def _open_input(fin, config, first_pass=False):
+  """ Return a `csv_parser` of an input of `config`.
+
+  Bad rows are handled by the policy of `config` during the first pass over
+  the inputs, and skipped silently in later passes, which see the same rows.
+  """
+  parser = csv_parser(fin, config.get_delimiter(), config.has_header())
+  if first_pass:
+    parser.set_bad_rows(config.get_bad_rows(), config.get_quarantine())
+  else:
+    parser.set_bad_rows(BAD_ROWS_SKIP)
+  return parser
+
+
+def _reset_quarantine(config, ckpt=None):
+  """ Empty the quarantine file of a build, unless resuming one which
+  already read inputs.
+  """
+  if not config.get_quarantine():
+    return
+  if ckpt is not None and (ckpt.done('prune') or ckpt.done('count-0')):
+    return
+  open(config.get_quarantine(), 'w').close()
+
+
+def _count_input(parser, cols, accept, config, hook):
+  """ Count the keys of a single input into fresh maps.
+
+  Returns:
+    The record of counts cached by `build_cache.store_counts()`.
+  """
+  num_modes = config.num_modes()
+  maps = [index_map(name=config.get_mode_by_idx(m)['field'],
+      type_func=config.get_mode_by_idx(m)['type']) for m in range(num_modes)]
+  nrows = 0
+  for rows in _batched(parser.rows(hook, accept)):
+    nrows += len(rows)
+    for m in range(num_modes):
+      maps[m].add_batch([row[cols[m]] for row in rows])
+  return {
+    'rows' : nrows,
+    'rejected' : parser.num_rejected(),
+    'bad_rows' : parser.bad_rows(),
+    'counts' : [maps[m].get_counts() for m in range(num_modes)],
+    'skipped' : [maps[m].skipped for m in range(num_modes)],
+  }
 
 
-def build_tensor(config):
+def _build_maps(config, stats, progress, cache=None, ckpt=None, budget=None):
+  """ Count, prune, and map the keys of each mode (the first passes of a
+  build).
+
+  Args:
+    config (tensor_config): Configuration for the tensor to construct
+    stats (build_stats): Records the phases.
+    progress (func): Progress callback (may be None).
+    cache (build_cache): Reuse and store the key counts of each input
+                         (optional). Unused with a minimum count or streams,
+                         which need the rows themselves, and when bad rows
+                         are quarantined.
+    ckpt (checkpoint): Resume from and record completed steps (optional).
+    budget (memory_budget): Accounts the memory of the maps, and spills the
+                            pruner when over the limit (optional).
+
+  If any input is a stream (see `csv_parser.is_stream()`) or rows are
+  sampled (see `tensor_config.set_sample()`), the first pass also records
+  the (sampled) rows in a `row_spool`, which replaces the inputs in later
+  passes.
+
+  Returns:
+    A tuple of the list of built `index_map` objects, one per mode, and the
+    `row_spool` (or None).
+  """
   num_modes = config.num_modes() # save some typing
+  inputs = config.get_inputs()
+  if budget is None:
+    budget = memory_budget()
 
   indmaps = []
   for m in range(num_modes):
@@ -87,91 +489,824 @@ def build_tensor(config):
     name_ = config.get_mode_by_idx(m)['field']
     indmaps.append(index_map(name=name_, type_func=m_type, sort=sort_))
 
+  # iterative pruning keeps an encoded copy of the rows from the first pass
+  pruner = None
+  if config.get_min_count() > 1:
+    pruner = kcore_pruner(num_modes, config.get_min_count(),
+        config.get_prune_spill())
+
+  # streams can only be read once, and sampled rows are only known after
+  # the whole pass, so keep what the later passes need
+  sampler = _make_sampler(config)
+  sample_cols = list(range(num_modes))
+  spool = None
+  if sampler is not None or any(is_stream(f) for f in inputs):
+    spool = row_spool(num_modes, config.get_temp_dir())
+
+  if ckpt is not None:
+    ckpt.load_maps(indmaps)
+    stats.rejected_rows = ckpt.get('rejected_rows')
+    stats.bad_rows.update(ckpt.get('bad_rows', {}))
+    stats.pruned_rows = ckpt.get('pruned_rows')
+  _reset_quarantine(config, ckpt)
+
   #
   # Build index maps
   #
-  for fin in config.get_inputs():
-    # build CSV parser
-    parser = csv_parser(fin, config.get_delimiter(), config.has_header())
+  with stats.phase('count') as phase:
+    for i, fin in enumerate(inputs):
+      if ckpt is not None and (ckpt.done('prune') or
+          ckpt.done('count-{}'.format(i))):
+        continue
 
-    cols = grab_cols(parser, config)
+      # build CSV parser
+      parser = _open_input(fin, config, first_pass=True)
+
+      cols = grab_cols(parser, config)
+      accept = compile_filters(config, parser.get_header())
+
+      #
+      # Go over each row to build index maps
+      #
+      nrows = 0
+      record = None
+      hook = _progress_hook(progress, 'count', inputs, i, phase['rows'])
+      if cache is not None and pruner is None and spool is None and \
+          not config.get_quarantine():
+        record = cache.load_counts(fin, config)
+        if record is None:
+          record = _count_input(parser, cols, accept, config, hook)
+          cache.store_counts(fin, config, record)
+          stats.add_input_read(fin, record['rows'] + record['rejected'])
+        for m in range(num_modes):
+          indmaps[m].add_counts(record['counts'][m])
+          indmaps[m].skipped.update(record['skipped'][m])
+        nrows = record['rows']
+        stats.rejected_rows += record['rejected']
+        stats.add_bad_rows(record['bad_rows'])
+        _account(budget, config, indmaps)
+
+      elif pruner is None and spool is None:
+        for rows in _accounted(_batched(parser.rows(hook, accept)), budget,
+            config, indmaps):
+          nrows += len(rows)
+          for m in range(num_modes):
+            indmaps[m].add_batch([row[cols[m]] for row in rows])
+      elif sampler is not None:
+        # only the sampled rows are counted, projected to keys and value
+        val_col = _val_col(parser, config)
+        seen = sampler.num_seen
+        projected = ([row[c] for c in cols] +
+            [row[val_col] if val_col != -1 else 1]
+            for row in parser.rows(hook, accept))
+        for rows in _accounted(_batched(sampler.sample(projected)), budget,
+            config, indmaps, pruner, spool):
+          _add_rows(indmaps, rows, sample_cols, num_modes, pruner, spool)
+        nrows = sampler.num_seen - seen
+      else:
+        val_col = _val_col(parser, config)
+        for rows in _accounted(_batched(parser.rows(hook, accept)), budget,
+            config, indmaps, pruner, spool):
+          nrows += len(rows)
+          _add_rows(indmaps, rows, cols, val_col, pruner, spool)
+      phase['rows'] += nrows
+      if record is None:
+        stats.rejected_rows += parser.num_rejected()
+        stats.add_bad_rows(parser.bad_rows())
+        stats.add_input_read(source_name(fin), nrows + parser.num_rejected())
+
+      # the rows held by a pruner are not saved, so it restarts from scratch
+      if ckpt is not None and pruner is None:
+        ckpt.complete('count-{}'.format(i), indmaps,
+            rejected_rows=stats.rejected_rows, bad_rows=stats.bad_rows)
+
+    if sampler is not None:
+      for rows in _accounted(_batched(sampler.finish()), budget, config,
+          indmaps, pruner, spool):
+        _add_rows(indmaps, rows, sample_cols, num_modes, pruner, spool)
+      stats.sampled_rows = sampler.num_sampled
 
-    #
-    # Go over each row to build index maps
-    #
-    for row in parser.rows():
-      for m in range(num_modes):
-        indmaps[m].add(row[cols[m]])
 
+  if ckpt is None or not ckpt.done('prune'):
+    _prune(config, indmaps, pruner, spool, stats, progress, ckpt)
+    if ckpt is not None:
+      ckpt.complete('prune', indmaps, pruned_rows=stats.pruned_rows,
+          rejected_rows=stats.rejected_rows, bad_rows=stats.bad_rows)
+  _map(indmaps, stats)
+
+  return indmaps, spool
+
+
+def _prune(config, indmaps, pruner, spool, stats, progress, ckpt=None):
+  """ The prune phase of a build: remove the rows with a skipped key (and,
+  with a minimum count, the keys below it) from the counts of `indmaps`.
+
+  Args:
+    config (tensor_config): Configuration for the tensor to construct
+    indmaps (list): The `index_map` of each mode, after counting.
+    pruner (kcore_pruner): The pruner fed by the count pass (or None).
+    spool (row_spool): Read instead of the inputs if not None.
+    stats (build_stats): Records the phase.
+    progress (func): Progress callback (may be None).
+    ckpt (checkpoint): Resume from and record completed steps (optional).
+  """
+  num_modes = config.num_modes()
+  inputs = config.get_inputs()
 
   # First pass over the data is now complete. However due to pruning of
   # indices, we have to make a second pass. Suppose a key i was pruned. If a
   # key in another mode (j) only appeared when i was found, then j must also be
-  # pruned.
-  for fin in config.get_inputs():
-    parser = csv_parser(fin, config.get_delimiter(), config.has_header())
-    cols = grab_cols(parser, config)
+  # pruned. With a minimum count, this cascades and is handled by the pruner
+  # without another pass over the data.
+  with stats.phase('prune') as phase:
+    if pruner is not None:
+      phase['rows'] = pruner.num_rows
+      stats.pruned_rows = pruner.prune()
+      for m in range(num_modes):
+        indmaps[m].reset_counts(pruner.counts(m))
+
+    elif spool is not None:
+      phase['rows'] = spool.num_rows
+      stats.pruned_rows = _prune_spool(spool, indmaps)
+
+    else:
+      for i, fin in enumerate(inputs):
+        if ckpt is not None and ckpt.done('prune-{}'.format(i)):
+          continue
+        parser = _open_input(fin, config)
+        cols = grab_cols(parser, config)
+        accept = compile_filters(config, parser.get_header())
+
+        # Go over each row and remove unused keys
+        nrows = 0
+        hook = _progress_hook(progress, 'prune', inputs, i, phase['rows'])
+        for row in parser.rows(hook, accept):
+          nrows += 1
+          pruned = False
+          for m in range(num_modes):
+            if indmaps[m].get_count(row[cols[m]]) < 1:
+              pruned = True
+              break
+          if pruned:
+            stats.pruned_rows += 1
+            for m in range(num_modes):
+              indmaps[m].sub(row[cols[m]])
+        phase['rows'] += nrows
+        stats.add_input_read(source_name(fin))
+        if ckpt is not None:
+          ckpt.complete('prune-{}'.format(i), indmaps,
+              pruned_rows=stats.pruned_rows)
+
+
+def _map(indmaps, stats):
+  """ The build_map phase of a build. Maps that are already built (e.g.,
+  shared with another tensor) are skipped.
+  """
+  with stats.phase('build_map') as phase:
+    for imap in indmaps:
+      if not imap.is_mapped():
+        imap.build_map()
+      phase['rows'] += len(imap)
 
-    # Go over each row and remove unused keys
-    for row in parser.rows():
-      pruned = False
+
+def _prune_spool(spool, indmaps):
+  """ The prune pass of `_build_maps()` over a `row_spool` instead of the
+  inputs.
+
+  Returns:
+    The number of pruned rows.
+  """
+  num_modes = len(indmaps)
+  counts = [array('q', spool.counts(m)) for m in range(num_modes)]
+  pruned_rows = 0
+  for ids, _ in spool.rows():
+    pruned = False
+    for m in range(num_modes):
+      if ids[m] == INVALID or counts[m][ids[m]] < 1:
+        pruned = True
+        break
+    if pruned:
+      pruned_rows += 1
       for m in range(num_modes):
-        if indmaps[m].get_count(row[cols[m]]) < 1:
-          pruned = True
-          break
-      if pruned:
-        for m in range(num_modes):
-          indmaps[m].sub(row[cols[m]])
+        if ids[m] != INVALID:
+          counts[m][ids[m]] -= 1
 
   for m in range(num_modes):
-    indmaps[m].build_map()
+    keys = spool.keys(m)
+    indmaps[m].reset_counts({keys[i] : counts[m][i]
+        for i in range(len(keys))})
+  return pruned_rows
 
-  #
-  # Now go back over the data and build the tensor
-  #
-  with open(config.get_output(), 'w') as fout:
-    for fin in config.get_inputs():
-      parser = csv_parser(fin, config.get_delimiter(), config.has_header())
-      cols = grab_cols(parser, config)
 
-      #
-      # Go over each row to build index maps
-      #
-      inds = [0] * num_modes
-
-      # optionally extract values
-      val_field = config.get_vals()
-      val_col = -1
-      if val_field:
-        val_col = parser.get_header().index(val_field)
-
-      # Grab indices and prune non-zeros with None indices
-      val = 1
-      for row in parser.rows():
-        pruned = False
-        for m in range(num_modes):
-          idx = indmaps[m][row[cols[m]]]
-          if idx:
-            inds[m] = str(idx)
-          else:
-            pruned = True
+def _mapped_rows(config, indmaps, spool, phase, stats, progress,
+    file_idx=None):
+  """ Go back over the data and yield the non-zero of each row.
+
+  Rows with a pruned key in any mode are skipped.
+
+  Args:
+    config (tensor_config): Configuration for the tensor to construct
+    indmaps (list): The built `index_map` of each mode.
+    spool (row_spool): Read instead of the inputs if not None (and closed).
+    phase (dict): The current phase of `stats`.
+    stats (build_stats): Records inputs read.
+    progress (func): Progress callback (may be None).
+    file_idx (int): Only read this input (None to read all).
+
+  Yields:
+    Tuples of (indices, value), where the indices are one-indexed ints and
+    the value is the raw string from the values column (or 1; '1' when read
+    from the spool).
+  """
+  num_modes = config.num_modes()
+  inputs = config.get_inputs()
+
+  if spool is not None:
+    # id -> index of each mode; the trailing None is found by INVALID (-1)
+    lookup = [[indmaps[m].lookup(k) for k in spool.keys(m)] + [None]
+        for m in range(num_modes)]
+    try:
+      for ids, val in spool.rows():
+        phase['rows'] += 1
+        inds = [lookup[m][ids[m]] for m in range(num_modes)]
+        if None not in inds:
+          yield inds, val
+    finally:
+      spool.close()
+    return
+  for i, fin in enumerate(inputs):
+    if file_idx is not None and i != file_idx:
+      continue
+    parser = _open_input(fin, config)
+    cols = grab_cols(parser, config)
+    accept = compile_filters(config, parser.get_header())
+
+    # optionally extract values
+    val_col = _val_col(parser, config)
+
+    # Grab indices and prune non-zeros with None indices
+    val = 1
+    nrows = 0
+    hook = _progress_hook(progress, 'emit', inputs, i, phase['rows'])
+    for rows in _batched(parser.rows(hook, accept)):
+      nrows += len(rows)
+      cols_inds = [indmaps[m].get_batch([row[cols[m]] for row in rows])
+          for m in range(num_modes)]
+      for r, row in enumerate(rows):
+        inds = [col[r] for col in cols_inds]
+        if None in inds:
+          continue
 
         if val_col != -1:
           val = row[val_col]
+        yield inds, val
+    phase['rows'] += nrows
+    stats.add_input_read(source_name(fin))
 
-        if not pruned:
-          print('{} {}'.format(' '.join(inds), val), file=fout)
 
-  # may be None to leave duplicates
-  if config.get_merge_func():
-    merge_dups(config.get_output(), num_modes,
-        merge_func=config.get_merge_func())
+def _map_batches(batches, indmaps, cols, val_col, counts, slices=None):
+  """ The map stage of `_emit_pipelined()`: turn batches of rows into chunks
+  of `.tns` lines, skipping rows with a pruned key. The non-zeros are counted
+  in `slices` if given.
+  """
+  num_modes = len(indmaps)
+  for batch in batches:
+    out = []
+    cols_inds = [indmaps[m].get_batch([row[cols[m]] for row in batch])
+        for m in range(num_modes)]
+    for r, row in enumerate(batch):
+      inds = [col[r] for col in cols_inds]
+      if None in inds:
+        continue
+      val = row[val_col] if val_col != -1 else 1
+      out.append('{} {}\n'.format(' '.join(map(str, inds)), val))
+      if slices is not None:
+        slices.add(inds)
+    counts['rows'] += len(batch)
+    counts['nnz'] += len(out)
+    yield ''.join(out)
+
+
+def _emit_pipelined(config, indmaps, phase, stats, progress, fout,
+    slices=None, depth=None):
+  """ The emit pass of `_write_tensor()` as a `pipeline` of threads: a reader
+  of raw blocks, a CSV tokenizer producing batches of rows, a mapper
+  producing chunks of `.tns` lines (counting them in `slices`, if given), and
+  a writer. The queues between stages hold `depth` batches (default:
+  `config.get_pipeline()`).
+
+  Per-stage statistics are accumulated in `phase['stages']`.
+  """
+  inputs = config.get_inputs()
+  if depth is None:
+    depth = config.get_pipeline()
+  stages = phase.setdefault('stages', OrderedDict())
+  for i, fin in enumerate(inputs):
+    parser = _open_input(fin, config)
+    cols = grab_cols(parser, config)
+    accept = compile_filters(config, parser.get_header())
+    val_col = _val_col(parser, config)
+    hook = _progress_hook(progress, 'emit', inputs, i, phase['rows'])
+    counts = {'rows' : 0, 'nnz' : 0}
+
+    def write(chunks):
+      for chunk in chunks:
+        fout.write(chunk)
+        yield len(chunk)
+
+    pipe = pipeline(depth)
+    pipe.add_stage('read', lambda _: parser.read_blocks())
+    pipe.add_stage('parse', lambda blocks: parser.parse_blocks(blocks,
+        accept, hook))
+    pipe.add_stage('map', lambda batches: _map_batches(batches, indmaps,
+        cols, val_col, counts, slices))
+    pipe.add_stage('write', write)
+    pipe.run()
+
+    for name, record in pipe.stats.items():
+      total = stages.setdefault(name, OrderedDict([('items', 0),
+          ('wall', 0.), ('wait_in', 0.), ('wait_out', 0.),
+          ('utilization', 0.)]))
+      for k in ['items', 'wall', 'wait_in', 'wait_out']:
+        total[k] += record[k]
+      if total['wall'] > 0:
+        busy = total['wall'] - total['wait_in'] - total['wait_out']
+        total['utilization'] = max(busy, 0.) / total['wall']
+
+    phase['rows'] += counts['rows']
+    stats.nnz += counts['nnz']
+    stats.add_input_read(source_name(fin))
+
+
+def _write_parts(config, indmaps, stats, progress, ckpt, sort_order,
+    slices=None, budget=None):
+  """ The emit and merge/sort phases of `_write_tensor()` with checkpoints.
+
+  Each input is emitted to its own part file in the checkpoint, and each part
+  is sorted by `sort_order` (if not None) as a separate step, with splits
+  sized by `budget`. The sorted parts are then merged into the output,
+  combining duplicates if requested, and counted in `slices` if given.
+  """
+  if budget is None:
+    budget = memory_budget()
+  num_modes = config.num_modes()
+  inputs = config.get_inputs()
+  merge_func = config.get_merge_func()
+  parts = [ckpt.path('part-{}.tns'.format(i)) for i in range(len(inputs))]
+
+  with stats.phase('emit') as phase:
+    for i in range(len(inputs)):
+      if ckpt.done('emit-{}'.format(i)):
+        continue
+      nnz = 0
+      with open(parts[i] + '.tmp', 'w') as fout:
+        for inds, val in _mapped_rows(config, indmaps, None, phase, stats,
+            progress, file_idx=i):
+          print('{} {}'.format(' '.join(map(str, inds)), val), file=fout)
+          nnz += 1
+      os.replace(parts[i] + '.tmp', parts[i])
+      ckpt.complete('emit-{}'.format(i), **{'nnz-{}'.format(i) : nnz})
+  stats.nnz = sum(ckpt.get('nnz-{}'.format(i)) for i in range(len(inputs)))
+
+  if ckpt.done('merge'):
+    stats.nnz = ckpt.get('nnz')
+    if slices is not None:
+      # the counts of the merge were not saved
+      slices.add_file(config.get_output())
+    return
+
+  if sort_order is not None:
+    with stats.phase('sort') as phase:
+      for i in range(len(inputs)):
+        if ckpt.done('sort-{}'.format(i)):
+          continue
+        if ckpt.get('nnz-{}'.format(i)) > 0:
+          sort_tensor(parts[i], sort_order, config.get_temp_dir(),
+              split_mb=_sort_split_mb(budget))
+        phase['rows'] += ckpt.get('nnz-{}'.format(i))
+        ckpt.complete('sort-{}'.format(i))
+    budget.release('sort')
+
+  # merge the sorted runs
+  with stats.phase('merge_dups' if merge_func else 'merge') as phase:
+    phase['rows'] = stats.nnz
+    tmp_name = config.get_output() + '.tmp'
+    files = [open(p, 'r') for p in parts]
+    try:
+      lines = [(line.split() for line in f) for f in files]
+      if sort_order is not None:
+        lines = heapq.merge(*lines,
+            key=lambda x: [int(x[m]) for m in sort_order])
+      else:
+        lines = chain.from_iterable(lines)
+      with open(tmp_name, 'w') as fout:
+        if merge_func:
+          stats.nnz = _merge_lines(lines, fout, merge_func, slices)
+        else:
+          for line in lines:
+            print(' '.join(line), file=fout)
+            if slices is not None:
+              slices.add(line)
+      os.replace(tmp_name, config.get_output())
+    finally:
+      for f in files:
+        f.close()
+      if os.path.exists(tmp_name):
+        os.remove(tmp_name)
+  ckpt.complete('merge', nnz=stats.nnz)
+
+
+def _write_tensor(config, indmaps, spool, stats, progress, ckpt=None,
+    budget=None):
+  """ The final phases of a build: emit the non-zeros to the output file,
+  merge or sort them, and write the CSF, map, and statistics files.
+
+  Args:
+    config (tensor_config): Configuration for the tensor to construct
+    indmaps (list): The built `index_map` of each mode.
+    spool (row_spool): Read instead of the inputs if not None.
+    stats (build_stats): Records the phases.
+    progress (func): Progress callback (may be None).
+    ckpt (checkpoint): Resume from and record completed steps (optional).
+    budget (memory_budget): Sizes the output buffer, the pipeline queues, and
+                            the sort splits, and is reported in `stats`
+                            (optional).
+  """
+  num_modes = config.num_modes()
+  if budget is None:
+    budget = memory_budget()
+
+  # CSF requires sorted non-zeros, even if no order was requested
+  mode_order = config.get_mode_order()
+  if config.get_csf() and mode_order is None:
+    mode_order = list(range(num_modes))
+
+  # slice counts are gathered from the final non-zeros: while emitting, or
+  # while merging duplicates
+  slices = None
+  emit_slices = None
+  if config.get_slices():
+    slices = slice_counts([len(indmaps[m]) for m in range(num_modes)])
+    if not config.get_merge_func():
+      emit_slices = slices
+
+  if ckpt is not None:
+    sort_order = mode_order
+    if config.get_merge_func() and sort_order is None:
+      sort_order = list(range(num_modes))
+    _write_parts(config, indmaps, stats, progress, ckpt, sort_order, slices,
+        budget)
+
+  else:
+    #
+    # Now go back over the data and build the tensor
+    #
+    with stats.phase('emit') as phase:
+      with open(config.get_output(), 'w',
+          buffering=_write_buffer(budget)) as fout:
+        if config.get_pipeline() and spool is None:
+          _emit_pipelined(config, indmaps, phase, stats, progress, fout,
+              emit_slices, _pipeline_depth(budget, config.get_pipeline()))
+        else:
+          for inds, val in _mapped_rows(config, indmaps, spool, phase,
+              stats, progress):
+            print('{} {}'.format(' '.join(map(str, inds)), val), file=fout)
+            stats.nnz += 1
+            if emit_slices is not None:
+              emit_slices.add(inds)
+      budget.release('pipeline')
+    budget.release('writer')
+
+    # may be None to leave duplicates
+    if config.get_merge_func():
+      with stats.phase('merge_dups') as phase:
+        phase['rows'] = stats.nnz
+        stats.nnz = merge_dups(config.get_output(), num_modes,
+            merge_func=config.get_merge_func(), mode_order=mode_order,
+            tmp_dir=config.get_temp_dir(), slices=slices,
+            split_mb=_sort_split_mb(budget))
+    elif mode_order is not None:
+      with stats.phase('sort') as phase:
+        phase['rows'] = stats.nnz
+        sort_tensor(config.get_output(), mode_order, config.get_temp_dir(),
+            split_mb=_sort_split_mb(budget))
+    budget.release('sort')
+
+  if config.get_csf():
+    with stats.phase('csf') as phase:
+      phase['rows'] = stats.nnz
+      write_csf(config.get_output(), config.get_csf(),
+          [len(indmaps[m]) for m in range(num_modes)], mode_order)
+
+  if slices is not None:
+    with stats.phase('slices') as phase:
+      phase['rows'] = sum(slices.dims)
+      slices.write(config.get_slices(), config.get_slice_parts())
 
   #
   # Write maps to file
   #
+  with stats.phase('write_maps') as phase:
+    for m in range(num_modes):
+      indmaps[m].write_file(config.get_map_file(m))
+      phase['rows'] += len(indmaps[m])
+
+  for m in range(num_modes):
+    stats.add_mode(config.get_mode_by_idx(m)['field'], indmaps[m])
+
+  stats.memory = budget.to_dict()
+  stats.finish()
+  if config.get_stats_file():
+    stats.write_json(config.get_stats_file())
+
+
+def build_tensor(config, progress=None):
+  """ Construct a tensor and its mode maps from the inputs in `config`.
+
+  Args:
+    config (tensor_config): Configuration for the tensor to construct
+    progress (func): Optional callback invoked periodically while reading
+                     inputs as `progress(phase, file_idx, num_files, nbytes,
+                     total_bytes, rows)`. See `progress_reporter`. Defaults to
+                     `config.get_progress()`.
+
+  If `config.get_cache_dir()` is set, the outputs are restored from a
+  `build_cache` entry with the same inputs and settings when one exists, and
+  stored in the cache otherwise.
+
+  If `config.get_checkpoint_dir()` is set, progress is recorded after each
+  input and phase (see `checkpoint`), and with `config.get_resume()` a
+  failed build continues from its last completed step.
+
+  Returns:
+    A `build_stats` object with per-phase timings and tensor statistics. If
+    `config.get_dry_run()` is set, nothing is built and the dictionary of
+    estimates from `estimate_tensor()` is returned instead.
+  """
+  _make_dirs(config)
+  if config.get_dry_run():
+    return estimate_tensor(config, config.get_dry_run())
+
+  num_modes = config.num_modes() # save some typing
+  stats = build_stats(profile_dir=config.get_profile_dir(),
+      trace_memory=config.get_trace_memory())
+  if progress is None:
+    progress = config.get_progress()
+
+  cache = None
+  key = None
+  if config.get_cache_dir():
+    cache = build_cache(config.get_cache_dir(), config.get_cache_hash())
+    with stats.phase('cache') as phase:
+      key = cache.fingerprint(config)
+      record = cache.restore(config, key) if key else None
+    if record is not None:
+      stats.modes = record['modes']
+      stats.pruned_rows = record['pruned_rows']
+      stats.rejected_rows = record['rejected_rows']
+      stats.bad_rows = record['bad_rows']
+      stats.sampled_rows = record.get('sampled_rows')
+      stats.nnz = record['nnz']
+      stats.cached = True
+      stats.finish()
+      if config.get_stats_file():
+        stats.write_json(config.get_stats_file())
+      return stats
+
+  ckpt = None
+  if config.get_checkpoint_dir():
+    if any(is_stream(f) for f in config.get_inputs()):
+      raise ValueError('ERROR: builds from streaming inputs cannot be '
+          'checkpointed.')
+    if config.get_sample() is not None:
+      raise ValueError('ERROR: sampled builds cannot be checkpointed.')
+    ckpt = checkpoint(config.get_checkpoint_dir(), config,
+        config.get_resume())
+
+  budget = memory_budget(config.get_memory_limit())
+  indmaps, spool = _build_maps(config, stats, progress, cache, ckpt, budget)
+
+  _write_tensor(config, indmaps, spool, stats, progress, ckpt, budget)
+  if ckpt is not None:
+    ckpt.remove()
+
+  if key is not None:
+    cache.store(config, key, stats)
+  return stats
+
+
+def build_sparse_tensor(config, progress=None):
+  """ Construct a tensor in memory from the inputs in `config`.
+
+  The passes over the inputs are the same as `build_tensor()`, but non-zeros
+  are collected into a `sparse_tensor` and duplicates are merged in memory.
+  Nothing is written to disk except the statistics file, if one is set (and
+  the prune spill files of `config.set_min_count()`). The output, CSF, and
+  dry-run settings of `config` are ignored.
+
+  Args:
+    config (tensor_config): Configuration for the tensor to construct
+    progress (func): Optional progress callback, as in `build_tensor()`.
+
+  Returns:
+    A `sparse_tensor` with the `index_map` of each mode. Its `stats`
+    attribute holds the `build_stats` of the build.
+  """
+  num_modes = config.num_modes()
+  _make_dirs(config)
+  stats = build_stats(profile_dir=config.get_profile_dir(),
+      trace_memory=config.get_trace_memory())
+  if progress is None:
+    progress = config.get_progress()
+
+  budget = memory_budget(config.get_memory_limit())
+  indmaps, spool = _build_maps(config, stats, progress, budget=budget)
+
+  inds = [array('q') for _ in range(num_modes)]
+  vals = array('d')
+  with stats.phase('emit') as phase:
+    for row_inds, val in _mapped_rows(config, indmaps, spool, phase,
+          stats, progress):
+      for m in range(num_modes):
+        inds[m].append(row_inds[m] - 1)
+      vals.append(float(val))
+  stats.nnz = len(vals)
+
+  fields = [config.get_mode_by_idx(m)['field'] for m in range(num_modes)]
+  tensor = sparse_tensor(inds, vals, [len(x) for x in indmaps], indmaps,
+      fields)
+  inds = vals = None
+
+  mode_order = config.get_mode_order()
+  if config.get_merge_func():
+    with stats.phase('merge_dups') as phase:
+      phase['rows'] = stats.nnz
+      stats.nnz = tensor.merge_dups(config.get_merge_func(), mode_order)
+  elif mode_order is not None:
+    with stats.phase('sort') as phase:
+      phase['rows'] = stats.nnz
+      tensor.sort(mode_order)
+
   for m in range(num_modes):
-    fieldname = config.get_mode_by_idx(m)['field'].replace(' ', '')
-    indmaps[m].write_file('mode-{}-{}.map'.format(m+1,fieldname))
+    stats.add_mode(fields[m], indmaps[m])
+
+  stats.memory = budget.to_dict()
+  stats.finish()
+  if config.get_stats_file():
+    stats.write_json(config.get_stats_file())
+
+  tensor.stats = stats
+  return tensor
+
+
+def build_tensors(configs, progress=None):
+  """ Construct several tensors from a single pass over their shared inputs.
+
+  Each row is read and tokenized once, and the key of each distinct (field,
+  type) is converted once. The rows accepted by each tensor are recorded in
+  its own `row_spool`, which its prune and emit passes read instead of the
+  inputs. Modes with the same field, type, and ordering share one
+  `index_map` when they end up with the same keys and counts (e.g., tensors
+  with the same filters when no rows are pruned).
+
+  All configs must have the same inputs, delimiter, and header setting, and
+  must not sample rows. Dry-run settings are ignored.
+
+  Args:
+    configs (list): The `tensor_config` of each tensor to construct.
+    progress (func): Optional progress callback, as in `build_tensor()`.
+                     Defaults to the callback of the first config.
+
+  Returns:
+    A list with the `build_stats` of each tensor. The time of the shared
+    'count' phase is reported in each.
+  """
+  first = configs[0]
+  inputs = first.get_inputs()
+  for config in configs[1:]:
+    if config.get_inputs() != inputs or \
+        config.get_delimiter() != first.get_delimiter() or \
+        config.has_header() != first.has_header():
+      raise ValueError('ERROR: all tensors must have the same inputs, '
+          'delimiter, and header.')
+  if any(c.get_sample() is not None for c in configs):
+    raise ValueError('ERROR: cannot sample rows when building several '
+        'tensors.')
+  if progress is None:
+    progress = first.get_progress()
+
+  for config in configs:
+    _make_dirs(config)
+  _reset_quarantine(first)
+  budget = memory_budget(first.get_memory_limit())
+  stats = [build_stats(profile_dir=c.get_profile_dir(),
+      trace_memory=c.get_trace_memory()) for c in configs]
+
+  # one converting index_map per distinct (field, type)
+  convs = OrderedDict()
+  conv_ids = [] # the converter of each mode of each tensor
+  for config in configs:
+    ids = []
+    for m in range(config.num_modes()):
+      mode = config.get_mode_by_idx(m)
+      key = (mode['field'].lower(), mode['type'])
+      if key not in convs:
+        convs[key] = index_map(name=mode['field'], type_func=mode['type'])
+      ids.append(list(convs).index(key))
+    conv_ids.append(ids)
+  convs = list(convs.values())
+
+  spools = [row_spool(c.num_modes(), c.get_temp_dir()) for c in configs]
+  pruners = [None] * len(configs)
+  for t, config in enumerate(configs):
+    if config.get_min_count() > 1:
+      pruners[t] = kcore_pruner(config.num_modes(), config.get_min_count(),
+          config.get_prune_spill())
+
+  #
+  # Count the keys of every tensor in one pass
+  #
+  with stats[0].phase('count') as phase:
+    for i, fin in enumerate(inputs):
+      parser = _open_input(fin, first, first_pass=True)
+      conv_cols = [0] * len(convs)
+      for t, config in enumerate(configs):
+        cols = grab_cols(parser, config)
+        for m in range(config.num_modes()):
+          conv_cols[conv_ids[t][m]] = cols[m]
+      accepts = [compile_filters(c, parser.get_header()) for c in configs]
+      val_cols = [_val_col(parser, c) for c in configs]
+
+      nrows = 0
+      rejected = [0] * len(configs)
+      hook = _progress_hook(progress, 'count', inputs, i, phase['rows'])
+      for row in parser.rows(hook):
+        nrows += 1
+        keys = None
+        for t in range(len(configs)):
+          if accepts[t] is not None and not accepts[t](row):
+            rejected[t] += 1
+            continue
+          if keys is None:
+            keys = [convs[j].add(row[conv_cols[j]])
+                for j in range(len(convs))]
+          tkeys = [keys[j] for j in conv_ids[t]]
+          spools[t].add_row(tkeys,
+              row[val_cols[t]] if val_cols[t] != -1 else 1)
+          if pruners[t] is not None:
+            pruners[t].add_row(tkeys)
+      phase['rows'] += nrows
+      for t in range(len(configs)):
+        stats[t].rejected_rows += rejected[t]
+        stats[t].add_bad_rows(parser.bad_rows())
+        stats[t].add_input_read(source_name(fin), nrows)
+        budget.update('spool:{}'.format(t), spools[t].memory_usage())
+      for imap in convs:
+        imap.account(budget)
+      for t, pruner in enumerate(pruners):
+        if pruner is not None and budget.over() and not pruner.is_spilled():
+          pruner.spill(configs[t].get_prune_spill() or
+              configs[t].get_temp_dir())
+          budget.decide('pruner', 'spilled rows to disk',
+              'tensor {}, {} rows'.format(t, pruner.num_rows))
+  for imap in convs:
+    imap.account(budget, release=True)
+  convs = None
+
+  for st in stats[1:]:
+    st.phases['count'] = OrderedDict(stats[0].phases['count'])
+
+  #
+  # Prune, map, and emit each tensor from its spool
+  #
+  shared = []
+  map_files = dict()
+  for t, config in enumerate(configs):
+    indmaps = []
+    for m in range(config.num_modes()):
+      mode = config.get_mode_by_idx(m)
+      imap = index_map(name=mode['field'], type_func=mode['type'],
+          sort=mode['sort'])
+      imap.set_counts(zip(spools[t].keys(m), spools[t].counts(m)))
+      indmaps.append(imap)
+
+    _prune(config, indmaps, pruners[t], spools[t], stats[t], progress)
+    pruners[t] = None
+
+    for m in range(config.num_modes()):
+      match = [x for x in shared if x.same_keys(indmaps[m])]
+      if match:
+        indmaps[m] = match[0]
+      else:
+        shared.append(indmaps[m])
+
+      map_name = config.get_map_file(m)
+      if map_files.setdefault(map_name, indmaps[m]) is not indmaps[m]:
+        print('WARNING: tensors write different maps to {}; keeping the '
+            'last.'.format(map_name), file=sys.stderr)
 
+    _map(indmaps, stats[t])
+    _write_tensor(config, indmaps, spools[t], stats[t], progress,
+        budget=budget)
 
+  return stats
@@ -0,0 +1,151 @@
+
+
+import os
+import json
+import pickle
+
+from .build_cache import input_id, config_digest
+
+
+# bump when the checkpoint formats change
+CHECKPOINT_VERSION = 1
+
+# files of a checkpoint besides the 'part-*' tensor files
+CHECKPOINT_FILES = ['manifest.json', 'state.json', 'maps.pickle',
+    'manifest.json.tmp', 'state.json.tmp', 'maps.pickle.tmp']
+
+
+def _atomic_write(filename, data, binary=False):
+  """ Write `data` to `filename` so that readers see either the old or the
+  new contents.
+  """
+  tmp = filename + '.tmp'
+  with open(tmp, 'wb' if binary else 'w') as fout:
+    fout.write(data)
+    fout.flush()
+    os.fsync(fout.fileno())
+  os.replace(tmp, filename)
+
+
+class checkpoint:
+  """ The persistent progress of a build, for resuming it after a failure.
+
+  A checkpoint directory holds a manifest identifying the inputs (path,
+  size, and modification time) and the settings of the build, the list of
+  completed steps with the counters needed to report them, the index maps as
+  of the last completed counting or pruning step, and the emitted and sorted
+  part files of the tensor.
+
+  Steps are named by phase and input, e.g., 'count-0', 'prune', 'emit-3',
+  'sort-3', 'merge'.
+  """
+
+  def __init__(self, ckpt_dir, config, resume=False):
+    """ Open a checkpoint directory.
+
+    Without `resume`, any previous checkpoint in `ckpt_dir` is discarded.
+
+    Args:
+      ckpt_dir (str): The checkpoint directory (created if needed).
+      config (tensor_config): Configuration for the tensor to construct.
+      resume (bool): Continue from the steps completed by a previous build.
+
+    Raises:
+      ValueError: When resuming and the inputs or settings have changed.
+    """
+    self._dir = ckpt_dir
+    manifest = {
+      'version' : CHECKPOINT_VERSION,
+      'digest' : config_digest(config,
+          [input_id(f) for f in config.get_inputs()]),
+    }
+
+    old = None
+    try:
+      with open(self.path('manifest.json'), 'r') as fin:
+        old = json.load(fin)
+    except (OSError, ValueError):
+      pass
+
+    if resume and old is not None:
+      if old != manifest:
+        raise ValueError('ERROR: inputs or settings have changed since the '
+            'checkpoint in {}; cannot resume.'.format(ckpt_dir))
+      with open(self.path('state.json'), 'r') as fin:
+        self._state = json.load(fin)
+      return
+
+    self._clear()
+    os.makedirs(ckpt_dir, exist_ok=True)
+    self._state = {'steps' : [], 'values' : {}}
+    _atomic_write(self.path('manifest.json'), json.dumps(manifest))
+    self._save_state()
+
+
+  def path(self, name):
+    """ Return the path of a file in the checkpoint directory. """
+    return os.path.join(self._dir, name)
+
+
+  def _save_state(self):
+    _atomic_write(self.path('state.json'), json.dumps(self._state))
+
+
+  def done(self, step):
+    """ Return whether `step` was completed. """
+    return step in self._state['steps']
+
+
+  def get(self, name, default=0):
+    """ Return a value recorded by `complete()`. """
+    return self._state['values'].get(name, default)
+
+
+  def complete(self, step, indmaps=None, **values):
+    """ Record that `step` was completed.
+
+    Args:
+      step (str): The name of the step.
+      indmaps (list): The `index_map` of each mode, to persist (optional).
+      values: Counters to record, e.g., `rejected_rows=10`.
+    """
+    if indmaps is not None:
+      state = [(imap.get_counts(), imap.skipped) for imap in indmaps]
+      _atomic_write(self.path('maps.pickle'),
+          pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), binary=True)
+    self._state['values'].update(values)
+    self._state['steps'].append(step)
+    self._save_state()
+
+
+  def load_maps(self, indmaps):
+    """ Restore the key counts of `indmaps` from the last step that saved
+    them. Returns False if no maps were saved.
+    """
+    try:
+      with open(self.path('maps.pickle'), 'rb') as fin:
+        state = pickle.load(fin)
+    except OSError:
+      return False
+    for imap, (counts, skipped) in zip(indmaps, state):
+      imap.set_counts(counts.items())
+      imap.skipped = set(skipped)
+    return True
+
+
+  def _clear(self):
+    # only remove our own files, in case the directory is shared
+    if not os.path.isdir(self._dir):
+      return
+    for name in os.listdir(self._dir):
+      if name in CHECKPOINT_FILES or name.startswith('part-'):
+        os.remove(self.path(name))
+
+
+  def remove(self):
+    """ Delete the checkpoint after a successful build. """
+    self._clear()
+    try:
+      os.rmdir(self._dir)
+    except OSError:
+      pass
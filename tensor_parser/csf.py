@@ -0,0 +1,155 @@
+
+
+import sys
+from array import array
+
+
+#
+# CSF (compressed sparse fiber) output.
+#
+# The binary layout is the 4-byte magic `CSF1`, a sequence of little-endian
+# unsigned 64-bit integers, and finally the values as little-endian doubles:
+#
+#   nmodes
+#   nnz
+#   dims[nmodes]        (in the original mode order of the tensor)
+#   mode_order[nmodes]  (level l of the tree stores mode `mode_order[l]`)
+#   nfibers[nmodes]     (number of nodes at each level; nfibers[-1] == nnz)
+#   for each level l < nmodes-1:
+#     fptr[l][nfibers[l] + 1]
+#     fids[l][nfibers[l]]
+#   fids[nmodes-1][nnz]
+#   vals[nnz]
+#
+# Node `f` at level `l` has children `fptr[l][f]` to `fptr[l][f+1]` (exclusive)
+# at level `l+1`. All ids are zero-indexed.
+#
+
+CSF_MAGIC = b'CSF1'
+
+
+def _parse_line(line, num_modes):
+  line = line.split()
+  return [int(x) - 1 for x in line[:num_modes]], float(line[-1])
+
+
+def build_csf(lines, num_modes, mode_order):
+  """ Construct the CSF arrays from a stream of sorted non-zeros.
+
+  Args:
+    lines (iterable): Lines of a `.tns` file, sorted lexicographically by
+                      `mode_order`.
+    num_modes (int): The number of modes in the tensor.
+    mode_order (list): The mode indices (zero-indexed) of each level.
+
+  Returns:
+    A tuple (fptr, fids, vals) of `array` objects. `fptr` has one fewer level
+    than `fids`.
+  """
+  fptr = [array('Q') for _ in range(num_modes - 1)]
+  fids = [array('Q') for _ in range(num_modes)]
+  vals = array('d')
+
+  prev = None
+  for line in lines:
+    if not line.strip():
+      continue
+    inds, val = _parse_line(line, num_modes)
+    inds = [inds[m] for m in mode_order]
+
+    # first level whose node differs from the previous non-zero -- the leaves
+    # always start a new node, even for (unmerged) duplicates
+    first_new = 0
+    if prev is not None:
+      first_new = num_modes - 1
+      for l in range(num_modes - 1):
+        if inds[l] != prev[l]:
+          first_new = l
+          break
+
+    for l in range(first_new, num_modes):
+      if l < num_modes - 1:
+        fptr[l].append(len(fids[l+1]))
+      fids[l].append(inds[l])
+    vals.append(val)
+    prev = inds
+
+  # close the final fiber of each level
+  for l in range(num_modes - 1):
+    fptr[l].append(len(fids[l+1]))
+
+  return fptr, fids, vals
+
+
+def write_csf(tensor_name, csf_name, dims, mode_order=None):
+  """ Write a sorted `.tns` file as a binary CSF file.
+
+  Args:
+    tensor_name (str): The tensor file, sorted lexicographically by
+                       `mode_order`.
+    csf_name (str): The name of the output CSF file.
+    dims (list): The length of each mode.
+    mode_order (list): The mode indices (zero-indexed) of each level. Defaults
+                       to the natural order of the modes.
+  """
+  num_modes = len(dims)
+  if mode_order is None:
+    mode_order = range(num_modes)
+  mode_order = list(mode_order)
+
+  with open(tensor_name, 'r') as fin:
+    fptr, fids, vals = build_csf(fin, num_modes, mode_order)
+
+  with open(csf_name, 'wb') as fout:
+    fout.write(CSF_MAGIC)
+    header = array('Q', [num_modes, len(vals)])
+    header.extend(dims)
+    header.extend(mode_order)
+    header.extend([len(f) for f in fids])
+    _write_array(fout, header)
+    for l in range(num_modes - 1):
+      _write_array(fout, fptr[l])
+      _write_array(fout, fids[l])
+    _write_array(fout, fids[-1])
+    _write_array(fout, vals)
+
+
+def read_csf(csf_name):
+  """ Read a CSF file written by `write_csf()`.
+
+  Returns:
+    A dictionary with keys 'dims', 'mode_order', 'fptr', 'fids', and 'vals'.
+  """
+  with open(csf_name, 'rb') as fin:
+    if fin.read(len(CSF_MAGIC)) != CSF_MAGIC:
+      raise ValueError('ERROR: {} is not a CSF file.'.format(csf_name))
+    num_modes, nnz = _read_array(fin, 'Q', 2)
+    dims = list(_read_array(fin, 'Q', num_modes))
+    mode_order = list(_read_array(fin, 'Q', num_modes))
+    nfibers = list(_read_array(fin, 'Q', num_modes))
+
+    fptr = []
+    fids = []
+    for l in range(num_modes - 1):
+      fptr.append(_read_array(fin, 'Q', nfibers[l] + 1))
+      fids.append(_read_array(fin, 'Q', nfibers[l]))
+    fids.append(_read_array(fin, 'Q', nnz))
+    vals = _read_array(fin, 'd', nnz)
+
+  return {'dims' : dims, 'mode_order' : mode_order, 'fptr' : fptr,
+      'fids' : fids, 'vals' : vals}
+
+
+def _write_array(fout, arr):
+  if sys.byteorder == 'big':
+    arr = array(arr.typecode, arr)
+    arr.byteswap()
+  arr.tofile(fout)
+
+
+def _read_array(fin, typecode, count):
+  arr = array(typecode)
+  arr.fromfile(fin, count)
+  if sys.byteorder == 'big':
+    arr.byteswap()
+  return arr
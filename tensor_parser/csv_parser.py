@@ -1,8 +1,14 @@
 
+import sys
 from sys import exit, stderr
+import os
+import io
 import csv
+import random
 import gzip
 import bz2
+from itertools import chain, islice
+from collections import OrderedDict
 
 
 #
@@ -24,6 +30,57 @@ def open_file(fname, mode):
     return open(fname, mode)
 
 
+def open_text(raw, fname):
+  """ Wrap an open binary handle for reading text, decompressing gzip and bz2
+  files based on the extension of `fname`.
+
+  Unlike `open_file()`, the caller keeps a handle on the underlying file, whose
+  `tell()` reports the (compressed) bytes consumed so far.
+
+  Args:
+    raw (file): A file opened with mode 'rb'.
+    fname (str): The name of the file, used to detect compression.
+  """
+  if fname.endswith('.gz'):
+    return gzip.open(raw, 'rt')
+  elif fname.endswith('.bz2'):
+    return bz2.open(raw, 'rt')
+  else:
+    return io.TextIOWrapper(raw)
+
+
+def is_stream(source):
+  """ Return whether an input can only be read once: '-' (stdin), an open
+  file object, or an iterable of rows. Any other string is a file name.
+  """
+  return not isinstance(source, str) or source == '-'
+
+
+def source_name(source):
+  """ Return a printable name for an input. """
+  if not is_stream(source):
+    return source
+  if source == '-':
+    return '<stdin>'
+  name = getattr(source, 'name', None)
+  if isinstance(name, str):
+    return name
+  return '<{}>'.format(type(source).__name__)
+
+
+def _decoded(lines):
+  # binary file objects (e.g., sys.stdin.buffer) yield bytes
+  for line in lines:
+    if isinstance(line, bytes):
+      line = line.decode()
+    yield line
+
+
+def _stringified(rows):
+  # rows from Python (e.g., a database cursor) may hold other types
+  for row in rows:
+    yield ['' if x is None else str(x) for x in row]
+
 
 def get_file_sample(fname, max_lines=100):
   """ Return up to the first `max_lines` of file `fname`.
@@ -47,6 +104,16 @@ def get_file_sample(fname, max_lines=100):
 
 
 
+# What to do with rows which cannot be tokenized or whose number of fields
+# differs from the header (see `csv_parser.set_bad_rows()`).
+BAD_ROWS_ABORT = 'abort'
+BAD_ROWS_SKIP = 'skip'
+BAD_ROWS_COUNT = 'count'
+BAD_ROWS_QUARANTINE = 'quarantine'
+BAD_ROW_POLICIES = [BAD_ROWS_ABORT, BAD_ROWS_SKIP, BAD_ROWS_COUNT,
+    BAD_ROWS_QUARANTINE]
+
+
 #
 # The good stuff.
 #
@@ -54,8 +121,20 @@ def get_file_sample(fname, max_lines=100):
 class csv_parser:
   """ A class representing a CSV file which is a thin wrapper above the python
   CSV library.
+
+  Besides file names, the input may be '-' for stdin, an open file object
+  (text or binary, e.g., a pipe), or an iterable of rows (sequences of
+  fields, e.g., a database cursor). These streaming inputs are sniffed from
+  their first lines and can only be read once with `rows()`; see
+  `is_stream()`.
   """
 
+  # how often `rows()` reports progress
+  PROGRESS_ROWS = 1 << 14
+
+  # bad rows reported individually by the 'count' policy, per pass
+  BAD_ROWS_REPORTED = 10
+
   def __init__(self, fname, delim=None, has_header=None):
     """ Construct a parser for a specific file.
     Args:
@@ -65,6 +144,17 @@ class csv_parser:
     """
 
     self._fname = fname
+    self._sampled_fraction = 1.0
+    self._rejected = 0
+    self._bad_policy = BAD_ROWS_ABORT
+    self._quarantine_name = None
+    self._quarantine = None
+    self._reset_bad_rows()
+
+    if is_stream(fname):
+      self._init_stream(fname, delim, has_header)
+      return
+    self._stream = None
 
     # Sniff the file to get a dialect, which stores metadata such as delimiter.
     try:
@@ -97,30 +187,384 @@ class csv_parser:
     self._file_has_header = has_header
 
 
-  def rows(self):
+  def _init_stream(self, source, delim, has_header):
+    """ Buffer the first lines of a streaming input to sniff it. """
+    if source == '-':
+      source = sys.stdin
+
+    # file objects yield lines of text, anything else yields rows
+    is_file = hasattr(source, 'read')
+    if is_file:
+      it = _decoded(source)
+    else:
+      it = _stringified(source)
+    sample = list(islice(it, 100))
+
+    if is_file:
+      text = ''.join(sample)
+      try:
+        self._dialect = csv.Sniffer().sniff(text)
+      except csv.Error as e:
+        print('ERROR {}: {}'.format(self.get_name(), e))
+        exit(1)
+      if delim is not None:
+        self._dialect.delimiter = delim
+      first = next(csv.reader(sample, self._dialect), [])
+    else:
+      # rows are already split into fields
+      self._dialect = csv.excel
+      first = sample[0] if sample else []
+      if has_header is None:
+        text = io.StringIO()
+        csv.writer(text).writerows(sample)
+        text = text.getvalue()
+      else:
+        text = ''
+
+    if has_header is None:
+      try:
+        has_header = csv.Sniffer().has_header(text)
+      except csv.Error:
+        has_header = True
+
+    if has_header:
+      self._header = list(first)
+    else:
+      self._header = [str(x+1) for x in range(len(first))]
+    self._file_has_header = has_header
+    self._stream = (is_file, chain(sample, it))
+
+
+  def _stream_rows(self):
+    """ Return an iterator over the (only) pass over a streaming input. """
+    if self._stream is None:
+      raise ValueError('ERROR {}: streaming input can only be read '
+          'once.'.format(self.get_name()))
+    is_file, it = self._stream
+    self._stream = None
+    if is_file:
+      it = csv.reader(it, self._dialect)
+    if self._file_has_header:
+      next(it, None)
+    return it
+
+
+  def set_bad_rows(self, policy=BAD_ROWS_ABORT, quarantine=None):
+    """ Choose what `rows()` and `parse_blocks()` do with bad rows: rows which
+    cannot be tokenized (e.g., an unterminated quote) and rows with fewer or
+    more fields than the header.
+
+    Bad rows are always counted (see `bad_rows()`), and then:
+
+      * 'abort' raises a ValueError naming the input and line.
+      * 'skip' drops them.
+      * 'count' drops them and prints the first `BAD_ROWS_REPORTED` of each
+        pass to stderr.
+      * 'quarantine' drops them and appends their fields to the CSV file
+        `quarantine`, in the dialect of the input. Rows which cannot be
+        tokenized have no fields and are only counted.
+
+    Args:
+      policy (str): One of `BAD_ROW_POLICIES`.
+      quarantine (str): The side file of the 'quarantine' policy.
+    """
+    if policy not in BAD_ROW_POLICIES:
+      raise ValueError('ERROR: unknown bad row policy "{}".'.format(policy))
+    if (policy == BAD_ROWS_QUARANTINE) != (quarantine is not None):
+      raise ValueError('ERROR: a quarantine file is required by, and only '
+          'used with, the "quarantine" policy.')
+    self._bad_policy = policy
+    self._quarantine_name = quarantine
+
+
+  def bad_rows(self):
+    """ Return the number of bad rows found during the last `rows()` or
+    `parse_blocks()`, as a dictionary of 'short' and 'long' rows (by number
+    of fields) and 'unparseable' ones.
+    """
+    return OrderedDict(zip(['short', 'long', 'unparseable'], self._bad))
+
+
+  def _reset_bad_rows(self):
+    self._bad = [0, 0, 0]
+
+
+  def _bad_row(self, reader, line, error=None):
+    """ Handle a bad row by the policy of `set_bad_rows()`. """
+    width = len(self._header)
+    if error is not None:
+      kind = 2
+      reason = str(error)
+    else:
+      kind = 0 if len(line) < width else 1
+      reason = 'expected {} fields, found {}'.format(width, len(line))
+    self._bad[kind] += 1
+
+    # rows of a stream of sequences have no line numbers
+    where = self.get_name()
+    if hasattr(reader, 'line_num'):
+      where += ' line {}'.format(reader.line_num)
+
+    if self._bad_policy == BAD_ROWS_ABORT:
+      raise ValueError('ERROR {}: {}.'.format(where, reason))
+    if self._bad_policy == BAD_ROWS_COUNT:
+      nbad = sum(self._bad)
+      if nbad <= csv_parser.BAD_ROWS_REPORTED:
+        print('WARNING {}: {}; skipping{}.'.format(where, reason,
+            ' (further bad rows are only counted)'
+            if nbad == csv_parser.BAD_ROWS_REPORTED else ''), file=stderr)
+    elif self._bad_policy == BAD_ROWS_QUARANTINE and line is not None:
+      if self._quarantine is None:
+        self._quarantine = open(self._quarantine_name, 'a', newline='')
+      csv.writer(self._quarantine, self._dialect).writerow(line)
+
+
+  def _checked(self, reader, predicate=None):
+    """ Yield the rows of `reader` with as many fields as the header and
+    accepted by `predicate`. Other rows are counted by `num_rejected()` or
+    handled by `_bad_row()`.
+    """
+    self._rejected = 0
+    self._reset_bad_rows()
+    width = len(self._header)
+    try:
+      while True:
+        try:
+          for line in reader:
+            if len(line) != width:
+              self._bad_row(reader, line)
+            elif predicate is None or predicate(line):
+              yield line
+            else:
+              self._rejected += 1
+          return
+        except csv.Error as e:
+          # the reader resumes at the next line
+          self._bad_row(reader, None, e)
+    finally:
+      if self._quarantine is not None:
+        self._quarantine.close()
+        self._quarantine = None
+
+
+  def rows(self, progress=None, predicate=None):
     """ Yield rows of the CSV file. Each row is represented as a list.
     
     Keys are taken from `_header` and values are those found in the file.
+
+    Args:
+      progress (func): Optional callback `progress(rows, nbytes)`, invoked
+                       every `PROGRESS_ROWS` rows and once at the end of the
+                       file. `nbytes` is the number of bytes consumed from the
+                       underlying (possibly compressed) file.
+      predicate (func): Optional function `predicate(row)`. Rows for which it
+                        returns False are skipped right after tokenizing and
+                        counted by `num_rejected()`.
+
+    Rows which cannot be tokenized or have a different number of fields than
+    the header are handled as set by `set_bad_rows()` (by default, a
+    ValueError is raised).
     """
 
-    with open_file(self._fname, 'r') as f:
+    if is_stream(self._fname):
+      reader = self._checked(self._stream_rows(), predicate)
+      nrows = 0
+      for line in reader:
+        yield line
+        nrows += 1
+        if progress is not None and nrows % csv_parser.PROGRESS_ROWS == 0:
+          progress(nrows, 0)
+      if progress is not None:
+        progress(nrows, 0)
+      return
+
+    with open(self._fname, 'rb') as raw, open_text(raw, self._fname) as f:
       reader = csv.reader(f, self._dialect)
-      try:
-        # skip header if file includes it
-        if self._file_has_header:
-          next(reader)
+      # skip header if file includes it
+      if self._file_has_header:
+        next(reader)
+      reader = self._checked(reader, predicate)
 
-        # grab each line
+      # grab each line
+      if progress is None:
+        yield from reader
+      else:
+        # only touch the file handle every PROGRESS_ROWS rows
+        nrows = 0
         for line in reader:
           yield line
+          nrows += 1
+          if nrows % csv_parser.PROGRESS_ROWS == 0:
+            progress(nrows, raw.tell())
+        progress(nrows, self.file_size())
 
-      # bad news
-      except csv.Error as e:
-        exit('ERROR {} line {}: {}'.format(self._fname, reader.line_num, e))
+  def read_blocks(self, block_size=1 << 20):
+    """ Yield the lines of the file in blocks, for a pipelined reader. See
+    `parse_blocks()`.
+
+    Args:
+      block_size (int): The approximate number of characters per block.
+
+    Yields:
+      Tuples of (lines, nbytes), where `nbytes` is the number of bytes
+      consumed from the underlying (possibly compressed) file.
+    """
+    with open(self._fname, 'rb') as raw, open_text(raw, self._fname) as f:
+      while True:
+        lines = f.readlines(block_size)
+        if not lines:
+          break
+        yield lines, raw.tell()
+
+  def parse_blocks(self, blocks, predicate=None, progress=None,
+      batch_size=1 << 12):
+    """ Tokenize blocks of lines from `read_blocks()` into batches of rows.
+
+    Quoted fields may span blocks. The header is skipped and bad rows are
+    handled as in `rows()`.
+
+    Args:
+      blocks (iterable): Tuples of (lines, nbytes) from `read_blocks()`.
+      predicate (func): Optional row filter, as in `rows()`.
+      progress (func): Optional callback `progress(rows, nbytes)`, as in
+                       `rows()`, invoked once per batch.
+      batch_size (int): The number of rows per batch.
+
+    Yields:
+      Lists of rows.
+    """
+    nbytes = [0]
+    def lines():
+      for block, pos in blocks:
+        yield from block
+        nbytes[0] = pos
+
+    reader = csv.reader(lines(), self._dialect)
+    nrows = 0
+    batch = []
+    if self._file_has_header:
+      next(reader, None)
+    for line in self._checked(reader, predicate):
+      batch.append(line)
+      if len(batch) == batch_size:
+        nrows += len(batch)
+        yield batch
+        batch = []
+        if progress is not None:
+          progress(nrows, nbytes[0])
+
+    if batch:
+      nrows += len(batch)
+      yield batch
+    if progress is not None:
+      progress(nrows, self.file_size())
+
+  def _accepted(self, reader, predicate):
+    for line in reader:
+      if predicate(line):
+        yield line
+      else:
+        self._rejected += 1
+
+  def num_rejected(self):
+    """ Return the number of rows rejected by the predicate during the last
+    `rows()`.
+    """
+    return self._rejected
+
+  def sample_rows(self, fraction, seed=0, block_size=1 << 16, predicate=None):
+    """ Yield a random sample of roughly `fraction` of the rows.
+
+    Uncompressed files are sampled in blocks of `block_size` bytes at random
+    offsets, so only the sampled part of the file is read. Compressed files
+    cannot be seeked cheaply and are sampled row by row while streaming
+    through the whole file, as are streaming inputs.
+
+    After the generator is exhausted, `sampled_fraction()` returns the
+    fraction of the file that was actually sampled.
+
+    Args:
+      fraction (float): The target fraction of rows, in (0, 1].
+      seed (int): The random seed.
+      block_size (int): The size of a sampled block in bytes.
+      predicate (func): Optional row filter, as in `rows()`.
+    """
+    rng = random.Random(seed)
+    self._sampled_fraction = 1.0
+    if fraction >= 1.0:
+      yield from self.rows(predicate=predicate)
+      return
+
+    if is_stream(self._fname) or self._fname.endswith('.gz') or \
+        self._fname.endswith('.bz2'):
+      nrows = 0
+      nsampled = 0
+      for line in self.rows():
+        nrows += 1
+        if rng.random() < fraction:
+          nsampled += 1
+          if predicate is None or predicate(line):
+            yield line
+          else:
+            self._rejected += 1
+      self._sampled_fraction = nsampled / max(nrows, 1)
+      return
+
+    self._rejected = 0
+    size = self.file_size()
+    blocks = list(range(0, size, block_size))
+    nblocks = min(len(blocks), max(1, int(round(len(blocks) * fraction))))
+    nbytes = 0
+    with open(self._fname, 'rb') as raw:
+      # the header holds no rows, so it is not part of the sampled fraction
+      header_bytes = len(raw.readline()) if self._file_has_header else 0
+      for start in sorted(rng.sample(blocks, nblocks)):
+        # skip the partial line, which belongs to the previous block; a line
+        # starting exactly at `start` is kept
+        if start > 0:
+          raw.seek(start - 1)
+          raw.readline()
+        else:
+          raw.seek(header_bytes)
+        lines = []
+        while raw.tell() < start + block_size:
+          line = raw.readline()
+          if not line:
+            break
+          nbytes += len(line)
+          lines.append(line.decode())
+        # rows of a quoted field split by the block boundary are dropped:
+        # they fail to tokenize or have the wrong number of fields
+        width = len(self._header)
+        reader = (line for line in csv.reader(lines, self._dialect)
+            if len(line) == width)
+        if predicate is not None:
+          reader = self._accepted(reader, predicate)
+        try:
+          yield from reader
+        except csv.Error:
+          continue
+    self._sampled_fraction = nbytes / max(size - header_bytes, 1)
+
+  def sampled_fraction(self):
+    """ Return the fraction of the file read by the last `sample_rows()`. """
+    return self._sampled_fraction
 
   def get_delimiter(self):
     return self._dialect.delimiter
 
+  def get_name(self):
+    """ Return a printable name for the input. """
+    return source_name(self._fname)
+
+  def file_size(self):
+    """ Return the size of the (possibly compressed) file in bytes, or 0 for a
+    streaming input.
+    """
+    if is_stream(self._fname):
+      return 0
+    return os.path.getsize(self._fname)
+
   def get_header(self):
     """ Return the header of the CSV file. """
     return self._header
@@ -0,0 +1,507 @@
+
+
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import socketserver
+from collections import OrderedDict
+
+from .index_map import index_map
+from .csv_parser import csv_parser, source_name
+from .row_filter import compile_filters
+from .builder import grab_cols, _val_col, _batched, _merge_lines
+from .build_cache import map_names
+from .checkpoint import _atomic_write
+
+
+# number of recent batches whose metrics are summarized
+METRICS_HISTORY = 1000
+
+
+def _percentile(sorted_vals, q):
+  if not sorted_vals:
+    return 0.
+  idx = min(int(q * len(sorted_vals)), len(sorted_vals) - 1)
+  return sorted_vals[idx]
+
+
+def _tentative_indices(imap, keys):
+  """ Return the index each key will have after `imap.extend_map(keys)`,
+  without modifying `imap`, and the list of keys which are not mapped yet.
+  """
+  new = OrderedDict()
+  base = len(imap)
+  inds = []
+  for key in keys:
+    idx = imap.lookup(key)
+    if idx is None:
+      idx = new.get(key)
+      if idx is None:
+        idx = base + len(new) + 1
+        new[key] = idx
+    inds.append(idx)
+  return inds, list(new)
+
+
+class build_daemon:
+  """ Incrementally build delta tensors from batches of new inputs, keeping
+  the index maps and configuration in memory between batches.
+
+  Indices are stable: a key keeps its index across batches, and new keys are
+  given the next indices of their mode in order of first appearance (the
+  sorting policies of the modes do not apply). Filters, types, values, and
+  merging of duplicates within a batch follow the config; pruning, mode
+  ordering, CSF, and sampling are not supported.
+
+  For batch N, the output directory receives:
+    batch-N.tns               the non-zeros of the batch, with global indices
+    batch-N.mode-M-FIELD.map  the keys first seen in the batch, in order of
+                              their indices (starting at the `first_index`
+                              reported in the metrics)
+  and the new keys are appended to the cumulative `mode-M-FIELD.map` files.
+  A batch is complete once its `.tns` file exists. The metrics of recent
+  batches are kept in `metrics.json`.
+
+  The maps are persisted so that a restarted daemon continues with the same
+  indices: the key counts of each batch are appended to
+  `daemon-journal.pickle` before its `.tns` file is published, and the
+  journal is periodically compacted into a snapshot of the maps in
+  `daemon-state.pickle`. A batch thus costs one small journal record, not a
+  copy of the maps. On restart, journaled batches whose `.tns` file exists
+  are replayed over the snapshot, and a batch interrupted before publishing
+  is discarded.
+  """
+
+  STATE_FILE = 'daemon-state.pickle'
+  JOURNAL_FILE = 'daemon-journal.pickle'
+  METRICS_FILE = 'metrics.json'
+
+  # the journal is compacted once larger than the snapshot and this size
+  JOURNAL_MIN_BYTES = 1 << 20
+
+  def __init__(self, config, out_dir):
+    """
+    Args:
+      config (tensor_config): Configuration of the modes, filters, values,
+                              and merging of each batch.
+      out_dir (str): The directory of the delta tensors and maps (created if
+                     needed).
+    """
+    self._config = config
+    self._dir = out_dir
+    os.makedirs(out_dir, exist_ok=True)
+
+    num_modes = config.num_modes()
+    self.indmaps = []
+    for m in range(num_modes):
+      mode = config.get_mode_by_idx(m)
+      self.indmaps.append(index_map(name=mode['field'],
+          type_func=mode['type'], sort=index_map.SORT_NONE))
+    self._map_names = map_names(config)
+    self.num_batches = 0
+    self.history = []
+    self._snapshot_bytes = 0
+    self._journal_bytes = 0
+
+    self._load_state()
+    for m in range(num_modes):
+      self.indmaps[m].build_map()
+    self._replay()
+    # the cumulative maps may be behind the state after a crash
+    for m in range(num_modes):
+      self.indmaps[m].write_file(self._path(self._map_names[m]))
+
+
+  def _path(self, name):
+    return os.path.join(self._dir, name)
+
+
+  def _load_state(self):
+    """ Load the snapshot of the maps. """
+    try:
+      with open(self._path(build_daemon.STATE_FILE), 'rb') as fin:
+        state = pickle.load(fin)
+        self._snapshot_bytes = fin.tell()
+    except OSError:
+      return
+    self.num_batches = state['batches']
+    for imap, counts in zip(self.indmaps, state['counts']):
+      imap.set_counts(counts)
+
+
+  def _replay(self):
+    """ Commit the journaled batches newer than the snapshot whose `.tns`
+    file was published. The journal is cut after the last committed batch,
+    dropping a batch interrupted before publishing (and its partial files)
+    or a record torn by a crash.
+    """
+    journal = self._path(build_daemon.JOURNAL_FILE)
+    if not os.path.exists(journal):
+      return
+    good = 0
+    with open(journal, 'rb') as fin:
+      while True:
+        try:
+          record = pickle.load(fin)
+        except (EOFError, pickle.UnpicklingError):
+          break
+        batch = record['batch']
+        if batch > self.num_batches:
+          if not os.path.exists(self._tns(batch)):
+            self._discard(batch)
+            break
+          self._commit(batch, record['counts'])
+        good = fin.tell()
+    os.truncate(journal, good)
+    self._journal_bytes = good
+
+
+  def _discard(self, batch):
+    """ Remove the partial files of a batch which was not published. """
+    prefix = 'batch-{:06d}'.format(batch)
+    partial = [self._tns(batch) + '.tmp'] + [self._path('{}.{}'.format(
+        prefix, name)) for name in self._map_names]
+    for path in partial:
+      if os.path.exists(path):
+        os.remove(path)
+
+
+  def _journal(self, batch, counts):
+    """ Durably append the key counts of a batch about to be published. """
+    data = pickle.dumps({'batch' : batch, 'counts' : counts},
+        protocol=pickle.HIGHEST_PROTOCOL)
+    with open(self._path(build_daemon.JOURNAL_FILE), 'ab') as fout:
+      fout.write(data)
+      fout.flush()
+      os.fsync(fout.fileno())
+    self._journal_bytes += len(data)
+
+
+  def _compact(self):
+    """ Write a snapshot of the maps and empty the journal. Journaled batches
+    are already in the snapshot if a crash leaves them behind.
+    """
+    state = {
+      'batches' : self.num_batches,
+      'counts' : [list(imap.get_counts().items()) for imap in self.indmaps],
+    }
+    data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    _atomic_write(self._path(build_daemon.STATE_FILE), data, binary=True)
+    self._snapshot_bytes = len(data)
+    _atomic_write(self._path(build_daemon.JOURNAL_FILE), b'', binary=True)
+    self._journal_bytes = 0
+
+
+  def _tns(self, batch):
+    return self._path('batch-{:06d}.tns'.format(batch))
+
+
+  def _commit(self, batch, counts):
+    """ Add the key counts of a published batch to the maps. """
+    for m in range(len(self.indmaps)):
+      self.indmaps[m].extend_counts(counts[m])
+    self.num_batches = batch
+
+
+  def process(self, inputs, submitted=None):
+    """ Build the delta tensor of a batch of inputs.
+
+    If any input cannot be read, nothing is written and the maps are left
+    unchanged.
+
+    Args:
+      inputs (list): The input files of the batch.
+      submitted (float): When the batch was submitted (`time.time()`), to
+                         report its wait (defaults to now).
+
+    Returns:
+      A dictionary of metrics: the batch number and inputs, the seconds
+      spent waiting and in each step ('read', 'map', 'emit', 'commit'), the
+      total 'latency' from submission, the rows read, rejected by filters,
+      bad (see `tensor_config.set_bad_rows()`), and skipped, the non-zeros
+      written, and the new keys of each mode.
+    """
+    config = self._config
+    num_modes = config.num_modes()
+    start = time.time()
+    if submitted is None:
+      submitted = start
+    batch = self.num_batches + 1
+    metrics = OrderedDict([('batch', batch),
+        ('inputs', [source_name(f) for f in inputs]),
+        ('wait', max(start - submitted, 0.))])
+
+    #
+    # Read and convert the rows
+    #
+    t = time.perf_counter()
+    keys = [[] for _ in range(num_modes)]
+    vals = []
+    nrows = 0
+    rejected = 0
+    bad = 0
+    for fin in inputs:
+      try:
+        parser = csv_parser(fin, config.get_delimiter(), config.has_header())
+        parser.set_bad_rows(config.get_bad_rows(), config.get_quarantine())
+        cols = grab_cols(parser, config)
+        accept = compile_filters(config, parser.get_header())
+        val_col = _val_col(parser, config)
+        for rows in _batched(parser.rows(predicate=accept)):
+          nrows += len(rows)
+          for m in range(num_modes):
+            keys[m].extend(self.indmaps[m].convert_batch(
+                [row[cols[m]] for row in rows]))
+          vals.extend(row[val_col] if val_col != -1 else 1 for row in rows)
+      except SystemExit as e:
+        # the parser exits on inputs it cannot parse; fail only this batch
+        raise ValueError('ERROR: cannot parse {}{}'.format(source_name(fin),
+            ': {}'.format(e.code) if isinstance(e.code, str) else ''))
+      rejected += parser.num_rejected()
+      bad += sum(parser.bad_rows().values())
+    metrics['read'] = time.perf_counter() - t
+
+    #
+    # Drop rows with skipped keys and find the indices of the rest
+    #
+    t = time.perf_counter()
+    keep = [r for r in range(nrows)
+        if all(keys[m][r] is not None for m in range(num_modes))]
+    if len(keep) < nrows:
+      keys = [[col[r] for r in keep] for col in keys]
+      vals = [vals[r] for r in keep]
+    inds = []
+    new_keys = []
+    for m in range(num_modes):
+      mode_inds, added = _tentative_indices(self.indmaps[m], keys[m])
+      inds.append(mode_inds)
+      new_keys.append(added)
+    metrics['map'] = time.perf_counter() - t
+
+    #
+    # Write the delta tensor and maps
+    #
+    t = time.perf_counter()
+    prefix = 'batch-{:06d}'.format(batch)
+    tns = self._tns(batch)
+    tmp = tns + '.tmp'
+    nonzeros = [[str(inds[m][r]) for m in range(num_modes)] + [str(vals[r])]
+        for r in range(len(vals))]
+    with open(tmp, 'w') as fout:
+      if config.get_merge_func():
+        nonzeros.sort(key=lambda nz: [int(i) for i in nz[:-1]])
+        nnz = _merge_lines(nonzeros, fout, config.get_merge_func())
+      else:
+        for nz in nonzeros:
+          print(' '.join(nz), file=fout)
+        nnz = len(nonzeros)
+    for m in range(num_modes):
+      with open(self._path('{}.{}'.format(prefix, self._map_names[m])),
+          'w') as fout:
+        for key in new_keys[m]:
+          print(key, file=fout)
+    metrics['emit'] = time.perf_counter() - t
+
+    #
+    # Journal the batch, publish it, then commit its keys
+    #
+    t = time.perf_counter()
+    first_index = [len(imap) + 1 for imap in self.indmaps]
+    counts = []
+    for m in range(num_modes):
+      mode_counts = OrderedDict()
+      for key in keys[m]:
+        mode_counts[key] = mode_counts.get(key, 0) + 1
+      counts.append(mode_counts)
+    self._journal(batch, counts)
+    os.replace(tmp, tns)
+    self._commit(batch, counts)
+    if self._journal_bytes > max(self._snapshot_bytes,
+        build_daemon.JOURNAL_MIN_BYTES):
+      self._compact()
+    for m in range(num_modes):
+      if new_keys[m]:
+        with open(self._path(self._map_names[m]), 'a') as fout:
+          for key in new_keys[m]:
+            print(key, file=fout)
+    metrics['commit'] = time.perf_counter() - t
+
+    metrics['latency'] = time.time() - submitted
+    metrics['rows'] = nrows
+    metrics['rejected_rows'] = rejected
+    metrics['bad_rows'] = bad
+    metrics['skipped_rows'] = nrows - len(keep)
+    metrics['nnz'] = nnz
+    metrics['new_keys'] = [len(k) for k in new_keys]
+    metrics['first_index'] = first_index
+    busy = time.time() - start
+    metrics['rows_per_sec'] = nrows / busy if busy > 0 else 0.
+
+    self.history.append(metrics)
+    del self.history[:-METRICS_HISTORY]
+    _atomic_write(self._path(build_daemon.METRICS_FILE),
+        json.dumps({'summary' : self.summary(), 'batches' : self.history},
+            indent=2))
+    return metrics
+
+
+  def summary(self):
+    """ Return the number of batches and rows and the mean, median, 95th
+    percentile, and maximum latency of the recent batches.
+    """
+    latencies = sorted(b['latency'] for b in self.history)
+    n = len(latencies)
+    return OrderedDict([
+      ('batches', self.num_batches),
+      ('recent', n),
+      ('rows', sum(b['rows'] for b in self.history)),
+      ('latency_mean', sum(latencies) / n if n else 0.),
+      ('latency_p50', _percentile(latencies, 0.5)),
+      ('latency_p95', _percentile(latencies, 0.95)),
+      ('latency_max', latencies[-1] if n else 0.),
+      ('mode_lengths', [len(imap) for imap in self.indmaps]),
+    ])
+
+
+def _report(metrics):
+  print('[batch {}] {} inputs, {} rows, {} nnz, {} new keys, {:0.1f} ms'.format(
+      metrics['batch'], len(metrics['inputs']), metrics['rows'],
+      metrics['nnz'], sum(metrics['new_keys']), metrics['latency'] * 1e3),
+      file=sys.stderr)
+
+
+class _request_handler(socketserver.StreamRequestHandler):
+  """ Handle one client connection: one JSON request per line, answered by
+  one JSON line.
+  """
+  def handle(self):
+    for line in self.rfile:
+      line = line.strip()
+      if not line:
+        continue
+      reply = self.server.dispatch(line, time.time())
+      self.wfile.write(json.dumps(reply).encode() + b'\n')
+      self.wfile.flush()
+      if self.server.stopping:
+        return
+
+
+class _daemon_server(socketserver.UnixStreamServer):
+  def __init__(self, path, daemon):
+    self.daemon = daemon
+    self.stopping = False
+    super().__init__(path, _request_handler)
+
+  def dispatch(self, line, received):
+    try:
+      request = json.loads(line.decode())
+      cmd = request.get('cmd', 'build')
+      if cmd == 'build':
+        metrics = self.daemon.process(request['inputs'], received)
+        _report(metrics)
+        return metrics
+      if cmd == 'stats':
+        return {'summary' : self.daemon.summary(),
+            'last' : self.daemon.history[-1] if self.daemon.history else None}
+      if cmd == 'shutdown':
+        self.stopping = True
+        return {'ok' : True}
+      return {'error' : 'unknown command "{}"'.format(cmd)}
+    except Exception as e:
+      print('ERROR: {}'.format(e), file=sys.stderr)
+      return {'error' : str(e)}
+
+
+def serve_socket(daemon, path):
+  """ Accept batches over a UNIX socket until a shutdown request.
+
+  Each request is a JSON object on its own line, answered by a JSON line:
+    {"inputs": ["/data/a.csv", ...]}  build a batch; returns its metrics
+    {"cmd": "stats"}                  returns the summary and last metrics
+    {"cmd": "shutdown"}               stop the daemon
+  Relative paths are resolved from the daemon's working directory. Errors
+  are returned as {"error": "..."}.
+  """
+  if os.path.exists(path):
+    os.remove(path)
+  server = _daemon_server(path, daemon)
+  server.timeout = 0.5
+  try:
+    while not server.stopping:
+      server.handle_request()
+  finally:
+    server.server_close()
+    if os.path.exists(path):
+      os.remove(path)
+
+
+def _spooled(spool_dir):
+  """ Return the input files waiting in a spool directory, by name. Hidden
+  files and files ending with '.tmp' are still being written.
+  """
+  names = []
+  for name in sorted(os.listdir(spool_dir)):
+    if name.startswith('.') or name.endswith('.tmp'):
+      continue
+    if os.path.isfile(os.path.join(spool_dir, name)):
+      names.append(name)
+  return names
+
+
+def watch_spool(daemon, spool_dir, poll=1.0, max_batches=None):
+  """ Build a batch from the files waiting in `spool_dir` every `poll`
+  seconds.
+
+  Files should be moved into the directory once complete (or written with a
+  hidden or '.tmp' name and renamed). After their batch, they are moved to
+  `spool_dir/done`, or to `spool_dir/failed` if it could not be built.
+
+  Args:
+    daemon (build_daemon): The daemon which builds the batches.
+    spool_dir (str): The directory to watch.
+    poll (float): Seconds between scans of the directory.
+    max_batches (int): Stop after this many batches (None to run forever).
+  """
+  done_dir = os.path.join(spool_dir, 'done')
+  failed_dir = os.path.join(spool_dir, 'failed')
+  os.makedirs(done_dir, exist_ok=True)
+  os.makedirs(failed_dir, exist_ok=True)
+
+  batches = 0
+  while max_batches is None or batches < max_batches:
+    names = _spooled(spool_dir)
+    if not names:
+      time.sleep(poll)
+      continue
+    paths = [os.path.join(spool_dir, name) for name in names]
+    submitted = max(os.path.getmtime(p) for p in paths)
+    try:
+      _report(daemon.process(paths, submitted))
+      dest = done_dir
+    except Exception as e:
+      print('ERROR: batch of {} failed: {}'.format(', '.join(names), e),
+          file=sys.stderr)
+      dest = failed_dir
+    for name, path in zip(names, paths):
+      shutil.move(path, os.path.join(dest, name))
+    batches += 1
+
+
+def serve(config):
+  """ Run the daemon of `config.get_serve()`, writing deltas to the output
+  of `config`. The inputs of `config` are built as the first batch when the
+  output directory has no previous state.
+  """
+  settings = config.get_serve()
+  daemon = build_daemon(config, config.get_output())
+  if daemon.num_batches == 0 and config.get_inputs():
+    _report(daemon.process(config.get_inputs()))
+
+  if settings['socket'] is not None:
+    serve_socket(daemon, settings['socket'])
+  else:
+    watch_spool(daemon, settings['spool'], settings['poll'])
+  return daemon
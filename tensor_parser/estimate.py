@@ -0,0 +1,245 @@
+
+
+import os
+import sys
+import csv
+import time
+import tempfile
+from collections import OrderedDict
+from contextlib import redirect_stderr
+
+from .index_map import index_map
+from .csv_parser import csv_parser, BAD_ROWS_SKIP
+from .row_filter import compile_filters
+
+
+def estimate_distinct(num_rows, sample_counts):
+  """ Extrapolate the number of distinct keys in `num_rows` rows from the key
+  counts of a uniform sample, using Shlosser's estimator (which favors skewed
+  data).
+
+  Args:
+    num_rows (int): The (estimated) number of rows in the full data.
+    sample_counts (iterable): The number of appearances of each distinct key
+                              in the sample.
+  """
+  freqs = dict() # number of keys that appear i times
+  for c in sample_counts:
+    freqs[c] = freqs.get(c, 0) + 1
+  sampled = sum(i * f for i, f in freqs.items())
+  distinct = sum(freqs.values())
+  if sampled == 0 or sampled >= num_rows or 1 not in freqs:
+    return distinct
+
+  q = sampled / num_rows
+  num = sum((1 - q) ** i * f for i, f in freqs.items())
+  den = sum(i * q * (1 - q) ** (i - 1) * f for i, f in freqs.items())
+  if den == 0:
+    return distinct
+  estimate = distinct + freqs.get(1, 0) * num / den
+  return int(round(min(estimate, num_rows)))
+
+
+def _map_bytes(imap):
+  """ Return the approximate memory of an `index_map` per key. """
+  nkeys = len(imap.get_counts())
+  if nkeys == 0:
+    return 0
+  return imap.memory_usage() / nkeys
+
+
+def _run_lengths(tensor_name, num_modes):
+  """ Yield the number of repeats of each distinct non-zero of a sorted
+  `.tns` file.
+  """
+  prev = None
+  count = 0
+  with open(tensor_name, 'r') as fin:
+    for line in fin:
+      inds = line.split()[:num_modes]
+      if inds == prev:
+        count += 1
+        continue
+      if prev is not None:
+        yield count
+      prev = inds
+      count = 1
+  if prev is not None:
+    yield count
+
+
+def estimate_tensor(config, fraction=0.01, seed=0):
+  """ Estimate the size and cost of building a tensor from a sample.
+
+  A sample of roughly `fraction` of the rows of each input is built into a
+  tensor with the same `index_map` types and merging as the real build. The
+  results are extrapolated to the full inputs. Nothing is written except
+  temporary files for the sampled rows and tensor, so memory is bounded by
+  the index maps of the sample.
+
+  Args:
+    config (tensor_config): Configuration for the tensor to construct
+    fraction (float): The fraction of rows to sample from each input.
+    seed (int): The random seed.
+
+  Returns:
+    A dictionary of estimates.
+  """
+  num_modes = config.num_modes()
+  indmaps = []
+  for m in range(num_modes):
+    mode = config.get_mode_by_idx(m)
+    indmaps.append(index_map(name=mode['field'], type_func=mode['type'],
+        sort=mode['sort']))
+
+  # the sampled keys and values, mapped once the maps are built
+  fd, rows_name = tempfile.mkstemp(suffix='.csv', dir=config.get_temp_dir())
+  fd_tns, tmp_name = tempfile.mkstemp(suffix='.tns',
+      dir=config.get_temp_dir())
+  os.close(fd_tns)
+  try:
+    with os.fdopen(fd, 'w', newline='') as rows_f:
+      sampled = _sample(config, fraction, seed, indmaps, csv.writer(rows_f))
+    return _estimate(config, indmaps, rows_name, tmp_name, sampled)
+  finally:
+    for name in [rows_name, tmp_name]:
+      if os.path.exists(name):
+        os.remove(name)
+
+
+def _sample(config, fraction, seed, indmaps, writer):
+  """ Sample rows and count keys, as in the first pass of a build, writing
+  the keys and value of each sampled row with `writer`.
+
+  Returns:
+    A dictionary of the number of sampled rows, the estimated number of rows
+    and accepted rows of the inputs, the rows read, and the time taken.
+  """
+  from .builder import grab_cols
+
+  num_modes = config.num_modes()
+  nsampled_all = 0
+  rows_est = 0.     # all rows of the inputs
+  accepted_est = 0. # rows which pass the filters
+  nread = 0
+  start = time.perf_counter()
+  with open(os.devnull, 'w') as redirect:
+    with redirect_stderr(redirect):
+      for fin in config.get_inputs():
+        parser = csv_parser(fin, config.get_delimiter(), config.has_header())
+        # estimates describe the rows which would be kept
+        parser.set_bad_rows(BAD_ROWS_SKIP)
+        cols = grab_cols(parser, config)
+        val_col = -1
+        if config.get_vals():
+          val_col = parser.get_header().index(config.get_vals())
+
+        accept = compile_filters(config, parser.get_header())
+        nsampled = 0
+        for row in parser.sample_rows(fraction, seed, predicate=accept):
+          nsampled += 1
+          for m in range(num_modes):
+            indmaps[m].add(row[cols[m]])
+          writer.writerow([row[c] for c in cols] +
+              [row[val_col] if val_col != -1 else 1])
+        frac = max(parser.sampled_fraction(), 1e-12)
+        nsampled_all += nsampled
+        nread += nsampled + parser.num_rejected()
+        rows_est += (nsampled + parser.num_rejected()) / frac
+        accepted_est += nsampled / frac
+  return {'sampled' : nsampled_all, 'rows' : rows_est,
+      'accepted' : accepted_est, 'read' : nread,
+      'time' : time.perf_counter() - start}
+
+
+def _estimate(config, indmaps, rows_name, tmp_name, sampled):
+  """ Map the sampled rows of `_sample()` into the `.tns` file `tmp_name`,
+  merge it, and extrapolate the estimates of `estimate_tensor()`.
+  """
+  from .builder import merge_dups, sort_tensor
+
+  num_modes = config.num_modes()
+  rows_est = sampled['rows']
+  accepted_est = sampled['accepted']
+  nread = sampled['read']
+  count_time = sampled['time']
+  for m in range(num_modes):
+    indmaps[m].build_map()
+
+  #
+  # Emit and merge the sampled tensor
+  #
+  nnz = 0
+  tns_bytes = 0
+  start = time.perf_counter()
+  with open(rows_name, 'r', newline='') as fin, open(tmp_name, 'w') as fout:
+    for row in csv.reader(fin):
+      inds = [indmaps[m][row[m]] for m in range(num_modes)]
+      if None in inds:
+        continue
+      line = '{} {}'.format(' '.join(str(i) for i in inds), row[num_modes])
+      print(line, file=fout)
+      nnz += 1
+      tns_bytes += len(line) + 1
+  emit_time = time.perf_counter() - start
+
+  nsampled = sampled['sampled']
+  scale = accepted_est / max(nsampled, 1)
+  nnz_before = int(round(nnz * scale))
+  nnz_after = nnz_before
+  if config.get_merge_func() and nnz > 0:
+    # count the repeats of each non-zero from the sorted sample
+    sort_tensor(tmp_name, list(range(num_modes)), config.get_temp_dir())
+    nnz_after = estimate_distinct(nnz_before,
+        _run_lengths(tmp_name, num_modes))
+
+  start = time.perf_counter()
+  if config.get_merge_func() and nnz > 0:
+    merge_dups(tmp_name, num_modes, merge_func=config.get_merge_func(),
+        tmp_dir=config.get_temp_dir())
+  merge_time = time.perf_counter() - start
+
+  #
+  # Extrapolate
+  #
+  dims = [estimate_distinct(accepted_est, indmaps[m].get_counts().values())
+      for m in range(num_modes)]
+
+  # indices get longer as the modes grow
+  line_bytes = tns_bytes / max(nnz, 1)
+  for m in range(num_modes):
+    line_bytes += len(str(dims[m])) - len(str(max(len(indmaps[m]), 1)))
+
+  # three passes over the inputs, plus merging
+  build_time = 3 * count_time * rows_est / max(nread, 1) + \
+      scale * (emit_time + merge_time)
+
+  return OrderedDict([
+    ('sampled_rows', nsampled),
+    ('rows', int(round(rows_est))),
+    ('dims', OrderedDict((config.get_mode_by_idx(m)['field'], dims[m])
+        for m in range(num_modes))),
+    ('nnz_before_merge', nnz_before),
+    ('nnz_after_merge', nnz_after),
+    ('tns_bytes', int(line_bytes * nnz_after)),
+    ('index_map_bytes', int(sum(_map_bytes(indmaps[m]) * dims[m]
+        for m in range(num_modes)))),
+    ('sample_rows_per_sec', nsampled / count_time if count_time > 0 else 0.),
+    ('build_seconds', build_time),
+  ])
+
+
+def print_estimate(est, fout=None):
+  """ Print the results of `estimate_tensor()` in human-readable form. """
+  fout = fout or sys.stdout
+  print('Dry run: sampled {} of ~{} rows'.format(est['sampled_rows'],
+      est['rows']), file=fout)
+  for field, dim in est['dims'].items():
+    print('  mode "{}": ~{} indices'.format(field, dim), file=fout)
+  print('  nnz: ~{} before merging, ~{} after merging'.format(
+      est['nnz_before_merge'], est['nnz_after_merge']), file=fout)
+  print('  tensor file: ~{:0.1f} MB'.format(est['tns_bytes'] / 1e6), file=fout)
+  print('  index maps: ~{:0.1f} MB'.format(est['index_map_bytes'] / 1e6),
+      file=fout)
+  print('  build time: ~{:0.0f} s ({:0.0f} sampled rows/s)'.format(
+      est['build_seconds'], est['sample_rows_per_sec']), file=fout)
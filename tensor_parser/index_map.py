@@ -1,8 +1,255 @@
 
 
 import sys
-from collections import OrderedDict
-from dateutil import parser as date_parser
+import math
+import datetime
+from collections import OrderedDict, Counter
+from itertools import islice
+
+
+#
+# Batch type functions. A batch function takes a list of raw strings and
+# returns a tuple of (converted keys, failure mask), where the mask is a
+# sequence of bools marking the keys which could not be converted (or None if
+# all were converted).
+#
+def _convert_each(type_func, keys):
+  """ Convert keys one at a time with `type_func`. """
+  newkeys = []
+  failed = []
+  for key in keys:
+    try:
+      newkey = type_func(key)
+    except:
+      newkey = None
+    newkeys.append(newkey)
+    failed.append(newkey is None)
+  return newkeys, failed
+
+
+def _convert_map(type_func, keys):
+  """ Convert keys with a single `map()` over `type_func`, falling back to
+  converting one key at a time if any key cannot be converted.
+  """
+  try:
+    return list(map(type_func, keys)), None
+  except:
+    return _convert_each(type_func, keys)
+
+
+def _batch_str(keys):
+  return keys, None
+
+
+def _batch_int(keys):
+  return _convert_map(int, keys)
+
+
+def _batch_float(keys):
+  return _convert_map(float, keys)
+
+
+def batch_roundf(ndigits, keys):
+  """ The batch function of floats rounded to `ndigits` of precision. """
+  flts, failed = _batch_float(keys)
+  return [round(f, ndigits) if f is not None else None for f in flts], failed
+
+
+def batch_type(batch_func):
+  """ Make a type function from a batch function.
+
+  The returned function converts a single key (raising ValueError if it
+  cannot be converted) and exposes `batch_func` as its `batch` attribute.
+  """
+  def type_func(key):
+    newkeys, failed = batch_func([key])
+    if (failed is not None and failed[0]) or newkeys[0] is None:
+      raise ValueError('cannot convert "{}"'.format(key))
+    return newkeys[0]
+  type_func.batch = batch_func
+  return type_func
+
+
+#
+# Epoch timestamp types. Keys are ints (so they sort and bucket
+# arithmetically) which print as readable UTC dates in `.map` files.
+#
+_EPOCH = datetime.datetime(1970, 1, 1)
+_DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+# the seconds which print as dates, from year 1 to 9999
+_EPOCH_MIN = (datetime.datetime.min - _EPOCH) // datetime.timedelta(seconds=1)
+_EPOCH_MAX = (datetime.datetime.max - _EPOCH) // datetime.timedelta(seconds=1)
+
+
+class epoch_time(int):
+  """ Seconds since the Unix epoch, printed as 'YYYY-MM-DD HH:MM:SS'.
+
+  Raises ValueError for times which cannot be printed as dates, so that they
+  are skipped when counting keys rather than failing when writing maps.
+  """
+  def __new__(cls, secs):
+    if not _EPOCH_MIN <= secs <= _EPOCH_MAX:
+      raise ValueError('timestamp {} is out of range'.format(secs))
+    return super().__new__(cls, secs)
+
+  def __str__(self):
+    return (_EPOCH + datetime.timedelta(seconds=int(self))).strftime(
+        '%Y-%m-%d %H:%M:%S')
+
+
+class epoch_time_ms(int):
+  """ Milliseconds since the Unix epoch, printed as
+  'YYYY-MM-DD HH:MM:SS.mmm'.
+  """
+  def __new__(cls, ms):
+    if not _EPOCH_MIN * 1000 <= ms < (_EPOCH_MAX + 1) * 1000:
+      raise ValueError('timestamp {} is out of range'.format(ms))
+    return super().__new__(cls, ms)
+
+  def __str__(self):
+    secs, ms = divmod(int(self), 1000)
+    return '{}.{:03d}'.format(epoch_time(secs), ms)
+
+
+class weekday(int):
+  """ A day of the week from 0 (Monday) to 6, printed as its name. """
+  def __str__(self):
+    return _DAY_NAMES[self]
+
+
+def _parse_epoch(key):
+  """ Parse an integer timestamp, flooring fractional ones. """
+  try:
+    return int(key)
+  except ValueError:
+    return math.floor(float(key))
+
+
+def _batch_parse_epoch(keys):
+  try:
+    return list(map(int, keys)), None
+  except:
+    return _convert_each(_parse_epoch, keys)
+
+
+def _batch_arith(func, keys):
+  """ Parse timestamps and apply `func` to those that were parsed. """
+  ints, failed = _batch_parse_epoch(keys)
+  if failed is None:
+    return [func(t) for t in ints], None
+  return [func(t) if t is not None else None for t in ints], failed
+
+
+class _epoch_type:
+  """ A type which parses an integer timestamp and applies a function to
+  it, with a batch version. Types are objects rather than closures so that
+  they can be pickled, e.g., to build in worker processes.
+  """
+  def __init__(self, func):
+    self.func = func
+
+  def __call__(self, key):
+    return self.func(_parse_epoch(key))
+
+  def batch(self, keys):
+    return _batch_arith(self.func, keys)
+
+
+def _to_weekday(secs):
+  # 1970-01-01 was a Thursday
+  return weekday((secs // 86400 + 3) % 7)
+
+
+class _truncate:
+  """ Truncate epoch seconds to the start of their `width`-second interval.
+  """
+  def __init__(self, width):
+    self.width = width
+
+  def __call__(self, secs):
+    return epoch_time(secs - secs % self.width)
+
+
+def epoch_bucket(width):
+  """ Return a type which truncates epoch seconds to the start of their
+  `width`-second interval (e.g., 3600 for hours).
+  """
+  width = int(width)
+  if width <= 0:
+    raise ValueError('bucket width must be positive')
+  return _epoch_type(_truncate(width))
+
+
+class _round_float:
+  def __init__(self, ndigits):
+    self.ndigits = ndigits
+
+  def __call__(self, key):
+    return round(float(key), self.ndigits)
+
+  def batch(self, keys):
+    return batch_roundf(self.ndigits, keys)
+
+
+def round_float(ndigits):
+  """ Return a type which rounds floats to `ndigits` of precision. """
+  return _round_float(ndigits)
+
+
+#
+# Date types (module functions, so that they can be pickled)
+#
+_date_parse = None
+
+def _parse_date(x):
+  """ Parse a date with `dateutil`, which is imported on the first date
+  since it is slow to import.
+  """
+  global _date_parse
+  if _date_parse is None:
+    from dateutil import parser as date_parser
+    _date_parse = date_parser.parse
+  return _date_parse(x)
+
+def _date_year(x):
+  return _parse_date(x).year
+
+def _date_month(x):
+  return _parse_date(x).month
+
+def _date_day(x):
+  return _parse_date(x).day
+
+def _date_hour(x):
+  return _parse_date(x).hour
+
+def _date_min(x):
+  return _parse_date(x).minute
+
+def _date_sec(x):
+  return _parse_date(x).second
+
+
+# batch functions of builtin types, which cannot have attributes
+_BATCH_FUNCS = {
+  str : _batch_str,
+  int : _batch_int,
+  float : _batch_float,
+}
+
+
+def get_batch_func(type_func):
+  """ Return the batch function of a type: its `batch` attribute, or a
+  batch version of a builtin type, or None.
+  """
+  batch = getattr(type_func, 'batch', None)
+  if batch is not None:
+    return batch
+  try:
+    return _BATCH_FUNCS.get(type_func)
+  except TypeError:
+    # unhashable type function
+    return None
 
 
 class index_map:
@@ -13,7 +260,10 @@ class index_map:
   start from 1.
 
   After all keys have been added with `add()`, the map to continuous indices
-  must be built with `build_map()`. Mappings of keys -> indices can then be
+  must be built with `build_map()`. Keys are ordered according to the `sort`
+  policy: sorted by key (`True`), by first appearance (`False`), or by
+  decreasing count (`SORT_COUNT`), so that the densest slices receive the
+  smallest indices. Mappings of keys -> indices can then be
   accessed with `__getitem__()` (i.e., `my_map['apple']` will return its index
   in the tensor).
   """
@@ -29,13 +279,28 @@ class index_map:
   #
   # date types -- we have a lot of these
   #
-  TYPE_DATE  = date_parser.parse
-  TYPE_DATE_YEAR  = lambda x: date_parser.parse(x).year
-  TYPE_DATE_MONTH = lambda x: date_parser.parse(x).month
-  TYPE_DATE_DAY   = lambda x: date_parser.parse(x).day
-  TYPE_DATE_HOUR  = lambda x: date_parser.parse(x).hour
-  TYPE_DATE_MIN   = lambda x: date_parser.parse(x).minute
-  TYPE_DATE_SEC   = lambda x: date_parser.parse(x).second
+  TYPE_DATE  = _parse_date
+  TYPE_DATE_YEAR  = _date_year
+  TYPE_DATE_MONTH = _date_month
+  TYPE_DATE_DAY   = _date_day
+  TYPE_DATE_HOUR  = _date_hour
+  TYPE_DATE_MIN   = _date_min
+  TYPE_DATE_SEC   = _date_sec
+
+  #
+  # epoch timestamp types -- computed arithmetically, see also `epoch_bucket`
+  #
+  TYPE_EPOCH    = _epoch_type(epoch_time)
+  TYPE_EPOCH_MS = _epoch_type(epoch_time_ms)
+  TYPE_DOW      = _epoch_type(_to_weekday)
+
+
+  #
+  # Ordering policies.
+  #
+  SORT_NONE  = False
+  SORT_KEY   = True
+  SORT_COUNT = 'count-desc'
 
 
   def __init__(self, name="", type_func=TYPE_STR, sort=True):
@@ -45,6 +310,7 @@ class index_map:
     self._name = name
 
     self._type_func = type_func
+    self._batch_func = get_batch_func(type_func)
     self._is_mapped = False
     self._sort = sort
 
@@ -59,21 +325,74 @@ class index_map:
       return None
 
 
+  def __skip(self, key):
+    if key not in self.skipped:
+      print('Mode {} skipping key: "{}"'.format(self._name, key),
+          file=sys.stderr)
+      self.skipped.add(key)
+
+
   def add(self, key):
     """ Increment the count of a key in index_map.
+
+    Returns the key after conversion by the type function, or None if the key
+    was skipped.
     """
     newkey = self.__access_key(key)
     if newkey is None:
-      if key not in self.skipped:
-        print('Mode {} skipping key: "{}"'.format(self._name, key),
-            file=sys.stderr)
-        self.skipped.add(key)
-      return
+      self.__skip(key)
+      return None
 
     if newkey in self._keys:
       self._keys[newkey] += 1
     else:
       self._keys[newkey] = 1
+    return newkey
+
+
+  def convert_batch(self, keys):
+    """ Convert a list of keys with the type function.
+
+    Types with a batch function (see `get_batch_func()`) convert the whole
+    list in one call; others are mapped over the list, one key at a time
+    only if some key cannot be converted.
+
+    Returns:
+      The list of converted keys, with None for keys that cannot be
+      converted.
+    """
+    keys = [k if isinstance(k, str) else str(k) for k in keys]
+    if self._batch_func is None:
+      return _convert_map(self._type_func, keys)[0]
+    try:
+      newkeys, failed = self._batch_func(keys)
+    except:
+      return _convert_each(self._type_func, keys)[0]
+    # e.g., NumPy arrays from a vectorized batch function
+    newkeys = newkeys.tolist() if hasattr(newkeys, 'tolist') else \
+        list(newkeys)
+    if failed is not None:
+      for i in range(len(newkeys)):
+        if failed[i]:
+          newkeys[i] = None
+    return newkeys
+
+
+  def add_batch(self, keys):
+    """ Increment the counts of a list of keys, as with `add()` for each.
+
+    Returns:
+      The list of converted keys, with None for skipped keys.
+    """
+    newkeys = self.convert_batch(keys)
+    counts = Counter(newkeys)
+    if None in counts:
+      del counts[None]
+      for key, newkey in zip(keys, newkeys):
+        if newkey is None:
+          self.__skip(key)
+    self.add_counts(counts)
+    return newkeys
 
 
   def sub(self, key):
@@ -87,6 +406,56 @@ class index_map:
       self._keys[newkey] -= 1
 
   
+  def reset_counts(self, counts):
+    """ Replace the counts of all keys.
+
+    Keys are kept in their order of first appearance. Keys not present in
+    `counts` are given a count of 0, and are thus removed by `build_map()`.
+
+    Args:
+      counts (dict): Maps keys (after conversion by the type function) to
+                     their new counts.
+    """
+    for key in self._keys:
+      self._keys[key] = counts.get(key, 0)
+
+
+  def get_counts(self):
+    """ Return the dictionary of converted keys -> counts, in order of first
+    appearance. It must not be modified.
+    """
+    return self._keys
+
+
+  def add_counts(self, counts):
+    """ Add counts of keys, e.g., from another `index_map` over other rows.
+
+    Args:
+      counts (dict): Maps keys (already converted by the type function) to
+                     the counts to add, in order of first appearance.
+    """
+    for key, count in counts.items():
+      self._keys[key] = self._keys.get(key, 0) + count
+
+
+  def set_counts(self, counts):
+    """ Replace all keys and their counts.
+
+    Args:
+      counts (iterable): Pairs of (key, count), with keys already converted
+                         by the type function, in order of first appearance.
+    """
+    self._keys = OrderedDict(counts)
+
+
+  def same_keys(self, other):
+    """ Return whether `other` has the same type, ordering, and key counts, so
+    that both build the same map.
+    """
+    return self._type_func is other._type_func and \
+        self._sort == other._sort and self._keys == other._keys
+
+
   def get_count(self, key):
     """ Return the number of appearances of `key`.  """
     newkey = self.__access_key(key)
@@ -104,7 +473,10 @@ class index_map:
     # Grab keys that appear at least once (skip those that have been removed)
     uniques = list(filter((lambda x: self._keys[x] > 0), self._keys.keys()))
 
-    if self._sort:
+    if self._sort == index_map.SORT_COUNT:
+      # stable, so ties keep their order of first appearance
+      uniques.sort(key=lambda x: self._keys[x], reverse=True)
+    elif self._sort:
       uniques.sort()
 
     # build actual mapping
@@ -113,6 +485,71 @@ class index_map:
 
     self._is_mapped = True
 
+  def extend_map(self, newkeys):
+    """ Count converted keys and map those which are not mapped yet to the
+    next indices, in order of first appearance.
+
+    Unlike `build_map()`, the indices of keys that are already mapped never
+    change, so maps can grow as new data arrives.
+
+    Args:
+      newkeys (list): Keys already converted by the type function (e.g., by
+                      `convert_batch()`). None entries are ignored.
+
+    Returns:
+      The list of keys given new indices, in order of their indices.
+    """
+    added = []
+    for key in newkeys:
+      if key is None:
+        continue
+      self._keys[key] = self._keys.get(key, 0) + 1
+      if key not in self._map:
+        self._map[key] = len(self._map) + 1
+        added.append(key)
+    self._is_mapped = True
+    return added
+
+  def extend_counts(self, counts):
+    """ Like `extend_map()`, given the counts of the converted keys.
+
+    Args:
+      counts (dict): Maps keys to the counts to add, in order of first
+                     appearance.
+
+    Returns:
+      The list of keys given new indices, in order of their indices.
+    """
+    added = []
+    for key, count in counts.items():
+      self._keys[key] = self._keys.get(key, 0) + count
+      if key not in self._map:
+        self._map[key] = len(self._map) + 1
+        added.append(key)
+    self._is_mapped = True
+    return added
+
+  def memory_usage(self):
+    """ Estimate the bytes used by the keys, counts, and map, from the sizes
+    of the dictionaries and of a sample of the keys.
+    """
+    nbytes = sys.getsizeof(self._keys) + sys.getsizeof(self._map)
+    if self._keys:
+      sample = list(islice(self._keys, 64))
+      per_key = sum(sys.getsizeof(k) for k in sample) / len(sample)
+      # each count and index is an int object of its own
+      nbytes += int(len(self._keys) * (per_key + 32))
+    return nbytes
+
+
+  def account(self, budget, release=False):
+    """ Report the memory usage of this map to a `memory_budget`, or that it
+    was freed if `release` is set.
+    """
+    budget.update('index_map:{}'.format(self._name),
+        0 if release else self.memory_usage())
+
+
   def is_mapped(self):
     return self._is_mapped
 
@@ -136,6 +573,24 @@ class index_map:
       return None
     return self._map[key]
 
+  def lookup(self, newkey):
+    """ Return the index of a key that was already converted by the type
+    function (e.g., as returned by `add()`), or None if it is not mapped.
+    """
+    if not self._is_mapped:
+      raise Exception('ERROR: must use `build_map()` before accessing map.')
+    return self._map.get(newkey)
+
+  def get_batch(self, keys):
+    """ Return the list of indices of a list of keys, as with
+    `__getitem__()` for each.
+    """
+    if not self._is_mapped:
+      raise Exception('ERROR: must use `build_map()` before accessing map.')
+    get = self._map.get
+    return [get(k) if k is not None else None
+        for k in self.convert_batch(keys)]
+
   def __len__(self):
     return len(self._map)
 
@@ -0,0 +1,127 @@
+
+
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+
+# bytes per unit suffix of `parse_size()`
+_UNITS = {'' : 1, 'K' : 1 << 10, 'M' : 1 << 20, 'G' : 1 << 30, 'T' : 1 << 40}
+
+
+def parse_size(text):
+  """ Parse a size such as '512M', '16G', or '1048576' (bytes).
+
+  Raises:
+    ValueError: If `text` is not a size.
+  """
+  match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([KMGT]?)i?B?\s*$', text, re.I)
+  if not match:
+    raise ValueError('ERROR: invalid size "{}".'.format(text))
+  return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def format_size(nbytes):
+  """ Format a number of bytes for messages, e.g., '1.5 GB'. """
+  for unit in ['T', 'G', 'M', 'K']:
+    if nbytes >= _UNITS[unit]:
+      return '{:0.1f} {}B'.format(nbytes / _UNITS[unit], unit)
+  return '{} B'.format(nbytes)
+
+
+class memory_budget:
+  """ Account the memory of the components of a build against a limit.
+
+  Components (e.g., the index maps, the pruner, the external sort, and the
+  output buffers) report their estimated usage with `update()`, or ask for
+  memory with `grant()` before allocating it. When the limit is reached they
+  adapt (spill to disk, use smaller batches or sort splits), and record what
+  they did with `decide()`. Decisions are printed to stderr and reported in
+  the build statistics.
+
+  Without a limit, usage is still accounted but nothing is constrained.
+  """
+
+  def __init__(self, limit=None, verbose=True):
+    """
+    Args:
+      limit (int): The budget in bytes (None for no limit).
+      verbose (bool): Print decisions to stderr.
+    """
+    self.limit = limit
+    self.peak = 0
+    self.decisions = []
+    self._verbose = verbose
+    self._usage = OrderedDict() # component -> bytes
+    self._lock = threading.Lock()
+
+
+  def update(self, component, nbytes):
+    """ Set the estimated bytes used by `component`. """
+    with self._lock:
+      self._usage[component] = nbytes
+      self.peak = max(self.peak, sum(self._usage.values()))
+
+
+  def release(self, component):
+    """ Record that `component` freed its memory. """
+    self.update(component, 0)
+
+
+  def used(self):
+    """ Return the bytes used by all components. """
+    with self._lock:
+      return sum(self._usage.values())
+
+
+  def available(self, component=None):
+    """ Return the bytes left for `component` (including those it already
+    uses), or None without a limit.
+    """
+    if self.limit is None:
+      return None
+    with self._lock:
+      others = sum(v for k, v in self._usage.items() if k != component)
+    return max(self.limit - others, 0)
+
+
+  def over(self):
+    """ Return whether the accounted usage exceeds the limit. """
+    return self.limit is not None and self.used() > self.limit
+
+
+  def grant(self, component, want, minimum=0):
+    """ Reserve up to `want` bytes for `component`, but at least `minimum`.
+
+    Returns:
+      The number of bytes granted, which is `want` without a limit.
+    """
+    avail = self.available(component)
+    nbytes = want if avail is None else max(min(want, avail), minimum)
+    self.update(component, nbytes)
+    return nbytes
+
+
+  def decide(self, component, action, detail=''):
+    """ Record an adaptation of `component` to the limit. """
+    decision = OrderedDict([('component', component), ('action', action),
+        ('detail', detail), ('used', self.used())])
+    self.decisions.append(decision)
+    if self._verbose:
+      print('memory limit: {}: {}{}'.format(component, action,
+          ' ({})'.format(detail) if detail else ''), file=sys.stderr)
+
+
+  def to_dict(self):
+    """ Return the limit, peak and final usage, and decisions as a
+    JSON-serializable dictionary.
+    """
+    with self._lock:
+      usage = OrderedDict(self._usage)
+    return OrderedDict([
+      ('limit', self.limit),
+      ('peak', self.peak),
+      ('components', usage),
+      ('decisions', self.decisions),
+    ])
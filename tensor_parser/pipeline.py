@@ -0,0 +1,130 @@
+
+
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+
+# marks the end of a stage's output
+_DONE = object()
+
+# seconds between checks for a failed stage while blocked on a queue
+_POLL = 0.1
+
+
+class pipeline:
+  """ A chain of stages connected by bounded queues, each running in its own
+  thread.
+
+  A stage is a function taking an iterator over the outputs of the previous
+  stage (None for the first stage) and yielding its own outputs. Queues hold
+  at most `depth` items, so a fast stage blocks until the next one catches
+  up. The last stage runs in the calling thread. If any stage raises, the
+  others are stopped and the exception is re-raised by `run()`.
+
+  Threads only overlap work which releases the GIL, such as reading and
+  decompressing files and writing output, with the Python work of the other
+  stages. For each stage, `stats` records the number of items produced, the
+  seconds spent blocked on its input and output queues, and its utilization
+  (the fraction of its lifetime not spent blocked).
+  """
+
+  def __init__(self, depth=4):
+    """
+    Args:
+      depth (int): The capacity of each queue between stages.
+    """
+    self._depth = depth
+    self._stages = []
+    self._stop = threading.Event()
+    self._error = None
+    self.stats = OrderedDict()
+
+
+  def add_stage(self, name, func):
+    """ Append a stage.
+
+    Args:
+      name (str): The name of the stage in `stats`.
+      func (func): A generator function `func(items)`.
+    """
+    self._stages.append((name, func))
+    self.stats[name] = OrderedDict([('items', 0), ('wall', 0.),
+        ('wait_in', 0.), ('wait_out', 0.), ('utilization', 0.)])
+
+
+  def _get(self, q, record):
+    """ Iterate over the items of queue `q` until the end is reached. """
+    while True:
+      start = time.perf_counter()
+      while True:
+        try:
+          item = q.get(timeout=_POLL)
+          break
+        except queue.Empty:
+          if self._stop.is_set():
+            return
+      record['wait_in'] += time.perf_counter() - start
+      if item is _DONE:
+        return
+      yield item
+
+
+  def _put(self, q, item, record):
+    start = time.perf_counter()
+    while not self._stop.is_set():
+      try:
+        q.put(item, timeout=_POLL)
+        break
+      except queue.Full:
+        pass
+    record['wait_out'] += time.perf_counter() - start
+
+
+  def _run_stage(self, name, func, q_in, q_out):
+    record = self.stats[name]
+    start = time.perf_counter()
+    try:
+      items = self._get(q_in, record) if q_in is not None else None
+      for item in func(items):
+        record['items'] += 1
+        if q_out is not None:
+          self._put(q_out, item, record)
+        if self._stop.is_set():
+          break
+    except BaseException as e:
+      if self._error is None:
+        self._error = e
+      self._stop.set()
+    finally:
+      if q_out is not None:
+        self._put(q_out, _DONE, record)
+      record['wall'] = time.perf_counter() - start
+      if record['wall'] > 0:
+        busy = record['wall'] - record['wait_in'] - record['wait_out']
+        record['utilization'] = max(busy, 0.) / record['wall']
+
+
+  def run(self):
+    """ Run all stages until the last one finishes. """
+    queues = [queue.Queue(maxsize=self._depth)
+        for _ in range(len(self._stages) - 1)]
+    threads = []
+    for i, (name, func) in enumerate(self._stages[:-1]):
+      q_in = queues[i-1] if i > 0 else None
+      t = threading.Thread(target=self._run_stage,
+          args=(name, func, q_in, queues[i]), daemon=True)
+      t.start()
+      threads.append(t)
+
+    name, func = self._stages[-1]
+    q_in = queues[-1] if queues else None
+    try:
+      self._run_stage(name, func, q_in, None)
+    finally:
+      self._stop.set()
+      for t in threads:
+        t.join()
+    if self._error is not None:
+      raise self._error
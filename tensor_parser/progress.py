@@ -0,0 +1,76 @@
+
+
+import sys
+import time
+from datetime import timedelta
+
+
+class progress_reporter:
+  """ Print the progress of a build to stderr at a throttled interval.
+
+  An instance is a callback suitable for `build_tensor(progress=...)`. It is
+  invoked every few thousand rows (see `csv_parser.PROGRESS_ROWS`), so it only
+  reads the clock once per call and prints at most once per `interval`
+  seconds. Rates and the ETA are computed since the start of the current
+  phase.
+  """
+
+  def __init__(self, interval=5.0, stream=None):
+    """
+    Args:
+      interval (float): The minimum number of seconds between reports.
+      stream (file): Where to print reports (default: stderr).
+    """
+    self._interval = interval
+    self._stream = stream
+    self._phase = None
+    self._start = 0.
+    self._last = 0.
+
+
+  def __call__(self, phase, file_idx, num_files, nbytes, total_bytes, rows):
+    """ Report progress.
+
+    Args:
+      phase (str): The name of the current phase of the build.
+      file_idx (int): The current input (one-indexed).
+      num_files (int): The number of inputs.
+      nbytes (int): Bytes read so far during this phase, over all inputs.
+      total_bytes (int): Bytes to read during this phase, over all inputs.
+      rows (int): Rows read so far during this phase, over all inputs.
+    """
+    now = time.monotonic()
+    if phase != self._phase:
+      self._phase = phase
+      self._start = now
+      self._last = now
+
+    done = nbytes >= total_bytes and file_idx == num_files
+    if not done and now - self._last < self._interval:
+      return
+    self._last = now
+
+    print(self.format(phase, file_idx, num_files, nbytes, total_bytes, rows,
+        now - self._start), file=self._stream or sys.stderr)
+
+
+  @staticmethod
+  def format(phase, file_idx, num_files, nbytes, total_bytes, rows, elapsed):
+    """ Return a one-line summary of the progress of a phase. """
+    mb_sec = 0.
+    rows_sec = 0.
+    eta = '?'
+    if elapsed > 0:
+      mb_sec = nbytes / elapsed / 1e6
+      rows_sec = rows / elapsed
+      if nbytes > 0:
+        remaining = max(total_bytes - nbytes, 0) * elapsed / nbytes
+        eta = str(timedelta(seconds=int(remaining)))
+
+    percent = 100.
+    if total_bytes > 0:
+      percent = min(100. * nbytes / total_bytes, 100.)
+
+    return '[{}] file {}/{} | {:0.1f}% | {:0.1f} MB/s | {:0.0f} rows/s | ' \
+        'ETA {}'.format(phase, file_idx, num_files, percent, mb_sec, rows_sec,
+        eta)
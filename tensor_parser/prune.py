@@ -0,0 +1,210 @@
+
+
+import sys
+import mmap
+import tempfile
+from array import array
+
+
+# ids of rows with a skipped key
+INVALID = -1
+
+# number of ids buffered in memory before spilling to disk
+SPILL_CHUNK = 1 << 20
+
+
+class kcore_pruner:
+  """ Iteratively remove keys which appear in fewer than `min_count` rows of
+  any mode, until no more keys can be removed (the k-core of the tensor).
+
+  Removing a key removes all of its rows, which may in turn drop other keys
+  below `min_count`. Instead of rescanning the input, rows are stored as
+  compact arrays of integer key ids. Each key tracks its degree (number of
+  remaining rows) and the rows it appears in, and a worklist holds keys that
+  fell below `min_count`. Every row is removed at most once, so convergence
+  costs O(nnz) in total.
+
+  If `spill_dir` is given, the encoded rows and the key -> rows incidence are
+  kept in memory-mapped temporary files in that directory instead of memory.
+  """
+
+  def __init__(self, num_modes, min_count, spill_dir=None):
+    self._num_modes = num_modes
+    self._min_count = min_count
+    self._spill_dir = spill_dir
+
+    self._ids = [dict() for _ in range(num_modes)]  # key -> id
+    self._keys = [[] for _ in range(num_modes)]     # id -> key
+    self._rows = array('q')
+    self._spill = None
+    if spill_dir is not None:
+      self._spill = tempfile.TemporaryFile(dir=spill_dir)
+    self._maps = []
+
+    self._deg = None
+    self.num_rows = 0
+    self.removed_rows = 0
+
+
+  def add_row(self, keys):
+    """ Add a row, given as the (converted) key of each mode. A key of None
+    marks the row as invalid.
+    """
+    for m in range(self._num_modes):
+      key = keys[m]
+      if key is None:
+        self._rows.append(INVALID)
+        continue
+      ids = self._ids[m]
+      idx = ids.get(key)
+      if idx is None:
+        idx = len(self._keys[m])
+        ids[key] = idx
+        self._keys[m].append(key)
+      self._rows.append(idx)
+    self.num_rows += 1
+
+    if self._spill is not None and len(self._rows) >= SPILL_CHUNK:
+      self._rows.tofile(self._spill)
+      self._rows = array('q')
+
+
+  def spill(self, spill_dir=None):
+    """ Start keeping the encoded rows and the incidence of later pruning in
+    memory-mapped files in `spill_dir` (None for the system default), e.g.,
+    when a memory limit is reached. The rows added so far are written out.
+    """
+    if self._spill is not None:
+      return
+    self._spill_dir = spill_dir
+    if self._spill_dir is None:
+      self._spill_dir = tempfile.gettempdir()
+    self._spill = tempfile.TemporaryFile(dir=self._spill_dir)
+    self._rows.tofile(self._spill)
+    self._rows = array('q')
+
+
+  def is_spilled(self):
+    """ Return whether rows are kept on disk. """
+    return self._spill is not None
+
+
+  def memory_usage(self):
+    """ Estimate the bytes used by the key ids and the buffered rows. """
+    nbytes = len(self._rows) * self._rows.itemsize
+    for m in range(self._num_modes):
+      nbytes += sys.getsizeof(self._ids[m]) + sys.getsizeof(self._keys[m])
+    return nbytes
+
+
+  def _alloc(self, n):
+    """ Allocate a zeroed array of `n` signed 64-bit integers. """
+    if self._spill_dir is None:
+      return array('q', [0]) * n
+    f = tempfile.TemporaryFile(dir=self._spill_dir)
+    f.truncate(max(n, 1) * 8)
+    buf = mmap.mmap(f.fileno(), 0)
+    f.close()
+    self._maps.append(buf)
+    return memoryview(buf).cast('q')
+
+
+  def _encoded_rows(self):
+    if self._spill is None:
+      return self._rows
+    self._rows.tofile(self._spill)
+    self._rows = array('q')
+    self._spill.flush()
+    if self.num_rows == 0:
+      return array('q')
+    buf = mmap.mmap(self._spill.fileno(), 0)
+    self._maps.append(buf)
+    return memoryview(buf).cast('q')
+
+
+  def prune(self):
+    """ Remove keys and rows until every remaining key appears in at least
+    `min_count` rows. Invalid rows are always removed.
+
+    Returns:
+      The number of removed rows.
+    """
+    M = self._num_modes
+    k = self._min_count
+    rows = self._encoded_rows()
+    nrows = self.num_rows
+
+    # degrees of each key over the valid rows
+    alive = bytearray(nrows)
+    deg = [array('q', [0]) * len(self._keys[m]) for m in range(M)]
+    for r in range(nrows):
+      row = rows[r*M : (r+1)*M]
+      if INVALID in row:
+        continue
+      alive[r] = 1
+      for m in range(M):
+        deg[m][row[m]] += 1
+
+    # key -> rows incidence in compressed form
+    ptrs = []
+    incs = []
+    for m in range(M):
+      ptr = self._alloc(len(deg[m]) + 1)
+      for i in range(len(deg[m])):
+        ptr[i+1] = ptr[i] + deg[m][i]
+      inc = self._alloc(ptr[len(deg[m])])
+      fill = array('q', ptr[:len(deg[m])])
+      for r in range(nrows):
+        if alive[r]:
+          i = rows[r*M + m]
+          inc[fill[i]] = r
+          fill[i] += 1
+      ptrs.append(ptr)
+      incs.append(inc)
+
+    # worklist of keys below the threshold
+    work = [(m, i) for m in range(M) for i in range(len(deg[m]))
+        if 0 < deg[m][i] < k]
+    while work:
+      m, i = work.pop()
+      for j in range(ptrs[m][i], ptrs[m][i+1]):
+        r = incs[m][j]
+        if not alive[r]:
+          continue
+        alive[r] = 0
+        for m2 in range(M):
+          i2 = rows[r*M + m2]
+          deg[m2][i2] -= 1
+          # push each key once, when it first drops below the threshold
+          if deg[m2][i2] == k - 1:
+            work.append((m2, i2))
+
+    self._deg = deg
+    self.removed_rows = nrows - sum(alive)
+
+    # release views of the spill files before closing them
+    row = rows = ptr = ptrs = inc = incs = fill = None
+    self._close()
+    return self.removed_rows
+
+
+  def counts(self, mode):
+    """ Return a dictionary of key -> number of remaining rows for a mode,
+    after `prune()`.
+    """
+    deg = self._deg[mode]
+    return {key : deg[i] for i, key in enumerate(self._keys[mode])
+        if deg[i] > 0}
+
+
+  def _close(self):
+    for buf in self._maps:
+      try:
+        buf.close()
+      except BufferError:
+        # still exported by a live memoryview; freed with it
+        pass
+    self._maps = []
+    if self._spill is not None:
+      self._spill.close()
+      self._spill = None
@@ -0,0 +1,164 @@
+
+
+import sys
+import random
+from collections import OrderedDict
+
+from .csv_parser import csv_parser, BAD_ROWS_SKIP
+from .index_map import index_map
+from .sketches import hyperloglog, space_saving
+
+
+# Rough per-key overhead of an `index_map` (an OrderedDict entry for counting,
+# a dict entry for the mapping, and the boxed index), excluding the key itself.
+INDEX_MAP_ENTRY_BYTES = 200
+
+# Dates are expensive to parse, so only this many values per column are tried.
+DATE_SAMPLE = 1000
+
+
+def _is_type(type_func, x):
+  try:
+    type_func(x)
+    return True
+  except:
+    return False
+
+
+def scan_columns(fname, delim=None, has_header=None, fields=None, sample=1.0,
+    top_k=10, seed=0):
+  """ Summarize the columns of a CSV file in one streaming pass with bounded
+  memory.
+
+  For each column this reports the approximate number of distinct values
+  (HyperLogLog), the approximately most frequent values (Space-Saving), and
+  the fraction of values that parse as int, float, and date. If `fields` is
+  given, it also estimates the number of non-zeros and the memory of the index
+  maps of a tensor built from those fields.
+
+  Args:
+    fname (str): The CSV file to scan, or a `csv_parser` of it (e.g., of a
+                 stream whose header was already read, which cannot be
+                 opened again). `delim` and `has_header` are then ignored.
+    delim (str): CSV delimiter (overrides discovered)
+    has_header (bool): Whether the CSV file has a header (overrides discovered)
+    fields (list): Proposed tensor modes (optional).
+    sample (float): The fraction of rows to scan, chosen at random.
+    top_k (int): The number of frequent values to report per column.
+    seed (int): Seed for sampling rows.
+
+  Returns:
+    A dictionary with keys 'rows', 'sampled_rows', 'bad_rows' (rows skipped
+    for their number of fields), 'columns', and (if `fields` is given)
+    'tensor'.
+  """
+  if isinstance(fname, csv_parser):
+    parser = fname
+  else:
+    parser = csv_parser(fname, delim, has_header)
+  # rows with the wrong number of fields are counted rather than scanned
+  parser.set_bad_rows(BAD_ROWS_SKIP)
+  header = parser.get_header()
+  ncols = len(header)
+
+  cols = []
+  if fields:
+    lower = [x.lower() for x in header]
+    for f in fields:
+      if f.lower() not in lower:
+        raise IndexError("Error: field '{}' not found.".format(f))
+      cols.append(lower.index(f.lower()))
+
+  distinct = [hyperloglog() for _ in range(ncols)]
+  frequent = [space_saving(capacity=max(10 * top_k, 100)) for _ in range(ncols)]
+  key_bytes = [0] * ncols
+  hits = [[0, 0, 0] for _ in range(ncols)] # int, float, date
+  date_tries = [0] * ncols
+  tuples = hyperloglog()
+
+  rng = random.Random(seed)
+  nrows = 0
+  nsampled = 0
+  for row in parser.rows():
+    nrows += 1
+    if sample < 1.0 and rng.random() >= sample:
+      continue
+    nsampled += 1
+
+    for c in range(ncols):
+      x = row[c]
+      distinct[c].add(x)
+      frequent[c].add(x)
+      key_bytes[c] += len(x)
+      if _is_type(int, x):
+        hits[c][0] += 1
+        hits[c][1] += 1
+      elif _is_type(float, x):
+        hits[c][1] += 1
+      if date_tries[c] < DATE_SAMPLE:
+        date_tries[c] += 1
+        if _is_type(index_map.TYPE_DATE, x):
+          hits[c][2] += 1
+
+    if cols:
+      tuples.add('\x00'.join(row[c] for c in cols))
+
+  columns = []
+  for c in range(ncols):
+    n = max(nsampled, 1)
+    columns.append(OrderedDict([
+      ('field', header[c]),
+      ('distinct', distinct[c].estimate()),
+      ('top', frequent[c].top(top_k)),
+      ('int', hits[c][0] / n),
+      ('float', hits[c][1] / n),
+      ('date', hits[c][2] / max(date_tries[c], 1)),
+      ('avg_bytes', key_bytes[c] / n),
+    ]))
+
+  results = OrderedDict([('rows', nrows), ('sampled_rows', nsampled),
+      ('bad_rows', sum(parser.bad_rows().values())), ('columns', columns)])
+
+  if cols:
+    # keys are stored as str objects in the index maps
+    memory = 0
+    for c in cols:
+      per_key = sys.getsizeof('x' * int(columns[c]['avg_bytes'])) + \
+          INDEX_MAP_ENTRY_BYTES
+      memory += columns[c]['distinct'] * per_key
+    results['tensor'] = OrderedDict([
+      ('fields', [header[c] for c in cols]),
+      ('dims', [columns[c]['distinct'] for c in cols]),
+      ('nnz_before_merge', nrows),
+      ('nnz_after_merge', tuples.estimate()),
+      ('index_map_bytes', memory),
+    ])
+
+  return results
+
+
+def print_scan(results, fout=None):
+  """ Print the results of `scan_columns()` in human-readable form. """
+  fout = fout or sys.stdout
+  print('Scanned {} rows ({} sampled, {} bad)'.format(results['rows'],
+      results['sampled_rows'], results['bad_rows']), file=fout)
+  print('{:<24} {:>12} {:>7} {:>7} {:>7}  {}'.format('field', 'distinct~',
+      'int', 'float', 'date', 'top values (count)'), file=fout)
+  for col in results['columns']:
+    top = ', '.join('{} ({})'.format(x, n) for x, n, err in col['top'][:5])
+    print('{:<24} {:>12} {:>6.1f}% {:>6.1f}% {:>6.1f}%  {}'.format(
+        col['field'][:24], col['distinct'], 100 * col['int'],
+        100 * col['float'], 100 * col['date'], top), file=fout)
+
+  if 'tensor' in results:
+    t = results['tensor']
+    print('', file=fout)
+    print('Proposed tensor: {}'.format(', '.join(t['fields'])), file=fout)
+    print('  dims~: {}'.format(' x '.join(str(d) for d in t['dims'])),
+        file=fout)
+    print('  nnz: {} before merging, ~{} after merging'.format(
+        t['nnz_before_merge'], t['nnz_after_merge']), file=fout)
+    print('  index maps: ~{:0.1f} MB'.format(t['index_map_bytes'] / 1e6),
+        file=fout)
+    if results['sampled_rows'] < results['rows']:
+      print('  (distinct counts are of the sampled rows only)', file=fout)
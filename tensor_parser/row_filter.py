@@ -0,0 +1,90 @@
+
+
+import sys
+
+from .index_map import index_map
+
+
+#
+# Row predicates, evaluated by `csv_parser.rows()` before any `index_map` work.
+#
+
+FILTER_EQ    = '=='
+FILTER_IN    = 'in'
+FILTER_RANGE = 'range'
+
+
+def _typed(type_func, x):
+  """ Convert `x` with `type_func`, returning None on failure. """
+  try:
+    return type_func(x)
+  except:
+    return None
+
+
+def _compile_one(col, type_func, op, value):
+  """ Return a function which accepts or rejects a row. """
+  if op == FILTER_EQ:
+    value = [value]
+    op = FILTER_IN
+
+  if op == FILTER_IN:
+    if type_func is str:
+      vals = frozenset(str(v) for v in value)
+      return lambda row: row[col] in vals
+    vals = frozenset(_typed(type_func, str(v)) for v in value) - {None}
+    return lambda row: _typed(type_func, row[col]) in vals
+
+  if op == FILTER_RANGE:
+    lo, hi = value
+    if lo is not None:
+      lo = type_func(str(lo))
+    if hi is not None:
+      hi = type_func(str(hi))
+    def in_range(row):
+      x = _typed(type_func, row[col])
+      if x is None:
+        return False
+      return (lo is None or lo <= x) and (hi is None or x <= hi)
+    return in_range
+
+  raise ValueError("Error: unknown filter operation '{}'.".format(op))
+
+
+def compile_filters(config, header):
+  """ Compile the filters of `config` into a single row predicate.
+
+  Each filter compares using the type function of its field's mode, or as
+  strings if the field is not a mode of the tensor.
+
+  Args:
+    config (tensor_config): Configuration for the tensor to construct
+    header (list): The header of the CSV file being read.
+
+  Returns:
+    A function `accept(row)` returning a bool, or None if there are no
+    filters.
+  """
+  filters = config.get_filters()
+  if not filters:
+    return None
+
+  lower = [x.lower() for x in header]
+  preds = []
+  for f in filters:
+    if f['field'].lower() not in lower:
+      print('ERROR: filter field "{}" not found'.format(f['field']),
+          file=sys.stderr)
+      sys.exit(1)
+    col = lower.index(f['field'].lower())
+
+    type_func = index_map.TYPE_STR
+    try:
+      type_func = config.get_mode(f['field'])['type']
+    except IndexError:
+      pass
+    preds.append(_compile_one(col, type_func, f['op'], f['value']))
+
+  if len(preds) == 1:
+    return preds[0]
+  return lambda row: all(p(row) for p in preds)
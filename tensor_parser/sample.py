@@ -0,0 +1,138 @@
+
+
+import random
+
+
+class row_sampler:
+  """ Select a random sample of the rows of a build.
+
+  Rows are sampled either independently with probability `rate` (Bernoulli
+  sampling) or as a uniform sample of exactly `size` rows (reservoir
+  sampling). Samples are reproducible for a given `seed` and input order.
+
+  With a `stratify` function, every stratum (e.g., every key of a mode) keeps
+  at least one row, so that rare keys survive sampling. With Bernoulli
+  sampling, a row of each stratum with no sampled row is added to the sample.
+  With reservoir sampling, such rows replace random rows of strata with more
+  than one, so the sample keeps `size` rows (if there are more than `size`
+  strata, a random subset of them is kept). One row per stratum is held in
+  memory until the end of the sample.
+
+  Bernoulli samples are produced while the rows are read by `sample()`, while
+  reservoir samples (and the rows added for strata) are only known after all
+  rows were seen and are returned by `finish()`, in their input order.
+  """
+
+  def __init__(self, rate=None, size=None, seed=0, stratify=None):
+    """
+    Args:
+      rate (float): The probability of sampling each row, in (0, 1].
+      size (int): The number of rows to sample (instead of `rate`).
+      seed (int): The random seed.
+      stratify (func): Optional function returning the stratum of a row.
+    """
+    if (rate is None) == (size is None):
+      raise ValueError('ERROR: specify exactly one of a sample rate and size.')
+    if rate is not None and not 0 < rate <= 1:
+      raise ValueError('ERROR: sample rate must be in (0, 1].')
+    if size is not None and size < 1:
+      raise ValueError('ERROR: sample size must be positive.')
+
+    self._rate = rate
+    self._size = size
+    self._rng = random.Random(seed)
+    self._stratify = stratify
+
+    self.num_seen = 0        # rows offered so far
+    self._reservoir = []     # (position, row) of reservoir sampling
+    self._covered = set()    # strata with a sampled row (Bernoulli)
+    self._fallback = dict()  # stratum -> [rows seen, position, row]
+    self.num_sampled = 0
+
+
+  def _offer_fallback(self, stratum, row):
+    """ Keep a uniform choice of one row per stratum. """
+    entry = self._fallback.get(stratum)
+    if entry is None:
+      self._fallback[stratum] = [1, self.num_seen, row]
+      return
+    entry[0] += 1
+    if self._rng.randrange(entry[0]) == 0:
+      entry[1] = self.num_seen
+      entry[2] = row
+
+
+  def sample(self, rows):
+    """ Offer rows to the sample, yielding those which were sampled
+    immediately (Bernoulli sampling only).
+    """
+    rng = self._rng
+    for row in rows:
+      if self._rate is not None:
+        if rng.random() < self._rate:
+          self.num_sampled += 1
+          if self._stratify is not None:
+            stratum = self._stratify(row)
+            self._covered.add(stratum)
+            self._fallback.pop(stratum, None)
+          yield row
+        elif self._stratify is not None:
+          stratum = self._stratify(row)
+          if stratum not in self._covered:
+            self._offer_fallback(stratum, row)
+
+      else:
+        if len(self._reservoir) < self._size:
+          self._reservoir.append((self.num_seen, row))
+        else:
+          j = rng.randrange(self.num_seen + 1)
+          if j < self._size:
+            self._reservoir[j] = (self.num_seen, row)
+        if self._stratify is not None:
+          self._offer_fallback(self._stratify(row), row)
+      self.num_seen += 1
+
+
+  def finish(self):
+    """ Return the rows of the sample which were not yielded by `sample()`,
+    in input order.
+    """
+    if self._rate is not None:
+      extra = sorted((pos, row) for _, pos, row in self._fallback.values())
+      self.num_sampled += len(extra)
+      return [row for _, row in extra]
+
+    sample = self._reservoir
+    if self._stratify is not None:
+      sample = self._cover_strata(sample)
+    sample.sort(key=lambda x: x[0])
+    self.num_sampled = len(sample)
+    return [row for _, row in sample]
+
+
+  def _cover_strata(self, sample):
+    """ Replace random rows of a reservoir sample by a row of each stratum
+    which is missing from it.
+    """
+    strata = [self._stratify(row) for _, row in sample]
+    counts = dict()
+    for s in strata:
+      counts[s] = counts.get(s, 0) + 1
+    missing = [s for s in self._fallback if s not in counts]
+    self._rng.shuffle(missing)
+
+    victims = list(range(len(sample)))
+    self._rng.shuffle(victims)
+    for s in missing:
+      # the next random row whose stratum has others left
+      while victims and counts[strata[victims[-1]]] <= 1:
+        victims.pop()
+      if not victims:
+        break
+      v = victims.pop()
+      counts[strata[v]] -= 1
+      _, pos, row = self._fallback[s]
+      sample[v] = (pos, row)
+      strata[v] = s
+      counts[s] = 1
+    return sample
@@ -0,0 +1,114 @@
+
+
+import math
+import heapq
+from hashlib import blake2b
+
+
+#
+# Bounded-memory summaries of a stream of keys.
+#
+
+def hash64(key):
+  """ Return a deterministic 64-bit hash of the string `key`. """
+  return int.from_bytes(blake2b(key.encode('utf-8'), digest_size=8).digest(),
+      'little')
+
+
+class hyperloglog:
+  """ Estimate the number of distinct keys in a stream using 2^`precision`
+  one-byte registers. The relative error is about 1.04 / sqrt(2^precision).
+  """
+
+  def __init__(self, precision=14):
+    self._p = precision
+    self._m = 1 << precision
+    self._registers = bytearray(self._m)
+
+
+  def add(self, key):
+    """ Add a (string) key to the sketch. """
+    h = hash64(key)
+    idx = h & (self._m - 1)
+    w = h >> self._p
+    rank = (64 - self._p) - w.bit_length() + 1
+    if rank > self._registers[idx]:
+      self._registers[idx] = rank
+
+
+  def merge(self, other):
+    """ Merge another sketch of the same precision into this one. """
+    if other._p != self._p:
+      raise ValueError('ERROR: cannot merge sketches of different precision.')
+    self._registers = bytearray(max(a, b) for a, b in
+        zip(self._registers, other._registers))
+
+
+  def estimate(self):
+    """ Return the estimated number of distinct keys. """
+    m = self._m
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+
+    # small range correction: linear counting
+    zeros = self._registers.count(0)
+    if estimate <= 2.5 * m and zeros > 0:
+      estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+  def memory(self):
+    """ Return the size of the registers in bytes. """
+    return self._m
+
+
+class space_saving:
+  """ Track the (approximately) most frequent keys of a stream with at most
+  `capacity` counters (Metwally et al., "Space-Saving").
+
+  Reported counts overestimate the true counts by at most the reported error.
+  Any key whose true frequency exceeds N/`capacity` is guaranteed to be
+  tracked.
+  """
+
+  def __init__(self, capacity=100):
+    self._capacity = capacity
+    self._counts = dict()
+    self._errors = dict()
+    # min-heap of (count, key) -- entries become stale as counts grow and are
+    # refreshed lazily during eviction
+    self._heap = []
+
+
+  def add(self, key):
+    """ Add a key to the summary. """
+    counts = self._counts
+    if key in counts:
+      counts[key] += 1
+      return
+
+    if len(counts) < self._capacity:
+      counts[key] = 1
+      self._errors[key] = 0
+      heapq.heappush(self._heap, (1, key))
+      return
+
+    # evict the key with the minimum count
+    while True:
+      count, victim = heapq.heappop(self._heap)
+      if counts[victim] == count:
+        break
+      heapq.heappush(self._heap, (counts[victim], victim))
+    del counts[victim]
+    del self._errors[victim]
+
+    counts[key] = count + 1
+    self._errors[key] = count
+    heapq.heappush(self._heap, (count + 1, key))
+
+
+  def top(self, k):
+    """ Return up to `k` tuples of (key, count, error), most frequent first.
+    """
+    keys = sorted(self._counts, key=lambda x: self._counts[x], reverse=True)
+    return [(x, self._counts[x], self._errors[x]) for x in keys[:k]]
@@ -0,0 +1,144 @@
+
+
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+from .csf import _write_array, _read_array
+
+
+#
+# Slice statistics output.
+#
+# The binary layout is the 4-byte magic `SLC1` followed by little-endian
+# unsigned 64-bit integers:
+#
+#   nmodes
+#   nparts
+#   dims[nmodes]
+#   for each mode m:
+#     counts[m][dims[m]]      (non-zeros in each slice, zero-indexed)
+#   for each mode m:
+#     bounds[m][nparts + 1]   (part p holds slices bounds[m][p] to
+#                              bounds[m][p+1], exclusive)
+#
+
+SLICES_MAGIC = b'SLC1'
+
+
+class slice_counts:
+  """ The number of non-zeros in each slice of each mode of a tensor.
+
+  Counts are kept in one compact array per mode, indexed by the (one-indexed)
+  indices of the tensor, and are accumulated while the non-zeros are written.
+  """
+
+  def __init__(self, dims):
+    """
+    Args:
+      dims (list): The length of each mode.
+    """
+    self.dims = list(dims)
+    self.counts = [array('Q', bytes(8 * d)) for d in self.dims]
+
+
+  def add(self, inds):
+    """ Count a non-zero with one-indexed indices `inds` (ints or strings).
+    """
+    for m, counts in enumerate(self.counts):
+      counts[int(inds[m]) - 1] += 1
+
+
+  def add_file(self, tensor_name):
+    """ Count the non-zeros of a `.tns` file. """
+    with open(tensor_name, 'r') as fin:
+      for line in fin:
+        inds = line.split()
+        if inds:
+          self.add(inds)
+
+
+  def partitions(self, parts):
+    """ Return the balanced partition of each mode into `parts` parts (see
+    `balanced_partition()`).
+    """
+    return [balanced_partition(counts, parts) for counts in self.counts]
+
+
+  def write(self, filename, parts=1):
+    """ Write the counts and the balanced partition of each mode into `parts`
+    parts as a binary file (see `read_slices()`).
+    """
+    with open(filename, 'wb') as fout:
+      fout.write(SLICES_MAGIC)
+      header = array('Q', [len(self.dims), parts])
+      header.extend(self.dims)
+      _write_array(fout, header)
+      for counts in self.counts:
+        _write_array(fout, counts)
+      for bounds in self.partitions(parts):
+        _write_array(fout, array('Q', bounds))
+
+
+def read_slices(filename):
+  """ Read a file written by `slice_counts.write()`.
+
+  Returns:
+    A dictionary with keys 'dims', 'counts' (an `array` of slice counts per
+    mode), and 'bounds' (the partition boundaries of each mode).
+  """
+  with open(filename, 'rb') as fin:
+    if fin.read(len(SLICES_MAGIC)) != SLICES_MAGIC:
+      raise ValueError('ERROR: {} is not a slice statistics file.'.format(
+          filename))
+    num_modes, parts = _read_array(fin, 'Q', 2)
+    dims = list(_read_array(fin, 'Q', num_modes))
+    counts = [_read_array(fin, 'Q', d) for d in dims]
+    bounds = [list(_read_array(fin, 'Q', parts + 1)) for _ in dims]
+  return {'dims' : dims, 'counts' : counts, 'bounds' : bounds}
+
+
+def _greedy_bounds(prefix, parts, cap):
+  """ Cut the slices into contiguous parts, each holding as many slices as
+  fit within `cap` non-zeros. Returns the bounds, or None if more than
+  `parts` parts are needed.
+  """
+  n = len(prefix) - 1
+  bounds = [0]
+  for _ in range(parts):
+    # the last slice which keeps the part within cap
+    pos = bisect_right(prefix, prefix[bounds[-1]] + cap, lo=bounds[-1]) - 1
+    bounds.append(pos)
+  if bounds[-1] != n:
+    return None
+  return bounds
+
+
+def balanced_partition(counts, parts):
+  """ Partition slices into `parts` contiguous ranges, minimizing the largest
+  number of non-zeros in a part.
+
+  Args:
+    counts (list): The non-zeros of each slice.
+    parts (int): The number of parts.
+
+  Returns:
+    A list of `parts + 1` boundaries: part `p` holds the (zero-indexed) slices
+    `bounds[p]` to `bounds[p+1]`, exclusive. Trailing parts may be empty.
+  """
+  if parts < 1:
+    raise ValueError('ERROR: the number of parts must be positive.')
+  prefix = [0] + list(accumulate(counts))
+  if not counts:
+    return [0] * (parts + 1)
+
+  # binary search of the smallest feasible maximum part
+  lo = max(counts)
+  hi = prefix[-1]
+  while lo < hi:
+    mid = (lo + hi) // 2
+    if _greedy_bounds(prefix, parts, mid) is None:
+      lo = mid + 1
+    else:
+      hi = mid
+  return _greedy_bounds(prefix, parts, lo)
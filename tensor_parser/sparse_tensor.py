@@ -0,0 +1,140 @@
+
+
+from array import array
+
+
+class sparse_tensor:
+  """ An in-memory sparse tensor in coordinate format.
+
+  Indices are stored zero-indexed as one `array` per mode and values as an
+  `array` of doubles. The `index_map` of each mode maps the original keys to
+  indices (which are one-indexed, as in `.tns` and `.map` files).
+  """
+
+  def __init__(self, inds, vals, dims, indmaps=None, fields=None):
+    """
+    Args:
+      inds (list): One sequence of zero-indexed indices per mode.
+      vals (sequence): The value of each non-zero.
+      dims (list): The length of each mode.
+      indmaps (list): The `index_map` of each mode (optional).
+      fields (list): The CSV field of each mode (optional).
+    """
+    self.inds = [array('q', x) for x in inds]
+    self.vals = array('d', vals)
+    self.dims = list(dims)
+    self.indmaps = indmaps
+    self.fields = fields
+    self.stats = None
+
+
+  def num_modes(self):
+    """ Return the number of modes in the tensor. """
+    return len(self.dims)
+
+
+  def nnz(self):
+    """ Return the number of non-zeros in the tensor. """
+    return len(self.vals)
+
+
+  def _sorted_order(self, mode_order):
+    inds = [self.inds[m] for m in mode_order]
+    return sorted(range(self.nnz()), key=lambda n: [x[n] for x in inds])
+
+
+  def sort(self, mode_order=None):
+    """ Sort the non-zeros lexicographically by a permutation of the modes.
+
+    Args:
+      mode_order (list): The mode indices (zero-indexed) to sort by, with the
+                         most significant mode first. Defaults to the natural
+                         order of the modes.
+    """
+    if mode_order is None:
+      mode_order = range(self.num_modes())
+    order = self._sorted_order(mode_order)
+    self.inds = [array('q', (x[n] for n in order)) for x in self.inds]
+    self.vals = array('d', (self.vals[n] for n in order))
+
+
+  def merge_dups(self, merge_func=sum, mode_order=None):
+    """ Remove duplicate non-zeros, combining their values with `merge_func`.
+
+    The result is sorted as in `sort()`.
+
+    Returns:
+      The number of non-zeros remaining after merging.
+    """
+    if mode_order is None:
+      mode_order = range(self.num_modes())
+    order = self._sorted_order(mode_order)
+
+    inds = [array('q') for _ in range(self.num_modes())]
+    vals = array('d')
+    start = 0
+    for i in range(1, len(order) + 1):
+      # indices do not match -- merge previous duplicates
+      if i == len(order) or any(x[order[i]] != x[order[start]]
+          for x in self.inds):
+        first = order[start]
+        for m in range(self.num_modes()):
+          inds[m].append(self.inds[m][first])
+        vals.append(merge_func([self.vals[n] for n in order[start:i]]))
+        start = i
+
+    self.inds = inds
+    self.vals = vals
+    return self.nnz()
+
+
+  def to_tns(self, filename):
+    """ Write the tensor to a (one-indexed) `.tns` file. """
+    with open(filename, 'w') as fout:
+      for n in range(self.nnz()):
+        inds = ' '.join(str(x[n] + 1) for x in self.inds)
+        print('{} {}'.format(inds, _format_val(self.vals[n])), file=fout)
+
+
+  def write_maps(self, prefix=''):
+    """ Write the `.map` file of each mode as `<prefix>mode-<m>-<field>.map`.
+    """
+    for m in range(self.num_modes()):
+      fieldname = self.fields[m].replace(' ', '')
+      self.indmaps[m].write_file('{}mode-{}-{}.map'.format(prefix, m+1,
+          fieldname))
+
+
+  def to_npz(self, filename, compressed=True):
+    """ Write the tensor to a NumPy `.npz` archive with arrays `inds` (nnz x
+    modes, zero-indexed), `vals`, and `dims`. Requires NumPy.
+    """
+    import numpy as np
+    inds = np.stack([np.frombuffer(x, dtype=np.int64) for x in self.inds],
+        axis=1) if self.num_modes() > 0 else np.zeros((self.nnz(), 0))
+    save = np.savez_compressed if compressed else np.savez
+    save(filename, inds=inds, vals=np.frombuffer(self.vals, dtype=np.float64),
+        dims=np.array(self.dims, dtype=np.int64))
+
+
+  def to_scipy_coo(self):
+    """ Return a 2-mode tensor as a `scipy.sparse.coo_matrix`. Requires SciPy.
+
+    Duplicate non-zeros are summed by SciPy if not already merged.
+    """
+    if self.num_modes() != 2:
+      raise ValueError('ERROR: only 2-mode tensors can be converted to a '
+          'sparse matrix (found {} modes).'.format(self.num_modes()))
+    import numpy as np
+    from scipy.sparse import coo_matrix
+    rows = np.frombuffer(self.inds[0], dtype=np.int64)
+    cols = np.frombuffer(self.inds[1], dtype=np.int64)
+    vals = np.frombuffer(self.vals, dtype=np.float64)
+    return coo_matrix((vals, (rows, cols)), shape=tuple(self.dims))
+
+
+def _format_val(val):
+  # keep integral values (e.g., count data) free of a trailing '.0'
+  if val.is_integer():
+    return str(int(val))
+  return str(val)
@@ -0,0 +1,133 @@
+
+
+import sys
+import tempfile
+from array import array
+
+
+# ids of keys skipped by their `index_map`
+INVALID = -1
+
+# number of rows buffered in memory before spooling to disk
+SPOOL_ROWS = 1 << 16
+
+
+class row_spool:
+  """ A compact copy of the mode columns and values of the accepted rows,
+  recorded during the first pass over the inputs.
+
+  Streaming inputs (see `csv_parser.is_stream()`) can only be read once, so
+  the remaining passes of a build read the spool instead. Keys are stored as
+  integer ids per mode (the converted key of each id is kept once in memory)
+  and values as their raw strings, so that the spool yields the same values
+  as the inputs, in temporary files which are removed by `close()`.
+  """
+
+  def __init__(self, num_modes, spool_dir=None):
+    """
+    Args:
+      num_modes (int): The number of modes of the tensor.
+      spool_dir (str): The directory of the temporary files (None for the
+                       system default).
+    """
+    self._num_modes = num_modes
+    self._ids = [dict() for _ in range(num_modes)]  # key -> id
+    self._keys = [[] for _ in range(num_modes)]     # id -> key
+    self._counts = [array('q') for _ in range(num_modes)]
+
+    self._rows = array('q')
+    self._vals = bytearray()   # UTF-8 values, back to back
+    self._lens = array('q')    # bytes of each value
+    self._rows_f = tempfile.TemporaryFile(dir=spool_dir)
+    self._vals_f = tempfile.TemporaryFile(dir=spool_dir)
+    self._lens_f = tempfile.TemporaryFile(dir=spool_dir)
+    self.num_rows = 0
+
+
+  def add_row(self, keys, val):
+    """ Add a row, given as the (converted) key of each mode and its value. A
+    key of None marks a skipped key.
+    """
+    for m in range(self._num_modes):
+      key = keys[m]
+      if key is None:
+        self._rows.append(INVALID)
+        continue
+      ids = self._ids[m]
+      idx = ids.get(key)
+      if idx is None:
+        idx = len(self._keys[m])
+        ids[key] = idx
+        self._keys[m].append(key)
+        self._counts[m].append(0)
+      self._counts[m][idx] += 1
+      self._rows.append(idx)
+    val = str(val).encode()
+    self._vals += val
+    self._lens.append(len(val))
+    self.num_rows += 1
+
+    if len(self._lens) >= SPOOL_ROWS:
+      self._flush()
+
+
+  def _flush(self):
+    self._rows.tofile(self._rows_f)
+    self._lens.tofile(self._lens_f)
+    self._vals_f.write(self._vals)
+    self._rows = array('q')
+    self._vals = bytearray()
+    self._lens = array('q')
+
+
+  def memory_usage(self):
+    """ Estimate the bytes used by the key ids and the buffered rows. """
+    nbytes = (len(self._rows) * self._rows.itemsize + len(self._vals) +
+        len(self._lens) * self._lens.itemsize)
+    for m in range(self._num_modes):
+      nbytes += (sys.getsizeof(self._ids[m]) + sys.getsizeof(self._keys[m]) +
+          len(self._counts[m]) * self._counts[m].itemsize)
+    return nbytes
+
+
+  def keys(self, mode):
+    """ Return the list of id -> converted key of a mode. """
+    return self._keys[mode]
+
+
+  def counts(self, mode):
+    """ Return the array of id -> number of rows of a mode. """
+    return self._counts[mode]
+
+
+  def rows(self):
+    """ Yield (ids, value) for each row in the order they were added, where
+    `ids` is a list with the key id of each mode (or `INVALID`), and the
+    value is the string of the value that was added.
+    """
+    self._flush()
+    M = self._num_modes
+    self._rows_f.seek(0)
+    self._vals_f.seek(0)
+    self._lens_f.seek(0)
+    left = self.num_rows
+    while left > 0:
+      n = min(left, SPOOL_ROWS)
+      rows = array('q')
+      lens = array('q')
+      rows.fromfile(self._rows_f, n * M)
+      lens.fromfile(self._lens_f, n)
+      vals = self._vals_f.read(sum(lens))
+      pos = 0
+      for r in range(n):
+        end = pos + lens[r]
+        yield rows[r*M : (r+1)*M].tolist(), vals[pos:end].decode()
+        pos = end
+      left -= n
+
+
+  def close(self):
+    """ Remove the temporary files. """
+    self._rows_f.close()
+    self._vals_f.close()
+    self._lens_f.close()
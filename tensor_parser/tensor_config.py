@@ -1,6 +1,15 @@
 
 
+import os
+
 from .index_map import index_map
+from .csv_parser import BAD_ROWS_ABORT, BAD_ROWS_QUARANTINE, BAD_ROW_POLICIES
+from . import row_filter
+
+
+def _merge_avg(vals):
+  return float(sum(vals)) / len(vals)
+
 
 class tensor_config:
 
@@ -8,9 +17,13 @@ class tensor_config:
   MERGE_SUM   = sum
   MERGE_MIN   = min
   MERGE_MAX   = max
-  MERGE_AVG   = (lambda l : float(sum(l)) / len(l))
+  MERGE_AVG   = _merge_avg
   MERGE_COUNT = len
 
+  FILTER_EQ    = row_filter.FILTER_EQ
+  FILTER_IN    = row_filter.FILTER_IN
+  FILTER_RANGE = row_filter.FILTER_RANGE
+
   def __init__(self, csv_names=None, tensor_name=None):
     """ An intermediate representation of user configuration information.
 
@@ -31,6 +44,30 @@ class tensor_config:
     self._modes = []
     self._vals = None
     self._merge_func = sum
+    self._mode_order = None
+    self._csf = None
+    self._slices = None
+    self._slice_parts = 1
+    self._memory_limit = None
+    self._bad_rows = BAD_ROWS_ABORT
+    self._quarantine = None
+    self._stats_file = None
+    self._progress = None
+    self._profile_dir = None
+    self._trace_memory = False
+    self._dry_run = None
+    self._filters = []
+    self._min_count = 1
+    self._prune_spill = None
+    self._cache_dir = None
+    self._cache_hash = False
+    self._checkpoint_dir = None
+    self._resume = False
+    self._pipeline = None
+    self._sample = None
+    self._serve = None
+    self._output_dir = None
+    self._temp_dir = None
 
 
   def set_delimiter(self, delim):
@@ -89,7 +126,15 @@ class tensor_config:
 
 
   def set_mode_sort(self, csv_field, to_sort):
-    assert(isinstance(to_sort, bool))
+    """ Set the ordering policy of a mode's indices.
+
+    Args:
+      csv_field (str): Which field of the CSV to modify
+      to_sort (bool or str): True to sort by key, False to keep the order of
+                             first appearance, or `index_map.SORT_COUNT` to
+                             order keys by decreasing number of appearances.
+    """
+    assert(isinstance(to_sort, bool) or to_sort == index_map.SORT_COUNT)
     for idx in range(self.num_modes()):
       if self._modes[idx]['field'].lower() == csv_field.lower():
         self._modes[idx]['sort'] = to_sort
@@ -127,12 +172,480 @@ class tensor_config:
     raise IndexError("Error: field '{}' not found.".format(csv_field))
 
 
+  def add_filter(self, csv_field, op, value):
+    """ Only use rows of the CSV which satisfy a predicate on a field.
+
+    Rows are filtered while parsing, before any index maps are built. Values
+    are compared after conversion with the type of the field's mode (see
+    `set_mode_type()`), or as strings if the field is not a mode. Rows whose
+    field cannot be converted are rejected. For example:
+
+      add_filter('state', tensor_config.FILTER_IN, ['MN', 'WI'])
+      add_filter('date', tensor_config.FILTER_RANGE, ('2017-01-01', None))
+
+    Multiple filters must all be satisfied.
+
+    Args:
+      csv_field (str): Which field of the CSV to filter on.
+      op (str): One of FILTER_EQ, FILTER_IN, or FILTER_RANGE.
+      value: A single value for FILTER_EQ, a list of values for FILTER_IN, or
+             an inclusive (low, high) tuple for FILTER_RANGE, where either
+             bound may be None.
+    """
+    if op not in [self.FILTER_EQ, self.FILTER_IN, self.FILTER_RANGE]:
+      raise ValueError("Error: unknown filter operation '{}'.".format(op))
+    self._filters.append({'field' : csv_field, 'op' : op, 'value' : value})
+
+
+  def get_filters(self):
+    """ Return the list of row filters added by `add_filter()`. """
+    return self._filters
+
+
+  def set_min_count(self, min_count, spill_dir=None):
+    """ Remove keys which appear in fewer than `min_count` non-zeros of
+    their mode.
+
+    Removing a key removes its non-zeros, which may drop other keys below
+    `min_count`, so keys are removed until none remain below the threshold.
+    This is done over a compact encoded copy of the rows (see
+    `prune.kcore_pruner`), not by rescanning the inputs.
+
+    Args:
+      min_count (int): The minimum number of non-zeros per key.
+      spill_dir (str): Keep the encoded rows in memory-mapped files in this
+                       directory instead of memory (None to use memory).
+    """
+    assert(min_count >= 1)
+    self._min_count = min_count
+    self._prune_spill = spill_dir
+
+
+  def get_min_count(self):
+    """ Return the minimum number of non-zeros per key. """
+    return self._min_count
+
+
+  def set_bad_rows(self, policy, quarantine=None):
+    """ Choose what to do with input rows which cannot be tokenized or have a
+    different number of fields than the header (see
+    `csv_parser.set_bad_rows()`). They are found during the first pass over
+    the inputs and counted in the build statistics.
+
+    Args:
+      policy (str): 'abort' (the default), 'skip', 'count', or 'quarantine'.
+      quarantine (str): The CSV file receiving the bad rows with the
+                        'quarantine' policy.
+    """
+    if policy not in BAD_ROW_POLICIES:
+      raise ValueError('ERROR: unknown bad row policy "{}".'.format(policy))
+    if (policy == BAD_ROWS_QUARANTINE) != (quarantine is not None):
+      raise ValueError('ERROR: a quarantine file is required by, and only '
+          'used with, the "quarantine" policy.')
+    self._bad_rows = policy
+    self._quarantine = quarantine
+
+
+  def get_bad_rows(self):
+    """ Return the policy for bad input rows. """
+    return self._bad_rows
+
+
+  def get_quarantine(self):
+    """ Return the name of the file receiving bad rows. Returns None unless
+    they are quarantined.
+    """
+    return self._in_output_dir(self._quarantine)
+
+
+  def get_prune_spill(self):
+    """ Return the directory for spilled pruning data. Returns None if the
+    data is kept in memory.
+    """
+    return self._prune_spill
+
+
+  def set_cache(self, cache_dir, hash_contents=False):
+    """ Reuse the outputs of previous builds with the same inputs and
+    settings.
+
+    See `build_cache`. Builds with streaming inputs are never cached.
+
+    Args:
+      cache_dir (str): The cache directory (None to disable).
+      hash_contents (bool): Identify inputs by a hash of their contents
+                            instead of their size and modification time.
+    """
+    self._cache_dir = cache_dir
+    self._cache_hash = hash_contents
+
+
+  def get_cache_dir(self):
+    """ Return the build cache directory. Returns None if unspecified. """
+    return self._cache_dir
+
+
+  def get_cache_hash(self):
+    """ Return whether cached inputs are identified by their contents. """
+    return self._cache_hash
+
+
+  def set_checkpoint(self, ckpt_dir, resume=False):
+    """ Record the progress of the build so that it can be resumed.
+
+    See `checkpoint`. The checkpoint is removed after a successful build.
+
+    Args:
+      ckpt_dir (str): The checkpoint directory (None to disable).
+      resume (bool): Continue from the last completed step of a previous
+                     build with the same inputs and settings.
+    """
+    self._checkpoint_dir = ckpt_dir
+    self._resume = resume
+
+
+  def get_checkpoint_dir(self):
+    """ Return the checkpoint directory. Returns None if unspecified. """
+    return self._checkpoint_dir
+
+
+  def get_resume(self):
+    """ Return whether to resume from a checkpoint. """
+    return self._resume
+
+
+  def set_pipeline(self, depth):
+    """ Overlap reading, tokenizing, mapping, and writing during the emit pass
+    by running them as a `pipeline` of threads.
+
+    Streaming inputs and checkpointed builds are emitted serially.
+
+    Args:
+      depth (int): The capacity of the queues between stages, in batches
+                   (None to disable).
+    """
+    self._pipeline = depth
+
+
+  def get_pipeline(self):
+    """ Return the pipeline queue capacity. Returns None if disabled. """
+    return self._pipeline
+
+
+  def set_sample(self, rate=None, rows=None, seed=0, stratify=None):
+    """ Build the tensor from a random sample of the rows of the inputs.
+
+    Rows are sampled as they are read (after filters), and only the sampled
+    rows are counted, mapped, and emitted. See `sample.row_sampler`.
+    Sampled builds read each input once, keeping the sampled rows in a
+    `row_spool` like streaming inputs, and cannot be checkpointed.
+
+    Args:
+      rate (float): Sample each row with this probability (Bernoulli).
+      rows (int): Sample exactly this many rows (reservoir). Exactly one of
+                  `rate` and `rows` must be given, or neither to disable.
+      seed (int): The random seed.
+      stratify (str): Keep at least one row of each key of this field, which
+                      must be a mode (None to disable).
+    """
+    if rate is None and rows is None:
+      self._sample = None
+      return
+    if rate is not None and rows is not None:
+      raise ValueError('ERROR: cannot sample by both rate and rows.')
+    if rate is not None and not 0 < rate <= 1:
+      raise ValueError('ERROR: sample rate must be in (0, 1].')
+    if rows is not None and rows < 1:
+      raise ValueError('ERROR: sample rows must be positive.')
+    self._sample = {
+      'rate' : rate,
+      'rows' : rows,
+      'seed' : seed,
+      'stratify' : stratify,
+    }
+
+
+  def get_sample(self):
+    """ Return the dictionary of sampling settings ('rate', 'rows', 'seed',
+    and 'stratify'). Returns None if rows are not sampled.
+    """
+    return self._sample
+
+
+  def set_serve(self, socket_path=None, spool_dir=None, poll=1.0):
+    """ Run as a daemon which keeps the index maps in memory and builds a
+    delta tensor for each batch of new inputs, instead of a single build.
+
+    See `daemon.build_daemon`. The inputs of the config form the first
+    batch, and the output is the directory of the deltas.
+
+    Args:
+      socket_path (str): Accept batches over a UNIX socket at this path.
+      spool_dir (str): Or watch this directory for new input files.
+      poll (float): Seconds between scans of `spool_dir`.
+    """
+    if socket_path is None and spool_dir is None:
+      self._serve = None
+      return
+    if socket_path is not None and spool_dir is not None:
+      raise ValueError('ERROR: serve either a socket or a spool directory.')
+    self._serve = {
+      'socket' : socket_path,
+      'spool' : spool_dir,
+      'poll' : poll,
+    }
+
+
+  def get_serve(self):
+    """ Return the dictionary of daemon settings ('socket', 'spool', and
+    'poll'). Returns None if not running as a daemon.
+    """
+    return self._serve
+
+
+  def set_output_dir(self, dirname):
+    """ Write the outputs of the build into a directory of its own.
+
+    The `.map` files are written to `dirname` instead of the current
+    directory, and relative names of the output tensor, CSF, and statistics
+    files are taken relative to it. Builds with different output
+    directories do not share any files, and can run concurrently.
+
+    Args:
+      dirname (str): The output directory, created by the build if needed
+                     (None for the current directory).
+    """
+    self._output_dir = dirname
+
+
+  def get_output_dir(self):
+    """ Return the output directory. Returns None if unspecified. """
+    return self._output_dir
+
+
+  def set_temp_dir(self, dirname):
+    """ Create the temporary files of the build (sorted splits, row spools, and
+    dry-run samples) in `dirname`.
+
+    Files which replace an output (e.g., the merged tensor) are always
+    written next to it first, so that they can be renamed atomically.
+
+    Args:
+      dirname (str): The temporary directory, created by the build if needed
+                     (None for the system default).
+    """
+    self._temp_dir = dirname
+
+
+  def get_temp_dir(self):
+    """ Return the temporary directory. Returns None if unspecified. """
+    return self._temp_dir
+
+
+  def _in_output_dir(self, filename):
+    if filename is None or self._output_dir is None:
+      return filename
+    return os.path.join(self._output_dir, filename)
+
+
+  def get_map_file(self, mode_idx):
+    """ Return the `.map` file written for mode `mode_idx`. """
+    fieldname = self.get_mode_by_idx(mode_idx)['field'].replace(' ', '')
+    return self._in_output_dir('mode-{}-{}.map'.format(mode_idx+1,
+        fieldname))
+
+
   def set_merge_func(self, merge_func):
     self._merge_func = merge_func
 
   def get_merge_func(self):
     return self._merge_func
 
+  def set_mode_order(self, csv_fields):
+    """ Sort the output non-zeros lexicographically by a permutation of the
+    modes.
+
+    The first field is the most significant. Passing None leaves the
+    non-zeros in the order produced by duplicate merging (if any).
+
+    If a field does not specify a mode which has been added via `add_mode()`,
+    this function raises an IndexError.
+
+    Args:
+      csv_fields (list): Fields of the CSV, one per mode.
+    """
+    if csv_fields is None:
+      self._mode_order = None
+      return
+
+    fields = [m['field'].lower() for m in self._modes]
+    order = []
+    for csv_field in csv_fields:
+      if csv_field.lower() not in fields:
+        raise IndexError("Error: field '{}' not found.".format(csv_field))
+      order.append(fields.index(csv_field.lower()))
+    if sorted(order) != list(range(self.num_modes())):
+      raise ValueError("Error: mode order must be a permutation of all modes.")
+    self._mode_order = order
+
+
+  def get_mode_order(self):
+    """ Return the mode indices (zero-indexed) by which to sort the output.
+    Returns None if unspecified.
+    """
+    return self._mode_order
+
+
+  def set_csf(self, filename):
+    """ Additionally write the tensor in compressed sparse fiber (CSF) form.
+
+    The CSF levels follow `get_mode_order()`, or the natural order of the
+    modes if no order is given.
+
+    Args:
+      filename (str): The name of the binary CSF file (None to disable).
+    """
+    self._csf = filename
+
+
+  def get_csf(self):
+    """ Return the name of the CSF output file. Returns None if unspecified.
+    """
+    return self._in_output_dir(self._csf)
+
+
+  def set_slices(self, filename, parts=1):
+    """ Additionally write the number of non-zeros in each slice of each
+    mode, and a balanced partition of each mode into `parts` contiguous parts
+    (see `slice_counts`). The counts are gathered while the non-zeros are
+    written, without another pass over the tensor.
+
+    Args:
+      filename (str): The name of the binary output file (None to disable).
+      parts (int): The number of parts of each mode.
+    """
+    if parts < 1:
+      raise ValueError('ERROR: the number of parts must be positive.')
+    self._slices = filename
+    self._slice_parts = parts
+
+
+  def get_slices(self):
+    """ Return the name of the slice statistics file. Returns None if
+    unspecified.
+    """
+    return self._in_output_dir(self._slices)
+
+
+  def get_slice_parts(self):
+    """ Return the number of parts of the partition of each mode. """
+    return self._slice_parts
+
+
+  def set_memory_limit(self, nbytes):
+    """ Keep the memory accounted by the build (the index maps, the pruner,
+    the external sort, and the output buffers) within `nbytes`.
+
+    Components adapt when the limit is reached: the pruner spills its rows to
+    disk, and the sort splits, output buffer, and pipeline queues shrink.
+    Each decision is printed and reported in the build statistics. The index
+    maps cannot be spilled, so the limit is a target rather than a bound.
+
+    Args:
+      nbytes (int): The limit in bytes (None for no limit).
+    """
+    if nbytes is not None and nbytes <= 0:
+      raise ValueError('ERROR: the memory limit must be positive.')
+    self._memory_limit = nbytes
+
+
+  def get_memory_limit(self):
+    """ Return the memory limit in bytes. Returns None if unlimited. """
+    return self._memory_limit
+
+
+  def set_stats_file(self, filename):
+    """ Write the build statistics (see `build_stats`) to a JSON file.
+
+    Args:
+      filename (str): The name of the JSON file (None to disable).
+    """
+    self._stats_file = filename
+
+
+  def get_stats_file(self):
+    """ Return the name of the JSON statistics file. Returns None if
+    unspecified.
+    """
+    return self._in_output_dir(self._stats_file)
+
+
+  def set_progress(self, callback):
+    """ Set a callback to report the progress of reading the inputs.
+
+    See `build_tensor()` for the signature and `progress_reporter` for an
+    implementation that prints to stderr.
+
+    Args:
+      callback (func): The progress callback (None to disable).
+    """
+    self._progress = callback
+
+
+  def get_progress(self):
+    """ Return the progress callback. Returns None if unspecified. """
+    return self._progress
+
+
+  def set_profile_dir(self, dirname):
+    """ Profile each phase of the build with cProfile.
+
+    One `<phase>.pstats` file is written per phase, which can be inspected
+    with the `pstats` module.
+
+    Args:
+      dirname (str): The directory for `.pstats` files (None to disable).
+    """
+    self._profile_dir = dirname
+
+
+  def get_profile_dir(self):
+    """ Return the cProfile output directory. Returns None if unspecified.
+    """
+    return self._profile_dir
+
+
+  def set_trace_memory(self, trace):
+    """ Trace allocations with tracemalloc and report them after each phase.
+
+    Args:
+      trace (bool): Whether to trace memory.
+    """
+    self._trace_memory = trace
+
+
+  def get_trace_memory(self):
+    """ Return whether memory should be traced. """
+    return self._trace_memory
+
+
+  def set_dry_run(self, fraction):
+    """ Only estimate the tensor from a sample instead of building it.
+
+    See `estimate.estimate_tensor()`.
+
+    Args:
+      fraction (float): The fraction of rows to sample from each input (None
+                        to build the tensor normally).
+    """
+    self._dry_run = fraction
+
+
+  def get_dry_run(self):
+    """ Return the dry-run sample fraction. Returns None if unspecified. """
+    return self._dry_run
+
+
   def get_mode(self, csv_field):
     """ Return the dictionary representing meta-data for a mode.
 
@@ -142,7 +655,7 @@ class tensor_config:
       {
         field => one of the columns in the CSV file
         type  => function for setting type (func)
-        sort  => sorting policy (bool)
+        sort  => sorting policy (bool or index_map.SORT_COUNT)
       }
 
     Args:
@@ -161,7 +674,7 @@ class tensor_config:
       {
         field => one of the columns in the CSV file
         type  => function for setting type (func)
-        sort  => sorting policy (bool)
+        sort  => sorting policy (bool or index_map.SORT_COUNT)
       }
 
     Args:
@@ -197,7 +710,7 @@ class tensor_config:
 
   def get_output(self):
     """ Return the output filename.  """
-    return self._output
+    return self._in_output_dir(self._output)
 
 
   def num_modes(self):
@@ -0,0 +1,111 @@
+
+
+import unittest
+
+import os, sys
+import uuid
+import subprocess
+import tempfile
+from contextlib import redirect_stderr
+
+import tests
+from benchmarks import gen_csv, run_benchmarks
+from tensor_parser import csv_parser
+
+class TestGenCSV(unittest.TestCase):
+
+  def test_deterministic(self):
+    columns = gen_csv.make_columns(3, cardinality=[10, 20, 30], skew=1.)
+    rows1 = list(gen_csv.generate_rows(100, columns, seed=7))
+    rows2 = list(gen_csv.generate_rows(100, columns, seed=7))
+    self.assertEqual(rows1, rows2)
+    self.assertEqual(len(rows1[0]), 4)
+
+    rows3 = list(gen_csv.generate_rows(100, columns, seed=8))
+    self.assertNotEqual(rows1, rows3)
+
+
+  def test_cardinality(self):
+    columns = gen_csv.make_columns(2, cardinality=[5, 1000], skew=[0., 2.])
+    rows = list(gen_csv.generate_rows(2000, columns))
+    self.assertLessEqual(len(set(r[0] for r in rows)), 5)
+    self.assertLessEqual(len(set(r[1] for r in rows)), 1000)
+
+    # heavy skew concentrates on the first key
+    firsts = sum(1 for r in rows if r[1] == 'k0')
+    self.assertGreater(firsts, len(rows) // 2)
+
+
+  def test_dups(self):
+    columns = gen_csv.make_columns(2, cardinality=1000000)
+    rows = list(gen_csv.generate_rows(1000, columns, dup_rate=0.5))
+    uniques = set(tuple(r[:-1]) for r in rows)
+    self.assertLess(len(uniques), 700)
+
+
+  def test_gzip(self):
+    tmp_name = str(uuid.uuid4().hex) + '.csv.gz'
+    try:
+      columns = gen_csv.make_columns(2, date_format='%Y-%m-%d')
+      gen_csv.generate_csv(tmp_name, 10, columns)
+      p = csv_parser.csv_parser(tmp_name)
+      self.assertEqual(p.get_header(), ['c1', 'c2', 'val'])
+      self.assertEqual(len(list(p.rows())), 10)
+    finally:
+      os.remove(tmp_name)
+
+
+  def test_import_times(self):
+    report = '\n'.join([
+      'import time: self [us] | cumulative | imported package',
+      'import time:       120 |        120 |   _io',
+      'import time:       300 |        420 | io',
+      'import time:        50 |         50 |     _stat',
+      'import time:       200 |        250 |   stat',
+      'import time:      1000 |       1250 | os',
+      'Found fields:',
+    ])
+    times = run_benchmarks.import_times(report)
+    self.assertEqual(list(times.items()), [('io', 420), ('os', 1250)])
+
+
+  def test_column_args(self):
+    args = run_benchmarks.parse_args(['-c', '2', '--cardinality', '5,1000',
+        '--skew', '0,1.5', '--date-format', '%Y-%m-%d',
+        '--date-format', 'none'])
+    self.assertEqual(args.cardinality, [5, 1000])
+    self.assertEqual(args.skew, [0., 1.5])
+    self.assertEqual(args.date_format, ['%Y-%m-%d', None])
+
+    args = run_benchmarks.parse_args([])
+    self.assertEqual((args.cardinality, args.skew, args.date_format),
+        (1000, 1., None))
+
+    with open(os.devnull, 'w') as redirect:
+      with redirect_stderr(redirect):
+        with self.assertRaises(SystemExit):
+          run_benchmarks.parse_args(['-c', '3', '--cardinality', '5,10'])
+
+
+  def test_startup(self):
+    with tempfile.TemporaryDirectory() as workdir:
+      columns = gen_csv.make_columns(2)
+      gen_csv.generate_csv(os.path.join(workdir, 'input.csv'), 10, columns)
+      args = run_benchmarks.parse_args(['-b', 'startup', '-r', '1'])
+      results = run_benchmarks.bench_startup(workdir, args)
+    self.assertEqual([r['name'] for r in results],
+        ['startup.help', 'startup.query'])
+    for r in results:
+      self.assertGreater(r['import_seconds'], 0.)
+      self.assertGreater(len(r['slowest_imports']), 0)
+
+    # the builder and date parsing are not needed to exit early
+    report = subprocess.run([sys.executable, '-X', 'importtime',
+        run_benchmarks.SCRIPT, '--help'], stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, universal_newlines=True).stderr
+    for module in ['tensor_parser.builder', 'dateutil', 'csvsorter', 'pprint']:
+      self.assertNotIn(module, report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+
+import unittest
+
+import os, sys
+import time
+import tempfile
+from functools import partial
+sys.path.append(os.path.abspath('..'))
+
+import tests
+from tensor_parser import builder
+from tensor_parser.build_cache import build_cache, _func_id
+from tensor_parser.tensor_config import tensor_config
+from tensor_parser.index_map import epoch_bucket
+
+class TestBuildCache(unittest.TestCase):
+
+  def _config(self, inputs):
+    config = tensor_config(csv_names=inputs, tensor_name='out.tns')
+    config.add_mode('user')
+    config.add_mode('item')
+    config.set_cache('cache')
+    return config
+
+  def _write(self, fname, rows):
+    with open(fname, 'w') as fout:
+      print('user,item', file=fout)
+      for row in rows:
+        print(row, file=fout)
+
+  def test_restore(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        self._write('a.csv', ['u1,x', 'u2,y', 'u1,x'])
+        stats = builder.build_tensor(self._config(['a.csv']))
+        self.assertFalse(stats.cached)
+        with open('out.tns', 'r') as fin:
+          expected = fin.read()
+
+        os.remove('out.tns')
+        os.remove('mode-1-user.map')
+        stats = builder.build_tensor(self._config(['a.csv']))
+        self.assertTrue(stats.cached)
+        self.assertEqual(stats.nnz, 2)
+        with open('out.tns', 'r') as fin:
+          self.assertEqual(fin.read(), expected)
+        self.assertTrue(os.path.exists('mode-1-user.map'))
+
+        # different settings are not restored
+        config = self._config(['a.csv'])
+        config.set_merge_func(tensor_config.MERGE_MAX)
+        self.assertFalse(builder.build_tensor(config).cached)
+      finally:
+        os.chdir(cwd)
+
+
+  def test_partial_counts(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        self._write('a.csv', ['u1,x', 'u2,y'])
+        self._write('b.csv', ['u3,x'])
+        builder.build_tensor(self._config(['a.csv', 'b.csv']))
+
+        # only the changed input is counted again
+        self._write('b.csv', ['u3,x', 'u4,z'])
+        now = time.time()
+        os.utime('b.csv', (now, now + 1))
+        stats = builder.build_tensor(self._config(['a.csv', 'b.csv']))
+        self.assertFalse(stats.cached)
+        self.assertEqual(stats.inputs['a.csv']['passes'], 2)
+        self.assertEqual(stats.inputs['b.csv']['passes'], 3)
+        self.assertEqual(stats.phases['count']['rows'], 4)
+        with open('mode-1-user.map', 'r') as fin:
+          self.assertEqual(fin.read().split(), ['u1', 'u2', 'u3', 'u4'])
+      finally:
+        os.chdir(cwd)
+
+
+  def test_func_id(self):
+    def roundf(x):
+      return lambda v: round(float(v), x)
+    self.assertNotEqual(_func_id(roundf(1)), _func_id(roundf(2)))
+    self.assertEqual(_func_id(roundf(1)), _func_id(roundf(1)))
+    self.assertEqual(_func_id(sum), 'builtins.sum')
+
+    # captured functions and partials are identified by their contents
+    self.assertEqual(_func_id(epoch_bucket(60)), _func_id(epoch_bucket(60)))
+    self.assertNotEqual(_func_id(epoch_bucket(60)),
+        _func_id(epoch_bucket(3600)))
+    self.assertEqual(_func_id(partial(round, ndigits=2)),
+        _func_id(partial(round, ndigits=2)))
+
+
+if __name__ == '__main__':
+  unittest.main()
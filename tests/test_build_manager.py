@@ -0,0 +1,142 @@
+
+import unittest
+
+import os
+import tempfile
+import threading
+
+import tests
+from tensor_parser import build_manager as bm
+from tensor_parser.build_manager import build_manager
+from tensor_parser.tensor_config import tensor_config
+
+
+class TestBuildManager(unittest.TestCase):
+
+  def _config(self, output_dir):
+    config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+    config.add_mode('user')
+    config.add_mode('item')
+    config.set_vals('val')
+    config.set_output_dir(output_dir)
+    return config
+
+
+  def test_fairness(self):
+    started = []
+    release = threading.Event()
+    def fake_build(config):
+      started.append(config)
+      release.wait()
+      return config
+
+    old_run = bm._run_build
+    bm._run_build = fake_build
+    try:
+      with build_manager(max_workers=1, executor='thread') as manager:
+        futures = [manager.submit('a1', owner='a')]
+        futures += [manager.submit(c, owner='a') for c in ['a2', 'a3', 'a4']]
+        futures += [manager.submit(c, owner='b') for c in ['b1', 'b2']]
+        futures.append(manager.submit('c1', owner='c'))
+        self.assertEqual(manager.pending(), 6)
+        release.set()
+      self.assertEqual(started, ['a1', 'a2', 'b1', 'c1', 'a3', 'b2', 'a4'])
+      self.assertEqual([f.result() for f in futures],
+          ['a1', 'a2', 'a3', 'a4', 'b1', 'b2', 'c1'])
+    finally:
+      bm._run_build = old_run
+
+
+  def test_max_workers(self):
+    lock = threading.Lock()
+    running = [0, 0] # current, maximum
+    def fake_build(config):
+      with lock:
+        running[0] += 1
+        running[1] = max(running)
+      threading.Event().wait(0.01)
+      with lock:
+        running[0] -= 1
+      return config
+
+    old_run = bm._run_build
+    bm._run_build = fake_build
+    try:
+      with build_manager(max_workers=2, executor='thread') as manager:
+        futures = [manager.submit(i, owner=i % 3) for i in range(10)]
+      self.assertEqual(sorted(f.result() for f in futures), list(range(10)))
+      self.assertEqual(running[1], 2)
+    finally:
+      bm._run_build = old_run
+
+
+  def test_errors(self):
+    def fake_build(config):
+      raise RuntimeError(config)
+
+    old_run = bm._run_build
+    bm._run_build = fake_build
+    try:
+      with build_manager(max_workers=1, executor='thread') as manager:
+        future = manager.submit('oops')
+        with self.assertRaises(RuntimeError):
+          future.result()
+      with self.assertRaises(RuntimeError):
+        manager.submit('late')
+    finally:
+      bm._run_build = old_run
+
+    with self.assertRaises(ValueError):
+      build_manager(executor='fiber')
+    with self.assertRaises(ValueError):
+      build_manager(max_workers=0)
+
+
+  def test_finished_before_watch(self):
+    # builds which finish before their callback is registered
+    old_run = bm._run_build
+    old_watch = build_manager._watch
+    def slow_watch(self, started):
+      for work, _ in started:
+        work.result()
+      old_watch(self, started)
+
+    bm._run_build = lambda config : config
+    build_manager._watch = slow_watch
+    try:
+      with build_manager(max_workers=1, executor='thread') as manager:
+        futures = [manager.submit(i, owner=i % 2) for i in range(6)]
+      self.assertEqual([f.result(timeout=10) for f in futures], list(range(6)))
+    finally:
+      bm._run_build = old_run
+      build_manager._watch = old_watch
+
+
+  def test_process_builds(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          for i in range(100):
+            print('u{},i{},{}'.format(i % 5, i % 4, i % 3), file=fout)
+
+        with build_manager(max_workers=2) as manager:
+          futures = [manager.submit(self._config('job{}'.format(j)),
+              owner=j % 2) for j in range(3)]
+
+          # lambdas cannot be sent to worker processes
+          config = self._config('bad')
+          config.set_merge_func(lambda vals : max(vals))
+          with self.assertRaises(ValueError):
+            manager.submit(config)
+
+        for j, future in enumerate(futures):
+          self.assertEqual(future.result().nnz, 20)
+          with open(os.path.join('job{}'.format(j), 'out.tns')) as fin:
+            self.assertEqual(len(fin.readlines()), 20)
+        self.assertFalse(os.path.exists('bad'))
+        self.assertFalse(os.path.exists('mode-1-user.map'))
+      finally:
+        os.chdir(cwd)
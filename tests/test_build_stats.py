@@ -0,0 +1,96 @@
+
+
+import unittest
+
+import os
+import json
+import uuid
+import pstats
+import tempfile
+from contextlib import redirect_stderr
+
+import tests
+from tensor_parser.build_stats import build_stats
+from tensor_parser.index_map import index_map
+
+class TestBuildStats(unittest.TestCase):
+
+  def test_phase(self):
+    stats = build_stats()
+    with stats.phase('count') as phase:
+      phase['rows'] += 10
+    with stats.phase('count') as phase:
+      phase['rows'] += 5
+
+    self.assertEqual(list(stats.phases.keys()), ['count'])
+    self.assertEqual(stats.phases['count']['rows'], 15)
+    self.assertGreaterEqual(stats.phases['count']['wall'], 0.)
+    self.assertGreaterEqual(stats.total_time(), 0.)
+
+
+  def test_modes(self):
+    imap = index_map()
+    imap.add('apple')
+    imap.add('banana')
+    imap.build_map()
+
+    stats = build_stats()
+    stats.add_mode('fruit', imap)
+    self.assertEqual(stats.modes[0]['field'], 'fruit')
+    self.assertEqual(stats.modes[0]['cardinality'], 2)
+    self.assertEqual(stats.modes[0]['skipped_keys'], 0)
+
+
+  def test_json(self):
+    tmp_name = str(uuid.uuid4().hex) + '.json'
+    try:
+      stats = build_stats()
+      with stats.phase('emit') as phase:
+        phase['rows'] = 3
+      stats.nnz = 2
+      stats.add_input_read(tmp_name, 3)
+      stats.write_json(tmp_name)
+
+      with open(tmp_name, 'r') as fin:
+        report = json.load(fin)
+      self.assertEqual(report['nnz'], 2)
+      self.assertEqual(report['phases']['emit']['rows'], 3)
+      self.assertEqual(report['inputs'][tmp_name]['passes'], 1)
+    finally:
+      os.remove(tmp_name)
+
+  def test_profile(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      stats = build_stats(profile_dir=tmp_dir)
+      with stats.phase('count') as phase:
+        phase['rows'] = sum(range(1000))
+      fname = os.path.join(tmp_dir, 'count.pstats')
+      self.assertTrue(os.path.exists(fname))
+
+      # repeats of a phase add to its profile rather than replacing it
+      def calls():
+        return sum(s[1] for f, s in pstats.Stats(fname).stats.items()
+            if 'builtins.sorted' in f[2])
+      with stats.phase('count') as phase:
+        sorted(range(10))
+      self.assertEqual(calls(), 1)
+      with stats.phase('count') as phase:
+        sorted(range(10))
+      self.assertEqual(calls(), 2)
+
+
+  def test_trace_memory(self):
+    stats = build_stats(trace_memory=True)
+    with open(os.devnull, 'w') as redirect:
+      with redirect_stderr(redirect):
+        with stats.phase('build_map') as phase:
+          junk = [str(x) for x in range(10000)]
+    stats.finish()
+
+    memory = stats.phases['build_map']['memory']
+    self.assertGreater(memory['traced_peak'], 0)
+    self.assertGreater(len(memory['top']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,9 @@ import argparse
 
 import os, sys
 import uuid
+import tempfile
+import threading
+from contextlib import redirect_stderr
 sys.path.append(os.path.abspath('..'))
 
 import tests
@@ -131,3 +134,487 @@ class TestBuilder(unittest.TestCase):
       os.remove(tmp_name)
 
 
+
+
+  def test_merge_mode_order(self):
+    tmp_name = str(uuid.uuid4().hex) + '.tmp'
+    try:
+      # make csv
+      with open(tmp_name, 'w') as fout:
+        print('1 2 3 1.0', file=fout)
+        print('2 1 3 2.0', file=fout)
+        print('1 2 3 5.0', file=fout)
+        print('2 1 1 1.0', file=fout)
+
+      builder.merge_dups(tmp_name, 3, mode_order=[2, 1, 0])
+
+      with open(tmp_name, 'r') as fin:
+        lines = fin.readlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0].strip(), '2 1 1 1.0')
+        self.assertEqual(lines[1].strip(), '2 1 3 2.0')
+        self.assertEqual(lines[2].strip(), '1 2 3 6.0')
+
+    finally:
+      os.remove(tmp_name)
+
+
+  def test_sort_tensor(self):
+    tmp_name = str(uuid.uuid4().hex) + '.tmp'
+    try:
+      # make csv
+      with open(tmp_name, 'w') as fout:
+        print('1 10 1.0', file=fout)
+        print('2 9 2.0', file=fout)
+        print('1 10 5.0', file=fout)
+
+      builder.sort_tensor(tmp_name, [1, 0])
+
+      with open(tmp_name, 'r') as fin:
+        lines = fin.readlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0].strip(), '2 9 2.0')
+        self.assertEqual(lines[1].split()[:2], ['1', '10'])
+        self.assertEqual(lines[2].split()[:2], ['1', '10'])
+
+    finally:
+      os.remove(tmp_name)
+
+
+  def test_sort_tensor_splits(self):
+    old_split_mb = builder.SORT_SPLIT_MB
+    old_fan_in = builder.SORT_FAN_IN
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        split_dir = os.path.join(tmp_dir, 'splits')
+        os.mkdir(split_dir)
+        lines = ['{} {} {}.0'.format(i % 5, (7 * i) % 3, i) for i in range(50)]
+        with open('in.tns', 'w') as fout:
+          fout.write('\n'.join(lines))
+
+        # several splits, which are kept out of the current directory
+        builder.SORT_SPLIT_MB = 0.001
+        builder.sort_tensor('in.tns', [0, 1], split_dir)
+
+        with open('in.tns', 'r') as fin:
+          got = [l.strip() for l in fin.readlines()]
+        key = lambda l : [int(x) for x in l.split()[:2]]
+        self.assertEqual([key(l) for l in got], sorted(key(l) for l in lines))
+        self.assertEqual(sorted(got), sorted(lines))
+        self.assertEqual(os.listdir(split_dir), [])
+        self.assertEqual(sorted(os.listdir('.')), ['in.tns', 'splits'])
+
+        # more splits than are merged at once; duplicates keep their order
+        import csvsorter
+        ctype = getattr(csvsorter, '_ctype', None)
+        with open('in.tns', 'w') as fout:
+          fout.write('\n'.join(lines))
+        builder.SORT_FAN_IN = 2
+        builder.sort_tensor('in.tns', [1, 0], split_dir)
+        with open('in.tns', 'r') as fin:
+          got = [l.strip() for l in fin.readlines()]
+        key = lambda l : [int(x) for x in l.split()[1::-1]]
+        self.assertEqual(got, sorted(lines, key=key))
+        self.assertEqual(os.listdir(split_dir), [])
+        # the key type of csvsorter is left alone
+        self.assertIs(getattr(csvsorter, '_ctype', None), ctype)
+      finally:
+        builder.SORT_SPLIT_MB = old_split_mb
+        builder.SORT_FAN_IN = old_fan_in
+        os.chdir(cwd)
+
+
+  def test_output_dir(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          for i in range(200):
+            print('u{},i{},{}'.format(i % 7, i % 11, i % 3), file=fout)
+
+        configs = []
+        for job in range(4):
+          config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+          config.add_mode('user')
+          config.add_mode('item')
+          config.set_vals('val')
+          if job % 2:
+            config.set_mode_order(['item', 'user'])
+          config.set_stats_file('stats.json')
+          config.set_output_dir('job{}'.format(job))
+          config.set_temp_dir(os.path.join('tmp', 'job{}'.format(job)))
+          configs.append(config)
+
+        # concurrent builds in one process and directory
+        errors = []
+        def run(config):
+          try:
+            builder.build_tensor(config)
+          except Exception as e:
+            errors.append(e)
+        threads = [threading.Thread(target=run, args=(c,)) for c in configs]
+        for t in threads:
+          t.start()
+        for t in threads:
+          t.join()
+        self.assertEqual(errors, [])
+
+        self.assertEqual(sorted(os.listdir('.')),
+            ['in.csv', 'job0', 'job1', 'job2', 'job3', 'tmp'])
+        outputs = []
+        for job in range(4):
+          self.assertEqual(sorted(os.listdir('job{}'.format(job))),
+              ['mode-1-user.map', 'mode-2-item.map', 'out.tns', 'stats.json'])
+          self.assertEqual(os.listdir(os.path.join('tmp', 'job{}'.format(job))),
+              [])
+          with open(os.path.join('job{}'.format(job), 'out.tns')) as fin:
+            outputs.append(fin.read())
+        self.assertEqual(outputs[0], outputs[2])
+        self.assertEqual(outputs[1], outputs[3])
+        self.assertEqual(len(outputs[0].splitlines()), 77)
+        self.assertEqual(sorted(outputs[0].splitlines()),
+            sorted(outputs[1].splitlines()))
+      finally:
+        os.chdir(cwd)
+
+
+  def test_build_stats(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          print('u1,a,1', file=fout)
+          print('u2,b,2', file=fout)
+          print('u1,a,4', file=fout)
+          print('u3,,1', file=fout)
+
+        config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+        config.add_mode('user')
+        config.add_mode('item',
+            transform=lambda x : x if len(x) > 0 else None)
+        config.set_vals('val')
+        with open(os.devnull, 'w') as redirect:
+          with redirect_stderr(redirect):
+            stats = builder.build_tensor(config)
+
+        with open('out.tns', 'r') as fin:
+          lines = [l.strip() for l in fin.readlines()]
+        self.assertEqual(lines, ['1 1 5', '2 2 2'])
+
+        self.assertEqual(stats.nnz, 2)
+        self.assertEqual(stats.pruned_rows, 1)
+        self.assertEqual(stats.phases['count']['rows'], 4)
+        self.assertEqual(stats.inputs['in.csv']['passes'], 3)
+        self.assertEqual(stats.modes[1]['cardinality'], 2)
+        self.assertTrue(os.path.exists('mode-1-user.map'))
+      finally:
+        os.chdir(cwd)
+
+
+  def test_build_min_count(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item', file=fout)
+          for row in ['u1,a', 'u1,a', 'u1,b', 'u2,b', 'u2,c', 'u3,a']:
+            print(row, file=fout)
+
+        config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+        config.add_mode('user')
+        config.add_mode('item')
+        config.set_min_count(2)
+        config.set_merge_func(tensor_config.MERGE_NONE)
+        stats = builder.build_tensor(config)
+
+        # c and u3 go first, then u2, then b
+        with open('out.tns', 'r') as fin:
+          lines = [l.strip() for l in fin.readlines()]
+        self.assertEqual(lines, ['1 1 1', '1 1 1'])
+        self.assertEqual(stats.pruned_rows, 4)
+        with open('mode-2-item.map', 'r') as fin:
+          self.assertEqual(fin.read().split(), ['a'])
+      finally:
+        os.chdir(cwd)
+
+
+  def test_build_sparse_tensor(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          print('u1,a,1', file=fout)
+          print('u2,b,2', file=fout)
+          print('u1,a,4', file=fout)
+
+        config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+        config.add_mode('user')
+        config.add_mode('item')
+        config.set_vals('val')
+        tensor = builder.build_sparse_tensor(config)
+
+        # nothing is written
+        self.assertEqual(sorted(os.listdir('.')), ['in.csv'])
+        self.assertEqual(tensor.dims, [2, 2])
+        self.assertEqual(list(tensor.inds[0]), [0, 1])
+        self.assertEqual(list(tensor.inds[1]), [0, 1])
+        self.assertEqual(list(tensor.vals), [5., 2.])
+        self.assertEqual(tensor.indmaps[0]['u2'], 2)
+        self.assertEqual(tensor.stats.nnz, 2)
+      finally:
+        os.chdir(cwd)
+
+
+  def test_build_stream(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        rows = [['user', 'item', 'val'], ['u1', 'a', 1], ['u2', 'b', 2.5],
+            ['u1', 'a', 4], ['u3', '', 1]]
+        config = tensor_config(csv_names=[iter(rows)], tensor_name='out.tns')
+        config.set_header(True)
+        config.add_mode('user')
+        config.add_mode('item',
+            transform=lambda x : x if len(x) > 0 else None)
+        config.set_vals('val')
+        with open(os.devnull, 'w') as redirect:
+          with redirect_stderr(redirect):
+            stats = builder.build_tensor(config)
+
+        with open('out.tns', 'r') as fin:
+          lines = [l.strip() for l in fin.readlines()]
+        self.assertEqual(lines, ['1 1 5', '2 2 2.5'])
+        self.assertEqual(stats.pruned_rows, 1)
+        with open('mode-1-user.map', 'r') as fin:
+          self.assertEqual(fin.read().split(), ['u1', 'u2'])
+      finally:
+        os.chdir(cwd)
+
+
+  def test_spool_values(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        vals = ['5', '', '0.12345678901234567890', 'n/a', '1e3', '-0']
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          for i in range(60):
+            print('u{},i{},{}'.format(i % 4, i % 9, vals[i % len(vals)]),
+                file=fout)
+
+        def build(name, inputs):
+          config = tensor_config(csv_names=inputs, tensor_name=name)
+          config.set_header(True)
+          config.set_delimiter(',')
+          config.add_mode('user')
+          config.add_mode('item')
+          config.set_vals('val')
+          config.set_merge_func(tensor_config.MERGE_NONE)
+          return config
+
+        builder.build_tensor(build('file.tns', ['in.csv']))
+        with open('in.csv', 'rb') as fin:
+          builder.build_tensor(build('stream.tns', [fin]))
+        builder.build_tensors([build('multi.tns', ['in.csv'])])
+
+        with open('file.tns', 'rb') as fin:
+          expected = fin.read()
+        self.assertIn(b' 0.12345678901234567890\n', expected)
+        for name in ['stream.tns', 'multi.tns']:
+          with open(name, 'rb') as fin:
+            self.assertEqual(fin.read(), expected)
+      finally:
+        os.chdir(cwd)
+
+
+  def test_build_sample(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item', file=fout)
+          for i in range(1000):
+            print('u{},i{}'.format(i % 10, i), file=fout)
+          print('rare,i0', file=fout)
+
+        config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+        config.add_mode('user')
+        config.add_mode('item')
+        config.set_sample(rows=20, seed=5, stratify='user')
+        stats = builder.build_tensor(config)
+
+        with open('out.tns', 'r') as fin:
+          lines = fin.readlines()
+        self.assertEqual(len(lines), 20)
+        self.assertEqual(stats.nnz, 20)
+        self.assertEqual(stats.sampled_rows, 20)
+        self.assertEqual(stats.phases['count']['rows'], 1001)
+        # only sampled keys are mapped, and every user keeps a row
+        with open('mode-1-user.map', 'r') as fin:
+          self.assertEqual(len(fin.read().split()), 11)
+        with open('mode-2-item.map', 'r') as fin:
+          self.assertEqual(len(fin.read().split()), 20)
+        # each input is read once
+        self.assertEqual(stats.inputs['in.csv']['passes'], 1)
+
+        # the same seed gives the same tensor
+        builder.build_tensor(config)
+        with open('out.tns', 'r') as fin:
+          self.assertEqual(fin.readlines(), lines)
+
+        config.set_sample(rate=0.1, seed=5)
+        stats = builder.build_tensor(config)
+        self.assertTrue(50 < stats.nnz < 150)
+        self.assertEqual(stats.sampled_rows, stats.nnz)
+
+        config.set_checkpoint('ckpt')
+        self.assertRaises(ValueError, builder.build_tensor, config)
+      finally:
+        os.chdir(cwd)
+
+
+  def test_build_tensors(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,day', file=fout)
+          for row in ['u2,a,1', 'u1,b,2', 'u2,a,2', 'u3,c,1']:
+            print(row, file=fout)
+
+        configs = []
+        for name, fields in [('ui.tns', ['user', 'item']),
+            ('ud.tns', ['user', 'day'])]:
+          config = tensor_config(csv_names=['in.csv'], tensor_name=name)
+          for field in fields:
+            config.add_mode(field)
+          configs.append(config)
+        configs[1].add_filter('day', tensor_config.FILTER_EQ, '2')
+
+        stats = builder.build_tensors(configs)
+        self.assertEqual(stats[0].phases['count']['rows'], 4)
+        self.assertEqual(stats[0].inputs['in.csv']['passes'], 1)
+        self.assertEqual(stats[1].rejected_rows, 2)
+
+        with open('ui.tns', 'r') as fin:
+          lines = [l.strip() for l in fin.readlines()]
+        self.assertEqual(lines, ['1 2 1', '2 1 2', '3 3 1'])
+        with open('ud.tns', 'r') as fin:
+          lines = [l.strip() for l in fin.readlines()]
+        self.assertEqual(lines, ['1 1 1', '2 1 1'])
+
+        with self.assertRaises(ValueError):
+          builder.build_tensors([configs[0],
+              tensor_config(csv_names=['other.csv'])])
+      finally:
+        os.chdir(cwd)
+
+
+  def test_merge_failure(self):
+    tmp_name = str(uuid.uuid4().hex) + '.tmp'
+    try:
+      with open(tmp_name, 'w') as fout:
+        print('1 2 3 1.0', file=fout)
+        print('1 2 3 oops', file=fout)
+
+      # the original data is kept and the error is not swallowed
+      with self.assertRaises(ValueError):
+        builder.merge_dups(tmp_name, 3)
+      with open(tmp_name, 'r') as fin:
+        self.assertEqual(len(fin.readlines()), 2)
+    finally:
+      os.remove(tmp_name)
+
+
+  def test_build_pipeline(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          print('u1,"a\nb",1', file=fout)
+          for i in range(5000):
+            print('u{},i{},{}'.format(i % 7, i % 11, i % 3), file=fout)
+
+        outputs = []
+        for depth in [None, 2]:
+          config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+          config.add_mode('user')
+          config.add_mode('item')
+          config.set_vals('val')
+          config.set_merge_func(tensor_config.MERGE_NONE)
+          config.set_pipeline(depth)
+          stats = builder.build_tensor(config)
+          with open('out.tns', 'r') as fin:
+            outputs.append(fin.read())
+
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(stats.nnz, 5001)
+        self.assertEqual(stats.phases['emit']['rows'], 5001)
+        self.assertEqual(list(stats.phases['emit']['stages'].keys()),
+            ['read', 'parse', 'map', 'write'])
+      finally:
+        os.chdir(cwd)
+
+
+  def test_bad_rows(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          for i in range(20):
+            print('u{},i{},{}'.format(i % 3, i % 4, i), file=fout)
+            if i % 5 == 0:
+              print('u{}'.format(i), file=fout)
+          print('u9,i9,1,extra', file=fout)
+
+        def make_config(policy, quarantine=None):
+          config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+          config.add_mode('user')
+          config.add_mode('item')
+          config.set_vals('val')
+          config.set_header(True)
+          config.set_delimiter(',')
+          config.set_merge_func(sum)
+          config.set_output_dir('out')
+          config.set_bad_rows(policy, quarantine)
+          return config
+
+        with self.assertRaisesRegex(ValueError, 'line 3: expected 3 fields'):
+          builder.build_tensor(make_config('abort'))
+
+        for pipeline in [None, 2]:
+          config = make_config('quarantine', 'bad.csv')
+          config.set_pipeline(pipeline)
+          config.set_min_count(2)
+          stats = builder.build_tensor(config)
+          self.assertEqual(stats.bad_rows,
+              {'short' : 4, 'long' : 1, 'unparseable' : 0})
+          self.assertEqual(stats.to_dict()['bad_rows']['short'], 4)
+          self.assertEqual(stats.nnz, 12)
+          with open(os.path.join('out', 'bad.csv')) as fin:
+            self.assertEqual(fin.read().splitlines(),
+                ['u0', 'u5', 'u10', 'u15', 'u9,i9,1,extra'])
+
+        with open(os.devnull, 'w') as redirect:
+          with redirect_stderr(redirect):
+            stats = builder.build_tensors([make_config('count')])[0]
+        self.assertEqual(sum(stats.bad_rows.values()), 5)
+      finally:
+        os.chdir(cwd)
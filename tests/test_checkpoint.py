@@ -0,0 +1,87 @@
+
+import unittest
+
+import os, sys
+import time
+import tempfile
+sys.path.append(os.path.abspath('..'))
+
+import tests
+from tensor_parser import builder
+from tensor_parser.tensor_config import tensor_config
+
+class TestCheckpoint(unittest.TestCase):
+
+  def _config(self, resume=False):
+    config = tensor_config(csv_names=['a.csv', 'b.csv'],
+        tensor_name='out.tns')
+    config.add_mode('user')
+    config.add_mode('item')
+    config.set_vals('val')
+    config.set_checkpoint('ckpt', resume)
+    return config
+
+  def _write(self):
+    with open('a.csv', 'w') as fout:
+      print('user,item,val', file=fout)
+      for row in ['u2,x,1', 'u1,y,2', 'u2,x,3']:
+        print(row, file=fout)
+    with open('b.csv', 'w') as fout:
+      print('user,item,val', file=fout)
+      for row in ['u1,y,4', 'u3,x,5']:
+        print(row, file=fout)
+
+  def test_resume(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      old_sort = builder.sort_tensor
+      try:
+        self._write()
+
+        # fail while sorting the emitted parts
+        def fail(tensor_name, mode_order, tmp_dir=None, split_mb=None):
+          raise RuntimeError('interrupted')
+        builder.sort_tensor = fail
+        with self.assertRaises(RuntimeError):
+          builder.build_tensor(self._config())
+        builder.sort_tensor = old_sort
+        self.assertTrue(os.path.exists(os.path.join('ckpt', 'part-1.tns')))
+
+        stats = builder.build_tensor(self._config(resume=True))
+        self.assertEqual(len(stats.inputs), 0) # no input was read again
+        self.assertEqual(stats.nnz, 3)
+        with open('out.tns', 'r') as fin:
+          lines = [l.strip() for l in fin.readlines()]
+        self.assertEqual(lines, ['1 2 6', '2 1 4', '3 1 5'])
+        self.assertFalse(os.path.exists('ckpt'))
+      finally:
+        builder.sort_tensor = old_sort
+        os.chdir(cwd)
+
+
+  def test_changed_inputs(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      old_merge = builder._merge_lines
+      try:
+        self._write()
+        def fail(lines, fout, merge_func, slices=None):
+          raise RuntimeError('interrupted')
+        builder._merge_lines = fail
+        with self.assertRaises(RuntimeError):
+          builder.build_tensor(self._config())
+        builder._merge_lines = old_merge
+
+        now = time.time()
+        os.utime('b.csv', (now, now + 1))
+        with self.assertRaises(ValueError):
+          builder.build_tensor(self._config(resume=True))
+      finally:
+        builder._merge_lines = old_merge
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,15 +1,17 @@
 
 import unittest
 import argparse
-from contextlib import redirect_stdout
+from contextlib import redirect_stdout, redirect_stderr
 
 import os, sys
+import subprocess
 sys.path.append(os.path.abspath('..'))
 
 import tests
 from scripts import build_tensor
 
 from tensor_parser.index_map import index_map
+from tensor_parser.tensor_config import tensor_config
 
 class TestCSVParser(unittest.TestCase):
 
@@ -78,6 +80,145 @@ class TestCSVParser(unittest.TestCase):
         config = build_tensor.parse_args(myargs)
     f = config.get_mode('1')['type']
     self.assertEqual(f('1.38'), 1.4)
+    self.assertEqual(f.batch(['1.38', 'x'])[0], [1.4, None])
+
+  def test_type_epoch(self):
+    myargs = ['hi.csv', 'out.tns', '-fa', '-fb', '-fc',
+        '--type=a,epoch', '--type=b,bucket-3600', '--type=c,dow']
+
+    with open(os.devnull, 'w') as redirect:
+      with redirect_stdout(redirect):
+        config = build_tensor.parse_args(myargs)
+    self.assertIs(config.get_mode('a')['type'], index_map.TYPE_EPOCH)
+    self.assertEqual(config.get_mode('b')['type']('7300'), 7200)
+    self.assertEqual(str(config.get_mode('c')['type']('0')), 'Thu')
+
+  def test_sample(self):
+    myargs = ['hi.csv', 'out.tns', '-fa', '--sample-rows=100',
+        '--sample-seed=7', '--sample-by=A']
+    config = build_tensor.parse_args(myargs)
+    self.assertEqual(config.get_sample(), {'rate' : None, 'rows' : 100,
+        'seed' : 7, 'stratify' : 'A'})
+
+    myargs = ['hi.csv', 'out.tns', '-fa', '--sample-rate=0.5']
+    config = build_tensor.parse_args(myargs)
+    self.assertEqual(config.get_sample()['rate'], 0.5)
+
+    for bad in [['--sample-rate=2'], ['--sample-by=b', '--sample-rows=5'],
+        ['--sample-by=a']]:
+      with open(os.devnull, 'w') as redirect:
+        with redirect_stderr(redirect):
+          with self.assertRaises(SystemExit):
+            build_tensor.parse_args(['hi.csv', 'out.tns', '-fa'] + bad)
+
+  def test_serve(self):
+    myargs = ['hi.csv', 'out', '-fa', '--serve-spool=incoming',
+        '--serve-poll=0.5']
+    config = build_tensor.parse_args(myargs)
+    self.assertEqual(config.get_serve(), {'socket' : None,
+        'spool' : 'incoming', 'poll' : 0.5})
+    self.assertIsNone(build_tensor.parse_args(['hi.csv', 'out',
+        '-fa']).get_serve())
+
+  def test_slices(self):
+    myargs = ['hi.csv', 'out.tns', '-fa', '--slices=out.slices',
+        '--slice-parts=8', '--output-dir=job']
+    config = build_tensor.parse_args(myargs)
+    self.assertEqual(config.get_slices(), os.path.join('job', 'out.slices'))
+    self.assertEqual(config.get_slice_parts(), 8)
+    with open(os.devnull, 'w') as redirect:
+      with redirect_stderr(redirect):
+        with self.assertRaises(SystemExit):
+          build_tensor.parse_args(myargs + ['--slice-parts=0'])
+
+  def test_memory_limit(self):
+    myargs = ['hi.csv', 'out.tns', '-fa']
+    self.assertIsNone(build_tensor.parse_args(myargs).get_memory_limit())
+    config = build_tensor.parse_args(myargs + ['--memory-limit=512M'])
+    self.assertEqual(config.get_memory_limit(), 512 << 20)
+    with open(os.devnull, 'w') as redirect:
+      with redirect_stderr(redirect):
+        with self.assertRaises(SystemExit):
+          build_tensor.parse_args(myargs + ['--memory-limit=lots'])
+
+  def test_query_stats_stdin(self):
+    script = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(build_tensor.__file__))), 'scripts', 'build_tensor.py')
+    text = 'user,item\n' + ''.join('u{},i{}\n'.format(i % 7, i % 3)
+        for i in range(300))
+    result = subprocess.run([sys.executable, script, '-', 'out.tns', '-f',
+        'user', '-f', 'item', '--query-stats'], input=text,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    self.assertEqual(result.returncode, 0, result.stderr)
+    # the rows after the buffered header are scanned too
+    self.assertIn('Scanned 300 rows', result.stdout)
+
+  def test_bad_rows(self):
+    myargs = ['hi.csv', 'out.tns', '-fa']
+    self.assertEqual(build_tensor.parse_args(myargs).get_bad_rows(), 'abort')
+    config = build_tensor.parse_args(myargs + ['--bad-rows=count'])
+    self.assertEqual(config.get_bad_rows(), 'count')
+    self.assertIsNone(config.get_quarantine())
+    config = build_tensor.parse_args(myargs + ['--quarantine=bad.csv',
+        '--output-dir=job'])
+    self.assertEqual(config.get_bad_rows(), 'quarantine')
+    self.assertEqual(config.get_quarantine(), os.path.join('job', 'bad.csv'))
+    with open(os.devnull, 'w') as redirect:
+      with redirect_stderr(redirect):
+        for bad in [['--bad-rows=ignore'], ['--bad-rows=quarantine'],
+            ['--bad-rows=skip', '--quarantine=bad.csv']]:
+          with self.assertRaises(SystemExit):
+            build_tensor.parse_args(myargs + bad)
+
+  def test_type_compiled_once(self):
+    myargs = ['hi.csv', 'out.tns', '-fa', '-fb', '-fc',
+        '--type=a,lambda x: x.lower()', '--type=b,lambda x: x.lower()',
+        '--type=c,roundf-2']
+
+    with open(os.devnull, 'w') as redirect:
+      with redirect_stdout(redirect):
+        config = build_tensor.parse_args(myargs)
+    # fields with the same custom type share one function
+    self.assertIs(config.get_mode('a')['type'], config.get_mode('b')['type'])
+    self.assertEqual(config.get_mode('a')['type']('HI'), 'hi')
+    self.assertEqual(config.get_mode('c')['type']('1.234'), 1.23)
+
+  def test_sort_count(self):
+    myargs = ['hi.csv', 'out.tns', '-fa', '-fb', '--sort-count=b',
+        '--no-sort=a']
+    config = build_tensor.parse_args(myargs)
+    self.assertEqual(config.get_mode('a')['sort'], False)
+    self.assertEqual(config.get_mode('b')['sort'], index_map.SORT_COUNT)
+
+  def test_progress(self):
+    myargs = ['hi.csv', 'out.tns', '-fa']
+    config = build_tensor.parse_args(myargs)
+    self.assertEqual(config.get_progress(), None)
+
+    myargs = ['hi.csv', 'out.tns', '-fa', '--progress']
+    config = build_tensor.parse_args(myargs)
+    self.assertTrue(callable(config.get_progress()))
+
+  def test_where(self):
+    myargs = ['hi.csv', 'out.tns', '-fa', '--where=a=1', '--where=b=x,y',
+        '--where-range=c=,5']
+    config = build_tensor.parse_args(myargs)
+    filters = config.get_filters()
+    self.assertEqual(len(filters), 3)
+    self.assertEqual(filters[0]['op'], tensor_config.FILTER_EQ)
+    self.assertEqual(filters[0]['value'], '1')
+    self.assertEqual(filters[1]['op'], tensor_config.FILTER_IN)
+    self.assertEqual(filters[1]['value'], ['x', 'y'])
+    self.assertEqual(filters[2]['op'], tensor_config.FILTER_RANGE)
+    self.assertEqual(filters[2]['value'], (None, '5'))
+
+  def test_mode_order(self):
+    myargs = ['hi.csv', 'out.tns', '-fa', '-fb', '--mode-order=b,a',
+        '--csf=out.csf']
+    config = build_tensor.parse_args(myargs)
+    self.assertEqual(config.get_mode_order(), [1, 0])
+    self.assertEqual(config.get_csf(), 'out.csf')
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+
+
+import unittest
+
+import os
+import uuid
+
+import tests
+from tensor_parser import csf
+
+class TestCSF(unittest.TestCase):
+
+  def test_build(self):
+    lines = ['1 1 1 1.0', '1 1 2 2.0', '1 2 1 3.0', '2 2 2 4.0']
+    fptr, fids, vals = csf.build_csf(lines, 3, [0, 1, 2])
+
+    self.assertEqual(list(fids[0]), [0, 1])
+    self.assertEqual(list(fptr[0]), [0, 2, 3])
+    self.assertEqual(list(fids[1]), [0, 1, 1])
+    self.assertEqual(list(fptr[1]), [0, 2, 3, 4])
+    self.assertEqual(list(fids[2]), [0, 1, 0, 1])
+    self.assertEqual(list(vals), [1.0, 2.0, 3.0, 4.0])
+
+
+  def test_build_mode_order(self):
+    # sorted by mode 2, then mode 1
+    lines = ['2 1 1.0', '1 2 2.0', '3 2 3.0']
+    fptr, fids, vals = csf.build_csf(lines, 2, [1, 0])
+
+    self.assertEqual(list(fids[0]), [0, 1])
+    self.assertEqual(list(fptr[0]), [0, 1, 3])
+    self.assertEqual(list(fids[1]), [1, 0, 2])
+
+
+  def test_build_dups(self):
+    lines = ['1 1 1.0', '1 1 2.0']
+    fptr, fids, vals = csf.build_csf(lines, 2, [0, 1])
+    self.assertEqual(list(fids[0]), [0])
+    self.assertEqual(list(fptr[0]), [0, 2])
+    self.assertEqual(list(fids[1]), [0, 0])
+
+
+  def test_roundtrip(self):
+    tns_name = str(uuid.uuid4().hex) + '.tns'
+    csf_name = str(uuid.uuid4().hex) + '.csf'
+    try:
+      with open(tns_name, 'w') as fout:
+        print('1 1 1 1.0', file=fout)
+        print('1 2 1 3.5', file=fout)
+        print('2 2 2 4.0', file=fout)
+      csf.write_csf(tns_name, csf_name, [2, 2, 2])
+
+      tt = csf.read_csf(csf_name)
+      self.assertEqual(tt['dims'], [2, 2, 2])
+      self.assertEqual(tt['mode_order'], [0, 1, 2])
+      self.assertEqual(list(tt['fptr'][0]), [0, 2, 3])
+      self.assertEqual(list(tt['fids'][2]), [0, 0, 1])
+      self.assertEqual(list(tt['vals']), [1.0, 3.5, 4.0])
+    finally:
+      os.remove(tns_name)
+      if os.path.exists(csf_name):
+        os.remove(csf_name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 
 import unittest
 
+import io
 import os
 import uuid
 
@@ -88,6 +89,130 @@ class TestCSVParser(unittest.TestCase):
     finally:
       os.remove(tmp_name)
 
+  def test_progress(self):
+    tmp_name = str(uuid.uuid4().hex) + '.csv.gz'
+    try:
+      # make csv
+      with csv_parser.open_file(tmp_name, 'w') as fout:
+        for i in range(100):
+          print('{},2,3,1.0'.format(i), file=fout)
+      p = csv_parser.csv_parser(tmp_name, has_header=False)
+
+      reports = []
+      old_rows = csv_parser.csv_parser.PROGRESS_ROWS
+      csv_parser.csv_parser.PROGRESS_ROWS = 30
+      try:
+        nrows = len(list(p.rows(lambda r, b : reports.append((r, b)))))
+      finally:
+        csv_parser.csv_parser.PROGRESS_ROWS = old_rows
+
+      self.assertEqual(nrows, 100)
+      self.assertEqual([r for r, b in reports], [30, 60, 90, 100])
+      self.assertEqual(reports[-1][1], os.path.getsize(tmp_name))
+    finally:
+      os.remove(tmp_name)
+
+  def test_predicate(self):
+    tmp_name = str(uuid.uuid4().hex) + '.csv'
+    try:
+      # make csv
+      with open(tmp_name, 'w') as fout:
+        print('a,b', file=fout)
+        for i in range(10):
+          print('{},x'.format(i), file=fout)
+      p = csv_parser.csv_parser(tmp_name, has_header=True)
+      rows = list(p.rows(predicate=lambda row : int(row[0]) % 2 == 0))
+      self.assertEqual([r[0] for r in rows], ['0', '2', '4', '6', '8'])
+      self.assertEqual(p.num_rejected(), 5)
+    finally:
+      os.remove(tmp_name)
+
+  def test_sample_header(self):
+    tmp_name = str(uuid.uuid4().hex) + '.csv'
+    try:
+      with open(tmp_name, 'w') as fout:
+        print('user,item', file=fout)
+        for i in range(100):
+          print('u{},i{}'.format(i, i % 3), file=fout)
+      p = csv_parser.csv_parser(tmp_name, has_header=True)
+      # every block is sampled, so the whole file was read
+      rows = list(p.sample_rows(0.99, block_size=64))
+      self.assertEqual(len(rows), 100)
+      self.assertEqual(p.sampled_fraction(), 1.0)
+    finally:
+      os.remove(tmp_name)
+
+  def test_stream(self):
+    text ='user,item\n' + ''.join('u{},i{}\n'.format(i, i % 3)
+        for i in range(200))
+    p = csv_parser.csv_parser(io.BytesIO(text.encode()))
+    self.assertEqual(p.get_header(), ['user', 'item'])
+    rows = list(p.rows())
+    self.assertEqual(len(rows), 200)
+    self.assertEqual(rows[150], ['u150', 'i0'])
+    self.assertEqual(p.file_size(), 0)
+
+    # streams can only be read once
+    with self.assertRaises(ValueError):
+      list(p.rows())
+
+  def test_iterable(self):
+    rows = [('user', 'count')] + [('u{}'.format(i), i) for i in range(5)]
+    p = csv_parser.csv_parser(iter(rows), has_header=True)
+    self.assertEqual(p.get_header(), ['user', 'count'])
+    self.assertEqual(list(p.rows())[-1], ['u4', '4'])
+    self.assertTrue(csv_parser.is_stream('-'))
+    self.assertFalse(csv_parser.is_stream('data.csv'))
+
+  def test_bad_rows(self):
+    tmp_name = str(uuid.uuid4().hex) + '.csv'
+    quarantine = tmp_name + '.bad'
+    try:
+      with open(tmp_name, 'w') as fout:
+        print('a,b,c', file=fout)
+        print('1,2,3', file=fout)
+        print('4,5', file=fout)
+        print('"{}",5,6'.format('x' * 200000), file=fout) # over the limit
+        print('7,8,9,10', file=fout)
+        print('11,12,13', file=fout)
+      p = csv_parser.csv_parser(tmp_name, ',', True)
+
+      # abort by default
+      with self.assertRaisesRegex(ValueError, 'line 3: expected 3 fields'):
+        list(p.rows())
+
+      p.set_bad_rows('skip')
+      rows = list(p.rows())
+      self.assertEqual(rows, [['1', '2', '3'], ['11', '12', '13']])
+      self.assertEqual(p.bad_rows(),
+          {'short' : 1, 'long' : 1, 'unparseable' : 1})
+      batches = list(p.parse_blocks(p.read_blocks(), batch_size=1))
+      self.assertEqual(batches, [[r] for r in rows])
+      self.assertEqual(sum(p.bad_rows().values()), 3)
+
+      p.set_bad_rows('quarantine', quarantine)
+      rows = list(p.rows(predicate=lambda row : row[0] == '1'))
+      self.assertEqual(rows, [['1', '2', '3']])
+      self.assertEqual(p.num_rejected(), 1)
+      with open(quarantine) as fin:
+        self.assertEqual(fin.read().splitlines(), ['4,5', '7,8,9,10'])
+
+      with self.assertRaises(ValueError):
+        p.set_bad_rows('ignore')
+      with self.assertRaises(ValueError):
+        p.set_bad_rows('skip', quarantine)
+
+      # rows of a stream have no line numbers
+      p = csv_parser.csv_parser(iter([('a', 'b'), ('1', '2'), ('3',)]),
+          has_header=True)
+      with self.assertRaisesRegex(ValueError, 'expected 2 fields, found 1'):
+        list(p.rows())
+    finally:
+      for name in [tmp_name, quarantine]:
+        if os.path.exists(name):
+          os.remove(name)
+
+
 
 if __name__ == '__main__':
     unittest.main()
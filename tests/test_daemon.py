@@ -0,0 +1,228 @@
+
+import unittest
+
+import os, sys
+import json
+import socket
+import tempfile
+import threading
+import time
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+sys.path.append(os.path.abspath('..'))
+
+import tests
+from tensor_parser.daemon import build_daemon, serve_socket, watch_spool
+from tensor_parser.tensor_config import tensor_config
+
+class TestDaemon(unittest.TestCase):
+
+  def setUp(self):
+    self._cwd = os.getcwd()
+    self._tmp = tempfile.TemporaryDirectory()
+    os.chdir(self._tmp.name)
+
+  def tearDown(self):
+    os.chdir(self._cwd)
+    self._tmp.cleanup()
+
+  def _config(self):
+    config = tensor_config(csv_names=[], tensor_name='out')
+    config.set_header(True)
+    config.add_mode('user')
+    config.add_mode('item')
+    config.set_vals('val')
+    return config
+
+  def _write(self, fname, rows):
+    with open(fname, 'w') as fout:
+      print('user,item,val', file=fout)
+      for row in rows:
+        print(row, file=fout)
+
+  def _read(self, fname):
+    with open(os.path.join('out', fname), 'r') as fin:
+      return [l.strip() for l in fin.readlines()]
+
+
+  def test_stable_indices(self):
+    daemon = build_daemon(self._config(), 'out')
+    self._write('a.csv', ['u2,x,1', 'u1,y,2', 'u2,x,3'])
+    metrics = daemon.process(['a.csv'])
+    self.assertEqual(metrics['batch'], 1)
+    self.assertEqual(metrics['rows'], 3)
+    self.assertEqual(metrics['nnz'], 2)
+    self.assertEqual(metrics['new_keys'], [2, 2])
+    for k in ['wait', 'read', 'map', 'emit', 'commit', 'latency']:
+      self.assertGreaterEqual(metrics[k], 0.)
+    self.assertEqual(self._read('batch-000001.tns'), ['1 1 4', '2 2 2'])
+
+    # known keys keep their indices, new keys get the next ones
+    self._write('b.csv', ['u3,y,5', 'u1,z,1'])
+    metrics = daemon.process(['b.csv'])
+    self.assertEqual(metrics['new_keys'], [1, 1])
+    self.assertEqual(metrics['first_index'], [3, 3])
+    self.assertEqual(self._read('batch-000002.tns'), ['2 3 1', '3 2 5'])
+    self.assertEqual(self._read('batch-000002.mode-1-user.map'), ['u3'])
+    self.assertEqual(self._read('batch-000002.mode-2-item.map'), ['z'])
+    self.assertEqual(self._read('mode-1-user.map'), ['u2', 'u1', 'u3'])
+
+    # a restarted daemon continues from the saved state
+    daemon = build_daemon(self._config(), 'out')
+    self.assertEqual(daemon.num_batches, 2)
+    self._write('c.csv', ['u4,x,1', 'u3,x,1'])
+    metrics = daemon.process(['c.csv'])
+    self.assertEqual(metrics['batch'], 3)
+    self.assertEqual(self._read('batch-000003.tns'), ['3 1 1', '4 1 1'])
+    self.assertEqual(self._read('mode-1-user.map'), ['u2', 'u1', 'u3', 'u4'])
+
+    with open(os.path.join('out', 'metrics.json'), 'r') as fin:
+      summary = json.load(fin)['summary']
+    self.assertEqual(summary['batches'], 3)
+    self.assertEqual(summary['mode_lengths'], [4, 3])
+
+
+  def test_failed_batch(self):
+    daemon = build_daemon(self._config(), 'out')
+    self._write('a.csv', ['u1,x,1'])
+    daemon.process(['a.csv'])
+
+    # the first input adds keys, but the second cannot be read
+    self._write('b.csv', ['u2,y,1'])
+    self.assertRaises(OSError, daemon.process, ['b.csv', 'missing.csv'])
+    self.assertEqual(len(daemon.indmaps[0]), 1)
+    self.assertEqual(daemon.num_batches, 1)
+    self.assertFalse(os.path.exists(os.path.join('out', 'batch-000002.tns')))
+
+
+  def test_crash_recovery(self):
+    daemon = build_daemon(self._config(), 'out')
+    self._write('a.csv', ['u1,x,1'])
+    daemon.process(['a.csv'])
+    self._write('b.csv', ['u2,x,1', 'u1,y,1'])
+
+    # crash after journaling batch 2, before publishing it
+    journal = daemon._journal
+    def crash(batch, counts):
+      journal(batch, counts)
+      raise RuntimeError('crash')
+    daemon._journal = crash
+    self.assertRaises(RuntimeError, daemon.process, ['b.csv'])
+    daemon = build_daemon(self._config(), 'out')
+    self.assertEqual(daemon.num_batches, 1)
+    self.assertEqual(len(daemon.indmaps[0]), 1)
+    self.assertEqual([f for f in os.listdir('out') if 'batch-000002' in f], [])
+
+    # crash after publishing batch 2, before committing its keys
+    def crash(batch, counts):
+      raise RuntimeError('crash')
+    daemon._commit = crash
+    self.assertRaises(RuntimeError, daemon.process, ['b.csv'])
+    self.assertTrue(os.path.exists(os.path.join('out', 'batch-000002.tns')))
+    daemon = build_daemon(self._config(), 'out')
+    self.assertEqual(daemon.num_batches, 2)
+    self.assertEqual(self._read('mode-1-user.map'), ['u1', 'u2'])
+    self.assertEqual(self._read('mode-2-item.map'), ['x', 'y'])
+    self.assertEqual(self._read('batch-000002.tns'), ['1 2 1', '2 1 1'])
+
+    self._write('c.csv', ['u3,y,1'])
+    self.assertEqual(daemon.process(['c.csv'])['batch'], 3)
+    self.assertEqual(self._read('batch-000003.tns'), ['3 2 1'])
+
+
+  def test_journal(self):
+    journal = os.path.join('out', build_daemon.JOURNAL_FILE)
+    state = os.path.join('out', build_daemon.STATE_FILE)
+    daemon = build_daemon(self._config(), 'out')
+    for b in range(5):
+      self._write('a.csv', ['u{},x,1'.format(b), 'u0,y,1'])
+      daemon.process(['a.csv'])
+    # small batches append to the journal without a snapshot of the maps
+    self.assertFalse(os.path.exists(state))
+    size = os.path.getsize(journal)
+
+    # a torn record is dropped on restart
+    with open(journal, 'ab') as fout:
+      fout.write(b'\x80\x04torn')
+    daemon = build_daemon(self._config(), 'out')
+    self.assertEqual(daemon.num_batches, 5)
+    self.assertEqual(daemon.indmaps[0].get_counts()['u0'], 6)
+    self.assertEqual(os.path.getsize(journal), size)
+
+    # once compacted, the snapshot holds the maps and the journal is empty
+    old_min = build_daemon.JOURNAL_MIN_BYTES
+    build_daemon.JOURNAL_MIN_BYTES = 0
+    try:
+      self._write('a.csv', ['u5,z,1'])
+      daemon.process(['a.csv'])
+    finally:
+      build_daemon.JOURNAL_MIN_BYTES = old_min
+    self.assertTrue(os.path.exists(state))
+    self.assertEqual(os.path.getsize(journal), 0)
+    daemon = build_daemon(self._config(), 'out')
+    self.assertEqual(daemon.num_batches, 6)
+    self.assertEqual(self._read('mode-1-user.map'),
+        ['u0', 'u1', 'u2', 'u3', 'u4', 'u5'])
+    self.assertEqual(self._read('mode-2-item.map'), ['x', 'y', 'z'])
+
+
+  def test_socket(self):
+    daemon = build_daemon(self._config(), 'out')
+    self._write('a.csv', ['u1,x,1', 'u2,y,1'])
+    path = os.path.join(self._tmp.name, 'daemon.sock')
+    with redirect_stderr(StringIO()):
+      server = threading.Thread(target=serve_socket, args=(daemon, path))
+      server.start()
+      try:
+        for _ in range(100):
+          if os.path.exists(path):
+            break
+          time.sleep(0.05)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+          sock.connect(path)
+          fio = sock.makefile('rw')
+          for request in [{'inputs' : ['a.csv']}, {'cmd' : 'stats'},
+              {'inputs' : ['missing.csv']}, {'cmd' : 'shutdown'}]:
+            print(json.dumps(request), file=fio, flush=True)
+          replies = [json.loads(fio.readline()) for _ in range(4)]
+      finally:
+        server.join(10)
+
+    self.assertEqual(replies[0]['nnz'], 2)
+    self.assertEqual(replies[1]['summary']['batches'], 1)
+    self.assertIn('error', replies[2])
+    self.assertEqual(replies[3], {'ok' : True})
+    self.assertFalse(server.is_alive())
+    self.assertFalse(os.path.exists(path))
+
+
+  def test_spool(self):
+    daemon = build_daemon(self._config(), 'out')
+    os.makedirs('spool')
+    self._write(os.path.join('spool', '1.csv'), ['u1,x,1'])
+    self._write(os.path.join('spool', '2.csv'), ['u2,x,1'])
+    self._write(os.path.join('spool', '.3.csv'), ['u3,x,1'])
+    with redirect_stderr(StringIO()):
+      watch_spool(daemon, 'spool', poll=0.01, max_batches=1)
+
+    self.assertEqual(self._read('batch-000001.tns'), ['1 1 1', '2 1 1'])
+    self.assertEqual(sorted(os.listdir(os.path.join('spool', 'done'))),
+        ['1.csv', '2.csv'])
+    self.assertTrue(os.path.exists(os.path.join('spool', '.3.csv')))
+
+    # an unparseable file fails its batch without stopping the daemon
+    open(os.path.join('spool', '4.csv'), 'w').close()
+    with redirect_stderr(StringIO()):
+      with redirect_stdout(StringIO()):
+        watch_spool(daemon, 'spool', poll=0.01, max_batches=1)
+    self.assertEqual(os.listdir(os.path.join('spool', 'failed')), ['4.csv'])
+    self.assertEqual(daemon.num_batches, 1)
+
+    self._write(os.path.join('spool', '5.csv'), ['u3,x,1'])
+    with redirect_stderr(StringIO()):
+      watch_spool(daemon, 'spool', poll=0.01, max_batches=1)
+    self.assertEqual(self._read('batch-000002.tns'), ['3 1 1'])
+
+
+if __name__ == '__main__':
+  unittest.main()
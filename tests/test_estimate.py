@@ -0,0 +1,62 @@
+
+
+import unittest
+
+import os
+import uuid
+from contextlib import redirect_stdout
+
+import tests
+from tensor_parser import estimate
+from tensor_parser.tensor_config import tensor_config
+
+class TestEstimate(unittest.TestCase):
+
+  def test_distinct_full(self):
+    # the sample is the whole data
+    self.assertEqual(estimate.estimate_distinct(4, [2, 1, 1]), 3)
+
+
+  def test_distinct_unique(self):
+    # every sampled key is unique: extrapolate linearly
+    est = estimate.estimate_distinct(1000, [1] * 100)
+    self.assertGreater(est, 900)
+    self.assertLessEqual(est, 1000)
+
+
+  def test_distinct_saturated(self):
+    # every key was seen many times: nothing more to find
+    self.assertEqual(estimate.estimate_distinct(10000, [100] * 10), 10)
+
+
+  def test_dry_run(self):
+    tmp_name = str(uuid.uuid4().hex) + '.csv'
+    try:
+      with open(tmp_name, 'w') as fout:
+        print('user,item', file=fout)
+        for i in range(20000):
+          print('u{},i{}'.format(i % 50, i % 7), file=fout)
+
+      config = tensor_config(csv_names=[tmp_name], tensor_name='unused.tns')
+      config.add_mode('user')
+      config.add_mode('item')
+      est = estimate.estimate_tensor(config, fraction=1.0)
+
+      self.assertEqual(est['rows'], 20000)
+      self.assertEqual(list(est['dims'].values()), [50, 7])
+      self.assertEqual(est['nnz_before_merge'], 20000)
+      self.assertEqual(est['nnz_after_merge'], 350)
+      self.assertGreater(est['tns_bytes'], 0)
+      self.assertFalse(os.path.exists('unused.tns'))
+
+      # a sample reads only part of the file
+      est = estimate.estimate_tensor(config, fraction=0.5)
+      self.assertLess(est['sampled_rows'], 20000)
+      self.assertGreater(est['rows'], 10000)
+      self.assertLess(est['rows'], 30000)
+    finally:
+      os.remove(tmp_name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 
 import unittest
+import os
+import tempfile
+from contextlib import redirect_stderr
+from io import StringIO
 
 import tests
-from tensor_parser.index_map import index_map
+from tensor_parser.index_map import index_map, batch_type, batch_roundf, \
+    epoch_bucket
 
 class TestCSVParser(unittest.TestCase):
 
@@ -35,6 +40,22 @@ class TestCSVParser(unittest.TestCase):
     self.assertEqual(imap['0'], 3)
 
 
+  def test_sort_count(self):
+    imap = index_map(sort=index_map.SORT_COUNT)
+    imap.add('banana')
+    imap.add('apple')
+    imap.add('cherry')
+    imap.add('cherry')
+    imap.add('apple')
+    imap.add('cherry')
+
+    imap.build_map()
+
+    self.assertEqual(imap['cherry'], 1)
+    self.assertEqual(imap['apple'], 2)
+    self.assertEqual(imap['banana'], 3)
+
+
   def test_sort_lex(self):
     imap = index_map()
     imap.add('banana')
@@ -131,6 +152,146 @@ class TestCSVParser(unittest.TestCase):
     self.assertEqual(imap['10:00PM'], 2)
 
 
+  def test_epoch(self):
+    imap = index_map(type_func=index_map.TYPE_EPOCH)
+    imap.add('1600000000')
+    imap.add('0')
+    imap.add('1600000000.75')
+
+    imap.build_map()
+    self.assertEqual(imap['0'], 1)
+    self.assertEqual(imap['1600000000'], 2)
+    self.assertEqual(imap.get_count('1600000000'), 2)
+    self.assertEqual(str(index_map.TYPE_EPOCH('1600000000')),
+        '2020-09-13 12:26:40')
+    self.assertEqual(str(index_map.TYPE_EPOCH('-1')), '1969-12-31 23:59:59')
+
+
+  def test_epoch_ms(self):
+    imap = index_map(type_func=index_map.TYPE_EPOCH_MS)
+    keys = imap.add_batch(['1600000000123', '5'])
+    self.assertEqual(keys, [1600000000123, 5])
+    self.assertEqual([str(k) for k in keys],
+        ['2020-09-13 12:26:40.123', '1970-01-01 00:00:00.005'])
+
+
+  def test_epoch_range(self):
+    # times past year 9999 cannot be printed, so they are skipped
+    for type_func, big in [(index_map.TYPE_EPOCH, '253402300800'),
+        (index_map.TYPE_EPOCH_MS, '99999999999999999999')]:
+      imap = index_map(type_func=type_func)
+      with redirect_stderr(StringIO()):
+        keys = imap.add_batch(['0', big, '-1e20'])
+        self.assertIsNone(imap.add(big))
+      self.assertEqual(keys, [0, None, None])
+      self.assertEqual(imap.skipped, {big, '-1e20'})
+
+      imap.build_map()
+      with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, 'time.map')
+        imap.write_file(fname)
+        with open(fname) as fin:
+          self.assertTrue(fin.read().startswith('1970-01-01 00:00:00'))
+    self.assertEqual(str(index_map.TYPE_EPOCH('253402300799')),
+        '9999-12-31 23:59:59')
+
+
+  def test_epoch_bucket(self):
+    hour = epoch_bucket(3600)
+    imap = index_map(type_func=hour)
+    with redirect_stderr(StringIO()):
+      keys = imap.add_batch(['7200', '7300', '3599', 'x'])
+    self.assertEqual(keys, [7200, 7200, 0, None])
+    self.assertEqual(str(hour('1600001234')), '2020-09-13 12:00:00')
+    self.assertEqual(hour('1600001234'), hour.batch(['1600001234'])[0][0])
+    self.assertRaises(ValueError, epoch_bucket, 0)
+
+    imap.build_map()
+    self.assertEqual(imap['10'], 1)
+    self.assertEqual(imap['7201'], 2)
+
+
+  def test_dow(self):
+    imap = index_map(type_func=index_map.TYPE_DOW)
+    # a Sunday, Thursday 1970-01-01, and a Monday
+    imap.add_batch(['1600000000', '0', '1600041600'])
+
+    imap.build_map()
+    with tempfile.TemporaryDirectory() as tmp:
+      fname = os.path.join(tmp, 'dow.map')
+      imap.write_file(fname)
+      with open(fname) as fin:
+        self.assertEqual(fin.read().split(), ['Mon', 'Thu', 'Sun'])
+
+
+  def test_add_batch(self):
+    keys = ['3', '1', 'x', '3', '2', 'x']
+    imap = index_map(type_func=index_map.TYPE_INT, sort=False)
+    with redirect_stderr(StringIO()):
+      newkeys = imap.add_batch(keys)
+    self.assertEqual(newkeys, [3, 1, None, 3, 2, None])
+    self.assertEqual(list(imap.get_counts().items()), [(3, 2), (1, 1), (2, 1)])
+    self.assertEqual(imap.skipped, {'x'})
+
+    # same keys, counts, and order as adding one at a time
+    single = index_map(type_func=index_map.TYPE_INT, sort=False)
+    with redirect_stderr(StringIO()):
+      for key in keys:
+        single.add(key)
+    self.assertEqual(list(single.get_counts().items()),
+        list(imap.get_counts().items()))
+
+    imap.build_map()
+    self.assertEqual(imap.get_batch(['2', 'x', '3', '7']), [3, None, 1, None])
+
+
+  def test_batch_roundf(self):
+    imap = index_map(type_func=lambda x: round(float(x), 1))
+    imap.add_batch(['1.38', '1.41', '2.0'])
+    self.assertEqual(dict(imap.get_counts()), {1.4 : 2, 2.0 : 1})
+    self.assertEqual(batch_roundf(1, ['1.38', 'y', '2.04']),
+        ([1.4, None, 2.0], [False, True, False]))
+
+
+  def test_batch_type(self):
+    calls = []
+    def parse_ints(keys):
+      calls.append(len(keys))
+      newkeys = [int(k) if k.isdigit() else -1 for k in keys]
+      return newkeys, [k == -1 for k in newkeys]
+
+    imap = index_map(type_func=batch_type(parse_ints))
+    with redirect_stderr(StringIO()):
+      self.assertEqual(imap.add_batch(['10', 'a', '2']), [10, None, 2])
+    self.assertEqual(calls, [3])
+    self.assertEqual(imap.skipped, {'a'})
+
+    # single keys go through the batch function as well
+    imap.build_map()
+    self.assertEqual(imap['2'], 1)
+    self.assertEqual(imap['10'], 2)
+    self.assertEqual(imap['a'], None)
+
+
+  def test_batch_numpy(self):
+    try:
+      import numpy as np
+    except ImportError:
+      self.skipTest('numpy is not installed')
+
+    def parse_ints(keys):
+      arr = np.char.isdigit(np.array(keys))
+      vals = np.where(arr, np.array(keys), '0').astype(np.int64)
+      return vals, ~arr
+
+    imap = index_map(type_func=batch_type(parse_ints))
+    with redirect_stderr(StringIO()):
+      newkeys = imap.add_batch(['5', 'b', '5'])
+    self.assertEqual(newkeys, [5, None, 5])
+    self.assertIs(type(newkeys[0]), int)
+    self.assertEqual(dict(imap.get_counts()), {5 : 2})
+
+
 
 if __name__ == '__main__':
     unittest.main()
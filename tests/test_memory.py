@@ -0,0 +1,115 @@
+
+import unittest
+
+import os
+import tempfile
+from contextlib import redirect_stderr
+
+import tests
+from tensor_parser import builder
+from tensor_parser.memory import memory_budget, parse_size, format_size
+from tensor_parser.prune import kcore_pruner
+from tensor_parser.tensor_config import tensor_config
+
+class TestMemory(unittest.TestCase):
+
+  def test_parse_size(self):
+    self.assertEqual(parse_size('1024'), 1024)
+    self.assertEqual(parse_size('2K'), 2048)
+    self.assertEqual(parse_size('1.5m'), 3 << 19)
+    self.assertEqual(parse_size('4GB'), 4 << 30)
+    self.assertEqual(parse_size(' 1GiB '), 1 << 30)
+    for text in ['', 'lots', '-1G', '1X']:
+      with self.assertRaises(ValueError):
+        parse_size(text)
+    self.assertEqual(format_size(512), '512 B')
+    self.assertEqual(format_size(3 << 19), '1.5 MB')
+
+
+  def test_budget(self):
+    budget = memory_budget(1000, verbose=False)
+    budget.update('a', 600)
+    self.assertEqual(budget.available('b'), 400)
+    self.assertEqual(budget.available('a'), 1000)
+    self.assertEqual(budget.grant('b', 1000, minimum=100), 400)
+    self.assertFalse(budget.over())
+    self.assertEqual(budget.grant('c', 1000, minimum=100), 100)
+    self.assertTrue(budget.over())
+    budget.decide('c', 'shrunk', 'detail')
+    budget.release('c')
+    self.assertEqual(budget.used(), 1000)
+
+    report = budget.to_dict()
+    self.assertEqual(report['limit'], 1000)
+    self.assertEqual(report['peak'], 1100)
+    self.assertEqual(report['components'], {'a' : 600, 'b' : 400, 'c' : 0})
+    self.assertEqual([d['action'] for d in report['decisions']], ['shrunk'])
+
+    unlimited = memory_budget()
+    self.assertIsNone(unlimited.available())
+    self.assertEqual(unlimited.grant('a', 1 << 40), 1 << 40)
+    self.assertFalse(unlimited.over())
+
+
+  def test_pruner_spill(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      p = kcore_pruner(2, 2)
+      p.add_row(['a', 'x'])
+      p.add_row(['a', 'x'])
+      self.assertGreater(p.memory_usage(), 0)
+      p.spill(tmp_dir)
+      self.assertTrue(p.is_spilled())
+      p.add_row(['b', 'x'])
+      p.add_row(['b', 'y'])
+      p.add_row(['c', 'y'])
+      self.assertEqual(p.prune(), 3)
+      self.assertEqual(p.counts(0), {'a' : 2})
+      self.assertEqual(p.counts(1), {'x' : 2})
+
+
+  def _build(self, limit):
+    config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+    config.add_mode('user')
+    config.add_mode('item')
+    config.set_vals('val')
+    config.set_min_count(2)
+    config.set_merge_func(sum)
+    config.set_mode_order(['item', 'user'])
+    config.set_memory_limit(limit)
+    with open(os.devnull, 'w') as redirect:
+      with redirect_stderr(redirect):
+        stats = builder.build_tensor(config)
+    with open('out.tns') as fin:
+      return stats, fin.read()
+
+
+  def test_build_limit(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          for i in range(500):
+            print('u{},i{},{}'.format(i % 23, i % 19, i % 5), file=fout)
+
+        stats, expected = self._build(None)
+        self.assertIsNone(stats.memory['limit'])
+        self.assertEqual(stats.memory['decisions'], [])
+
+        stats, output = self._build(1024)
+        self.assertEqual(output, expected)
+        actions = [(d['component'], d['action'])
+            for d in stats.to_dict()['memory']['decisions']]
+        self.assertIn(('pruner', 'spilled rows to disk'), actions)
+        self.assertIn(('sort', 'smaller sort splits'), actions)
+        self.assertIn(('writer', 'smaller output buffer'), actions)
+
+        with self.assertRaises(ValueError):
+          tensor_config().set_memory_limit(0)
+      finally:
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+
+import unittest
+
+import os, sys
+sys.path.append(os.path.abspath('..'))
+
+import tests
+from tensor_parser.pipeline import pipeline
+
+class TestPipeline(unittest.TestCase):
+
+  def test_stages(self):
+    out = []
+    def collect(items):
+      for x in items:
+        out.append(x)
+        yield x
+
+    pipe = pipeline(depth=2)
+    pipe.add_stage('source', lambda _: iter(range(100)))
+    pipe.add_stage('square', lambda items: (x * x for x in items))
+    pipe.add_stage('sink', collect)
+    pipe.run()
+
+    self.assertEqual(out, [x * x for x in range(100)])
+    self.assertEqual(list(pipe.stats.keys()), ['source', 'square', 'sink'])
+    for record in pipe.stats.values():
+      self.assertEqual(record['items'], 100)
+      self.assertLessEqual(record['utilization'], 1.)
+
+
+  def test_error(self):
+    def fail(items):
+      for x in items:
+        if x == 10:
+          raise KeyError(x)
+        yield x
+
+    pipe = pipeline(depth=1)
+    pipe.add_stage('source', lambda _: iter(range(1000000)))
+    pipe.add_stage('fail', fail)
+    pipe.add_stage('sink', lambda items: items)
+    with self.assertRaises(KeyError):
+      pipe.run()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,31 @@
+
+
+import unittest
+import io
+
+import tests
+from tensor_parser.progress import progress_reporter
+
+class TestProgress(unittest.TestCase):
+
+  def test_format(self):
+    line = progress_reporter.format('emit', 2, 4, 50000000, 100000000,
+        1000000, 10.)
+    self.assertEqual(line, '[emit] file 2/4 | 50.0% | 5.0 MB/s | '
+        '100000 rows/s | ETA 0:00:10')
+
+
+  def test_throttle(self):
+    out = io.StringIO()
+    report = progress_reporter(interval=3600., stream=out)
+    report('count', 1, 2, 10, 100, 5)
+    report('count', 1, 2, 20, 100, 10)
+    self.assertEqual(out.getvalue(), '')
+
+    # always report the end of a phase
+    report('count', 2, 2, 100, 100, 50)
+    self.assertEqual(len(out.getvalue().splitlines()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
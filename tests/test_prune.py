@@ -0,0 +1,52 @@
+
+
+import unittest
+import tempfile
+
+import tests
+from tensor_parser.prune import kcore_pruner
+
+class TestPrune(unittest.TestCase):
+
+  def _cascade(self, spill_dir=None):
+    p = kcore_pruner(2, 2, spill_dir)
+    # 'c' appears once and is removed, which leaves 'y' with a single row,
+    # which then removes 'b' down to one row...
+    p.add_row(['a', 'x'])
+    p.add_row(['a', 'x'])
+    p.add_row(['b', 'x'])
+    p.add_row(['b', 'y'])
+    p.add_row(['c', 'y'])
+    self.assertEqual(p.prune(), 3)
+    self.assertEqual(p.counts(0), {'a' : 2})
+    self.assertEqual(p.counts(1), {'x' : 2})
+
+
+  def test_cascade(self):
+    self._cascade()
+
+
+  def test_spill(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      self._cascade(tmp_dir)
+
+
+  def test_invalid(self):
+    p = kcore_pruner(2, 1)
+    p.add_row(['a', 'x'])
+    p.add_row(['b', None])
+    self.assertEqual(p.prune(), 1)
+    self.assertEqual(p.counts(0), {'a' : 1})
+    self.assertEqual(p.counts(1), {'x' : 1})
+
+
+  def test_stable(self):
+    p = kcore_pruner(3, 1)
+    p.add_row([1, 2, 3])
+    p.add_row([1, 2, 4])
+    self.assertEqual(p.prune(), 0)
+    self.assertEqual(p.counts(2), {3 : 1, 4 : 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
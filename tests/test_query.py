@@ -0,0 +1,42 @@
+
+
+import unittest
+
+import os
+import uuid
+
+import tests
+from tensor_parser.query import scan_columns
+
+class TestQuery(unittest.TestCase):
+
+  def test_scan(self):
+    tmp_name = str(uuid.uuid4().hex) + '.csv'
+    try:
+      # make csv
+      with open(tmp_name, 'w') as fout:
+        print('user,item,when', file=fout)
+        print('u1,1,2017-01-01', file=fout)
+        print('u2,2,2017-01-02', file=fout)
+        print('u1,1,2017-01-01', file=fout)
+        print('u1,3.5,2017-01-03', file=fout)
+
+      res = scan_columns(tmp_name, fields=['user', 'item'])
+      self.assertEqual(res['rows'], 4)
+      user, item, when = res['columns']
+      self.assertEqual(user['distinct'], 2)
+      self.assertEqual(user['top'][0][:2], ('u1', 3))
+      self.assertEqual(item['int'], 0.75)
+      self.assertEqual(item['float'], 1.0)
+      self.assertEqual(when['date'], 1.0)
+
+      self.assertEqual(res['tensor']['dims'], [2, 3])
+      self.assertEqual(res['tensor']['nnz_before_merge'], 4)
+      self.assertEqual(res['tensor']['nnz_after_merge'], 3)
+      self.assertGreater(res['tensor']['index_map_bytes'], 0)
+    finally:
+      os.remove(tmp_name)
+
+
+if __name__ == '__main__':
+    unittest.main()
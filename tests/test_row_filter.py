@@ -0,0 +1,62 @@
+
+
+import unittest
+
+import tests
+from tensor_parser.index_map import index_map
+from tensor_parser.tensor_config import tensor_config
+from tensor_parser.row_filter import compile_filters
+
+class TestRowFilter(unittest.TestCase):
+
+  def test_none(self):
+    config = tensor_config()
+    self.assertEqual(compile_filters(config, ['a', 'b']), None)
+
+
+  def test_eq_in(self):
+    config = tensor_config()
+    config.add_mode('a')
+    config.add_filter('A', tensor_config.FILTER_IN, ['x', 'y'])
+    config.add_filter('b', tensor_config.FILTER_EQ, 'keep')
+    accept = compile_filters(config, ['a', 'b'])
+
+    self.assertTrue(accept(['x', 'keep']))
+    self.assertTrue(accept(['y', 'keep']))
+    self.assertFalse(accept(['z', 'keep']))
+    self.assertFalse(accept(['x', 'drop']))
+
+
+  def test_typed(self):
+    config = tensor_config()
+    config.add_mode('n', transform=index_map.TYPE_INT)
+    config.add_filter('n', tensor_config.FILTER_EQ, '7')
+    accept = compile_filters(config, ['n'])
+    self.assertTrue(accept(['007']))
+    self.assertFalse(accept(['8']))
+    self.assertFalse(accept(['seven']))
+
+
+  def test_range(self):
+    config = tensor_config()
+    config.add_mode('n', transform=index_map.TYPE_FLOAT)
+    config.add_filter('n', tensor_config.FILTER_RANGE, ('1.5', None))
+    config.add_filter('d', tensor_config.FILTER_RANGE, (None, '2017-01-31'))
+    accept = compile_filters(config, ['n', 'd'])
+    self.assertTrue(accept(['10', '2017-01-01']))
+    self.assertFalse(accept(['1.4', '2017-01-01']))
+    self.assertFalse(accept(['10', '2017-02-01']))
+
+
+  def test_date_range(self):
+    config = tensor_config()
+    config.add_mode('d', transform=index_map.TYPE_DATE)
+    config.add_filter('d', tensor_config.FILTER_RANGE, ('Jan 1 2017',
+        '2017-01-31'))
+    accept = compile_filters(config, ['d'])
+    self.assertTrue(accept(['01/15/2017']))
+    self.assertFalse(accept(['02/01/2017']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+
+import unittest
+
+import tests
+from tensor_parser.sample import row_sampler
+
+class TestSample(unittest.TestCase):
+
+  def _sample(self, sampler, rows):
+    sampled = list(sampler.sample(rows))
+    return sampled + sampler.finish()
+
+
+  def test_bernoulli(self):
+    rows = list(range(10000))
+    sampled = self._sample(row_sampler(rate=0.1, seed=1), rows)
+    self.assertTrue(800 < len(sampled) < 1200)
+    self.assertEqual(sampled, sorted(sampled))
+
+    # reproducible with the same seed
+    self.assertEqual(self._sample(row_sampler(rate=0.1, seed=1), rows),
+        sampled)
+    self.assertNotEqual(self._sample(row_sampler(rate=0.1, seed=2), rows),
+        sampled)
+    self.assertEqual(self._sample(row_sampler(rate=1.0), rows), rows)
+
+
+  def test_reservoir(self):
+    rows = list(range(1000))
+    sampler = row_sampler(size=50, seed=3)
+    # nothing is known until all rows were seen
+    self.assertEqual(list(sampler.sample(rows)), [])
+    sampled = sampler.finish()
+    self.assertEqual(len(sampled), 50)
+    self.assertEqual(len(set(sampled)), 50)
+    self.assertEqual(sampled, sorted(sampled))
+    self.assertEqual(sampler.num_seen, 1000)
+    self.assertEqual(sampler.num_sampled, 50)
+
+    # fewer rows than the sample size
+    self.assertEqual(self._sample(row_sampler(size=50), rows[:10]), rows[:10])
+
+
+  def test_stratified(self):
+    # one row of key 'rare' among many of key 'common'
+    rows = [('common', i) for i in range(2000)]
+    rows.insert(1234, ('rare', -1))
+    stratify = lambda row: row[0]
+
+    sampled = self._sample(row_sampler(size=20, seed=0, stratify=stratify),
+        rows)
+    self.assertEqual(len(sampled), 20)
+    self.assertIn(('rare', -1), sampled)
+
+    sampled = self._sample(row_sampler(rate=0.01, seed=0, stratify=stratify),
+        rows)
+    self.assertIn(('rare', -1), sampled)
+    self.assertEqual(len(sampled), len(set(sampled)))
+
+
+  def test_invalid(self):
+    self.assertRaises(ValueError, row_sampler)
+    self.assertRaises(ValueError, row_sampler, rate=0.5, size=10)
+    self.assertRaises(ValueError, row_sampler, rate=1.5)
+    self.assertRaises(ValueError, row_sampler, size=0)
+
+
+if __name__ == '__main__':
+  unittest.main()
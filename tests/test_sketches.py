@@ -0,0 +1,53 @@
+
+
+import unittest
+
+import tests
+from tensor_parser.sketches import hyperloglog, space_saving
+
+class TestSketches(unittest.TestCase):
+
+  def test_hll_small(self):
+    hll = hyperloglog()
+    for x in ['apple', 'banana', 'apple', 'cherry']:
+      hll.add(x)
+    self.assertEqual(hll.estimate(), 3)
+
+
+  def test_hll_large(self):
+    hll = hyperloglog(precision=12)
+    N = 50000
+    for i in range(N):
+      hll.add(str(i))
+      hll.add(str(i))
+    # ~1.6% standard error
+    self.assertLess(abs(hll.estimate() - N) / N, 0.1)
+
+
+  def test_hll_merge(self):
+    a = hyperloglog()
+    b = hyperloglog()
+    for i in range(100):
+      a.add(str(i))
+      b.add(str(i + 50))
+    a.merge(b)
+    self.assertLess(abs(a.estimate() - 150), 5)
+
+
+  def test_space_saving(self):
+    ss = space_saving(capacity=10)
+    for i in range(1000):
+      ss.add('hot')
+      ss.add(str(i))
+      if i % 3 == 0:
+        ss.add('warm')
+
+    top = ss.top(2)
+    self.assertEqual(top[0][0], 'hot')
+    self.assertGreaterEqual(top[0][1], 1000)
+    self.assertEqual(top[1][0], 'warm')
+    self.assertLessEqual(top[1][1] - top[1][2], 334)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+
+import os
+import tempfile
+from collections import Counter
+
+import tests
+from tensor_parser import builder
+from tensor_parser.slices import slice_counts, read_slices, \
+    balanced_partition
+from tensor_parser.tensor_config import tensor_config
+
+class TestSlices(unittest.TestCase):
+
+  def _max_part(self, counts, bounds):
+    return max(sum(counts[bounds[p]:bounds[p+1]])
+        for p in range(len(bounds) - 1))
+
+
+  def test_balanced_partition(self):
+    counts = [5, 1, 1, 1, 5, 1, 1, 1, 5]
+    bounds = balanced_partition(counts, 3)
+    self.assertEqual(bounds, [0, 3, 6, 9])
+    self.assertEqual(self._max_part(counts, bounds), 7)
+
+    # optimal against all two-way cuts
+    counts = [3, 9, 1, 1, 7, 2, 8, 4]
+    bounds = balanced_partition(counts, 2)
+    best = min(max(sum(counts[:c]), sum(counts[c:]))
+        for c in range(len(counts) + 1))
+    self.assertEqual(self._max_part(counts, bounds), best)
+
+    # more parts than slices, and empty slices
+    self.assertEqual(balanced_partition([4, 0, 2], 5)[-1], 3)
+    self.assertEqual(balanced_partition([0, 0], 2), [0, 2, 2])
+    self.assertEqual(balanced_partition([], 2), [0, 0, 0])
+    self.assertRaises(ValueError, balanced_partition, [1], 0)
+
+
+  def test_roundtrip(self):
+    slices = slice_counts([3, 2])
+    for inds in [[1, 1], [1, 2], ['3', '2'], [1, 1]]:
+      slices.add(inds)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      fname = os.path.join(tmp_dir, 'out.slices')
+      slices.write(fname, parts=2)
+      data = read_slices(fname)
+      self.assertEqual(data['dims'], [3, 2])
+      self.assertEqual([list(c) for c in data['counts']], [[3, 0, 1], [2, 2]])
+      self.assertEqual(data['bounds'], [[0, 2, 3], [0, 1, 2]])
+
+      with open(fname, 'wb') as fout:
+        fout.write(b'nope')
+      self.assertRaises(ValueError, read_slices, fname)
+
+
+  def test_build(self):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      os.chdir(tmp_dir)
+      try:
+        with open('in.csv', 'w') as fout:
+          print('user,item,val', file=fout)
+          for i in range(300):
+            print('u{},i{},1'.format(i % 13, (i * i) % 17), file=fout)
+
+        # merged, unmerged, pipelined, and checkpointed builds
+        settings = [
+          {'merge' : tensor_config.MERGE_SUM},
+          {'merge' : tensor_config.MERGE_NONE},
+          {'merge' : tensor_config.MERGE_NONE, 'pipeline' : 2},
+          {'merge' : tensor_config.MERGE_SUM, 'checkpoint' : 'ckpt'},
+        ]
+        for setting in settings:
+          config = tensor_config(csv_names=['in.csv'], tensor_name='out.tns')
+          config.add_mode('user')
+          config.add_mode('item')
+          config.set_vals('val')
+          config.set_merge_func(setting['merge'])
+          config.set_pipeline(setting.get('pipeline'))
+          config.set_checkpoint(setting.get('checkpoint'))
+          config.set_slices('out.slices', parts=3)
+          stats = builder.build_tensor(config)
+
+          with open('out.tns', 'r') as fin:
+            lines = [l.split() for l in fin]
+          self.assertEqual(len(lines), stats.nnz)
+          data = read_slices('out.slices')
+          self.assertEqual(data['dims'], [13, 9]) # squares mod 17
+          for m in range(2):
+            expect = Counter(int(l[m]) - 1 for l in lines)
+            self.assertEqual(list(data['counts'][m]),
+                [expect[i] for i in range(data['dims'][m])])
+            self.assertEqual(data['bounds'][m],
+                balanced_partition(data['counts'][m], 3))
+          self.assertIn('slices', stats.phases)
+      finally:
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+  unittest.main()
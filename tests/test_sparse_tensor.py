@@ -0,0 +1,78 @@
+
+import unittest
+
+import os, sys
+import uuid
+sys.path.append(os.path.abspath('..'))
+
+import tests
+from tensor_parser.sparse_tensor import sparse_tensor
+
+class TestSparseTensor(unittest.TestCase):
+
+  def _tensor(self):
+    return sparse_tensor([[1, 0, 1], [2, 0, 2]], [1., 2.5, 3.], [2, 3])
+
+  def test_merge_dups(self):
+    tensor = self._tensor()
+    self.assertEqual(tensor.merge_dups(), 2)
+    self.assertEqual(list(tensor.inds[0]), [0, 1])
+    self.assertEqual(list(tensor.inds[1]), [0, 2])
+    self.assertEqual(list(tensor.vals), [2.5, 4.])
+
+    tensor = self._tensor()
+    tensor.merge_dups(max)
+    self.assertEqual(list(tensor.vals), [2.5, 3.])
+
+
+  def test_sort(self):
+    tensor = sparse_tensor([[0, 1, 2], [2, 1, 0]], [1., 2., 3.], [3, 3])
+    tensor.sort([1, 0])
+    self.assertEqual(list(tensor.inds[0]), [2, 1, 0])
+    self.assertEqual(list(tensor.vals), [3., 2., 1.])
+
+
+  def test_to_tns(self):
+    tmp_name = str(uuid.uuid4().hex) + '.tns'
+    try:
+      tensor = self._tensor()
+      tensor.merge_dups()
+      tensor.to_tns(tmp_name)
+      with open(tmp_name, 'r') as fin:
+        lines = [l.strip() for l in fin.readlines()]
+      self.assertEqual(lines, ['1 1 2.5', '2 3 4'])
+    finally:
+      os.remove(tmp_name)
+
+
+  def test_to_npz(self):
+    try:
+      import numpy as np
+    except ImportError:
+      self.skipTest('numpy is not installed')
+    tmp_name = str(uuid.uuid4().hex) + '.npz'
+    try:
+      self._tensor().to_npz(tmp_name)
+      data = np.load(tmp_name)
+      self.assertEqual(data['inds'].tolist(), [[1, 2], [0, 0], [1, 2]])
+      self.assertEqual(data['vals'].tolist(), [1., 2.5, 3.])
+      self.assertEqual(data['dims'].tolist(), [2, 3])
+    finally:
+      os.remove(tmp_name)
+
+
+  def test_to_scipy_coo(self):
+    try:
+      import scipy
+    except ImportError:
+      self.skipTest('scipy is not installed')
+    mat = self._tensor().to_scipy_coo()
+    self.assertEqual(mat.shape, (2, 3))
+    self.assertEqual(mat.toarray().tolist(), [[2.5, 0, 0], [0, 0, 4.]])
+
+    with self.assertRaises(ValueError):
+      sparse_tensor([[0], [0], [0]], [1.], [1, 1, 1]).to_scipy_coo()
+
+
+if __name__ == '__main__':
+  unittest.main()
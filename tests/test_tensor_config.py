@@ -53,6 +53,21 @@ class TestTensorConfig(unittest.TestCase):
     m = config.get_mode_by_idx(0)
     self.assertEqual(m['sort'], False)
 
+  def test_set_mode_order(self):
+    config = tensor_config()
+    config.add_mode('one')
+    config.add_mode('two')
+    config.add_mode('three')
+    self.assertEqual(config.get_mode_order(), None)
+
+    config.set_mode_order(['Three', 'one', 'two'])
+    self.assertEqual(config.get_mode_order(), [2, 0, 1])
+
+    with self.assertRaises(IndexError):
+      config.set_mode_order(['four', 'one', 'two'])
+    with self.assertRaises(ValueError):
+      config.set_mode_order(['one', 'one', 'two'])
+
 
 if __name__ == '__main__':
     unittest.main()